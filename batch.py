@@ -0,0 +1,221 @@
+#!/usr/bin/python
+"""Download and filter many GSE studies in a pool of worker processes.
+
+Runs script.write_gse for each GSE ID listed in a file, one study per task,
+in long-lived worker processes. Workers share one download cache and one
+GPL cache in CACHE_DIR: before workers start, the briefs, FTP listings and
+GPL data tables of all studies are downloaded once, so that workers do not
+download the same platform concurrently. Each worker keeps recently used
+parsed platforms in memory between its studies.
+
+Writes a JSON manifest of per-study status, timings and row counts, which
+is rewritten as each study completes. Stage timings of each study (see
+metrics) are in its manifest entry and in "logs/GSE_ID.metrics.json".
+
+SAMPLE USE:
+$ python batch.py gse_ids.txt out_dir=out processes=8 2> batch_log.txt
+"""
+from __future__ import print_function
+USE_MSG = """USE: python batch.py GSE_ID_FILE [options]
+
+GSE_ID_FILE: text file of one GSE ID per line; "#" starts a comment
+
+OPTIONS:
+  out_dir=str: path to output directory where to save filtered studies
+  processes=int: number of worker processes [default=number of CPUs]
+  manifest=str: path of JSON manifest [default=out_dir/manifest.json]
+  prefetch=int: concurrent downloads before workers start, 0 to disable [default=8]
+  merge_cols: bool (0 or 1) if to merge same-source columns [default=True]
+  percentile: floot 0 < x <= 1 of percentile by std to keep [default=.75]
+  engine: str of EQTLFilter row engine, "python" or "numpy" [default=python]
+  spill: bool (0 or 1) if to spill rows to TMP_DIR rather than re-read them [default=True]
+  read_threads: int of threads to decompress block-compressed cache files ahead [default=1]
+"""
+
+import sys
+import os
+import time
+import json
+import traceback
+import multiprocessing
+
+# Use the local directory environment if none is configured, as script.py.
+if ("ENV" not in os.environ) and ("CACHE_DIR" not in os.environ) and \
+  ("TMP_DIR" not in os.environ):
+  print("Warning: geo_api environment is not configured. Using local directory...")
+  os.environ["ENV"] = "LOCAL"
+  os.environ["CACHE_DIR"] = ""
+  os.environ["TMP_DIR"] = ""
+
+from __init__ import *
+from prefetch import Prefetcher
+from script import write_gse, study_filename
+import metrics as stage_metrics
+
+
+def read_gse_ids(filepath):
+  """Return [str] of unique GSE IDs in file order, ignoring comments."""
+  gse_ids = []
+  seen = set()
+  for line in open(filepath):
+    gse_id = line.split("#")[0].strip()
+    if gse_id and gse_id not in seen:
+      seen.add(gse_id)
+      gse_ids.append(gse_id)
+  return gse_ids
+
+
+def run_study(task):
+  """Worker task: write filtered matrices of one GSE study.
+
+  Args:
+    task: (str, str, {str: obj}) of (gse_id, out_dir, write_gse options)
+  Returns:
+    {str: obj} of manifest entry of this study
+  """
+  gse_id, out_dir, options = task
+  entry = {
+    'gse_id': gse_id,
+    'status': "ok",
+    'error': None,
+    'pid': os.getpid(),
+    'started': time.strftime("%Y-%m-%d %H:%M:%S"),
+    'studies': [],
+  }
+  t = time.time()
+  fp_log = open(os.path.join(out_dir, "logs", "%s.log.txt" % gse_id), "w")
+  stage_metrics.start(gse_id)
+  try:
+    g = GSE(gse_id)
+    for gse, n_rows in write_gse(g, fp_log, out_dir, **options):
+      entry['studies'].append({
+        'id': gse.id,
+        'platform_id': gse.platform.id,
+        'type': gse.type,
+        'file': study_filename(gse),
+        'rows': n_rows,
+      })
+  except Exception as e:
+    entry['status'] = "error"
+    entry['error'] = "%s: %s" % (e.__class__.__name__, e)
+    fp_log.write(traceback.format_exc())
+  m = stage_metrics.stop()
+  m.write(os.path.join(out_dir, "logs", "%s.metrics.json" % gse_id))
+  for line in m.summary():
+    fp_log.write(line + "\n")
+  entry['metrics'] = m.to_dict()
+  fp_log.close()
+  entry['seconds'] = round(time.time() - t, 3)
+  entry['rows'] = sum([x['rows'] for x in entry['studies']])
+  return entry
+
+
+def write_manifest(filepath, manifest):
+  """Write JSON `manifest` to `filepath` by replacing any previous file."""
+  tmp_filepath = filepath + ".tmp"
+  fp = open(tmp_filepath, "w")
+  json.dump(manifest, fp, indent=1, sort_keys=True)
+  fp.close()
+  os.rename(tmp_filepath, filepath)
+
+
+def main(gse_id_file, out_dir="", processes=None, manifest=None, prefetch=8,
+         merge_cols=True, percentile=.75, engine="python", spill=True,
+         read_threads=1):
+  """Batch script routine.
+
+  Args:
+    gse_id_file: str of path to file of GSE IDs
+    out_dir: str of path where to save filtered studies, logs and manifest
+    processes: int of number of worker processes or None for number of CPUs
+    manifest: str of path to JSON manifest or None for out_dir/manifest.json
+    prefetch: int of concurrent downloads before workers start, or 0
+    merge_cols: bool if to merge columns from same patient
+    percentile: float of top percentile to keep by standard deviation
+    engine: str of EQTLFilter row engine in filter.ENGINES
+    spill: bool if to spill filtered rows to a temporary file
+    read_threads: int of threads to decompress block-compressed cache files
+  Returns:
+    {str: obj} of manifest
+  """
+  if type(percentile) == str:
+    percentile = float(percentile)
+  assert percentile > 0 and percentile <= 1
+  if type(merge_cols) == str:
+    merge_cols = not merge_cols.lower() in ('0', 0, False, "", 'false','f', None)
+  if type(spill) == str:
+    spill = not spill.lower() in ('0', 0, False, "", 'false','f', None)
+  if processes is not None:
+    processes = int(processes)
+  prefetch = int(prefetch)
+  options = {'merge_cols': merge_cols, 'percentile': percentile,
+             'engine': engine, 'spill': spill, 'read_threads': int(read_threads)}
+
+  if not os.path.isdir(os.path.join(out_dir, "logs")):
+    os.makedirs(os.path.join(out_dir, "logs"))
+  if manifest is None:
+    manifest = os.path.join(out_dir, "manifest.json")
+  gse_ids = read_gse_ids(gse_id_file)
+
+  doc = {
+    'version': VERSION,
+    'gse_id_file': gse_id_file,
+    'options': options,
+    'started': time.strftime("%Y-%m-%d %H:%M:%S"),
+    'seconds': None,
+    'n_studies': len(gse_ids),
+    'n_ok': 0,
+    'n_error': 0,
+    'studies': {},
+  }
+  t = time.time()
+
+  # 1. Download shared files once: briefs, listings and GPL data tables.
+  # ==========
+  if prefetch > 0:
+    prefetcher = Prefetcher(max_workers=prefetch)
+    gpl_ids = prefetcher.prefetch_studies(gse_ids)
+    prefetcher.fetch([GPL.PTN_GPL % {'id': x} for x in sorted(gpl_ids)])
+    doc['prefetch_seconds'] = round(time.time() - t, 3)
+
+  # 2. Run studies in worker processes. Update manifest as studies complete.
+  # ==========
+  pool = multiprocessing.Pool(processes)
+  try:
+    tasks = [(gse_id, out_dir, options) for gse_id in gse_ids]
+    for entry in pool.imap_unordered(run_study, tasks):
+      doc['studies'][entry['gse_id']] = entry
+      doc['n_%s' % entry['status']] += 1
+      doc['seconds'] = round(time.time() - t, 3)
+      write_manifest(manifest, doc)
+      print("%d/%d %s %s in %.1fs, %d rows" %
+        (len(doc['studies']), len(gse_ids), entry['gse_id'], entry['status'],
+         entry['seconds'], entry['rows']))
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+  doc['seconds'] = round(time.time() - t, 3)
+  write_manifest(manifest, doc)
+  print("Done: %d ok, %d errors of %d studies in %.1fs. Manifest: %s" %
+    (doc['n_ok'], doc['n_error'], len(gse_ids), doc['seconds'], manifest))
+  return doc
+
+
+if __name__ == "__main__":
+
+  if len(sys.argv) == 1 or sys.argv[1].lower().strip('-') in ("h", 'help'):
+    print(USE_MSG)
+    sys.exit(1)
+
+  try:
+    gse_id_file = sys.argv[1]
+    options = dict(map(lambda s: s.split('='), sys.argv[2:]))
+  except:
+    print(USE_MSG)
+    raise
+
+  main(gse_id_file, **options)
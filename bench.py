@@ -0,0 +1,252 @@
+#!/usr/bin/python
+"""Time hot paths of series matrix parsing on local files.
+
+SAMPLE USE:
+$ python bench.py split GSE15745-GPL6104_series_matrix.txt.gz
+$ python bench.py gunzip GSE15745-GPL6104_series_matrix.txt.gz
+$ python bench.py e2e fixtures probes=50000 samples=100 files=2 repeat=3
+"""
+from __future__ import print_function
+USE_MSG = """USE: python bench.py BENCHMARK path [path ...]
+       python bench.py e2e fixture_dir [options]
+
+BENCHMARKS:
+  split: split and merge data lines of series matrix files with csv.reader
+    and with GSE._merge_csv_row_lines; verify identical rows
+  gunzip: read lines of gzip files with gzip.GzipFile and with
+    gzstream.GzipStream; verify identical lines
+  e2e: time GSE populate, GPL parse, GSE get_rows and EQTLFilter get_rows
+    of a synthetic study served offline from fixture_dir; writes the study
+    with fixtures.py unless it exists with the same options
+
+E2E OPTIONS:
+  repeat=int: number of timed runs; the fastest is reported [default=3]
+  other options of fixtures.py: probes, samples, replicates, missing, files,
+    seed, gse_id, gpl_id
+"""
+
+import sys
+import os
+import csv
+import gzip
+import time
+import json
+import shutil
+import tempfile
+
+# Use the local directory environment if none is configured, as script.py.
+if ("ENV" not in os.environ) and ("CACHE_DIR" not in os.environ) and \
+  ("TMP_DIR" not in os.environ):
+  os.environ["ENV"] = "LOCAL"
+  os.environ["CACHE_DIR"] = ""
+  os.environ["TMP_DIR"] = ""
+
+from geo import GSE, GPL
+from headercache import HeaderCache
+from download import gzstream
+import download
+from download.fixture_download import FixtureDownload
+import fixtures
+import filter
+import metrics
+
+
+def csv_merge_row_lines(lines):
+  """Return merged row of `lines` each split by csv.reader."""
+  row_id = None
+  row = []
+  for line in lines:
+    s = next(csv.reader([line], delimiter="\t"))
+    if row_id is None:
+      row_id = s[0]
+      row.extend(s)
+    else:
+      assert s[0] == row_id
+      row.extend(s[1:])
+  return row
+
+
+def read_data_lines(filepath):
+  """Return [str] of lines of a series matrix data table, excluding headers."""
+  if filepath.endswith(".gz"):
+    fp = gzstream.open(filepath, "r")
+  else:
+    fp = download.as_text(open(filepath, "rb"))
+  lines = []
+  in_table = False
+  for line in fp:
+    if line.startswith("!series_matrix_table_begin"):
+      in_table = True
+      # Skip the column title line.
+      next(fp)
+    elif line.startswith("!series_matrix_table_end"):
+      break
+    elif in_table:
+      lines.append(line)
+  fp.close()
+  return lines
+
+
+def timed(f, line_sets):
+  """Return (seconds, [[str]] rows) of applying `f` to each set of lines."""
+  t = time.time()
+  rows = [f(lines) for lines in line_sets]
+  return time.time() - t, rows
+
+
+def bench_split(paths):
+  """Compare csv.reader and GSE line splitting on data lines of `paths`.
+
+  Data lines at the same position in each file are merged into one row,
+  as for a study in several series matrix files.
+  """
+  gse = GSE.__new__(GSE)
+  gse.id = "bench"
+  files = [read_data_lines(path) for path in paths]
+  line_sets = list(zip(*files))
+  n_bytes = sum([len(line) for lines in files for line in lines])
+  print("%d rows, %d files, %.1f MB" %
+    (len(line_sets), len(files), n_bytes / 1e6))
+
+  t_csv, rows_csv = timed(csv_merge_row_lines, line_sets)
+  t_new, rows_new = timed(gse._merge_csv_row_lines, line_sets)
+  print("csv.reader:            %.3fs" % t_csv)
+  print("_merge_csv_row_lines:  %.3fs (%.1fx)" % (t_new, t_csv / max(t_new, 1e-9)))
+  if rows_csv != rows_new:
+    print("ERROR: rows differ.")
+    return 1
+  print("OK: rows identical.")
+  return 0
+
+
+def bench_gunzip(paths):
+  """Compare line reading of gzip files by gzip and by gzstream."""
+  status = 0
+  for path in paths:
+    t = time.time()
+    lines_old = list(gzip.open(path, "rb"))
+    t_old = time.time() - t
+    t = time.time()
+    lines_new = [line for lines in gzstream.open(path).iter_blocks()
+                 for line in lines]
+    t_new = time.time() - t
+    n_bytes = sum([len(line) for line in lines_old])
+    print("%s: %d lines, %.1f MB" % (path, len(lines_old), n_bytes / 1e6))
+    print("gzip.GzipFile:         %.3fs" % t_old)
+    print("gzstream.GzipStream:   %.3fs (%.1fx)" %
+      (t_new, t_old / max(t_new, 1e-9)))
+    if lines_old != lines_new:
+      print("ERROR: lines differ.")
+      status = 1
+  if status == 0:
+    print("OK: lines identical.")
+  return status
+
+
+def write_fixtures(fixture_dir, options):
+  """Write fixtures of `options` into `fixture_dir` unless they exist.
+
+  The options of written fixtures are kept in fixture_dir/fixtures.json.
+  """
+  path = os.path.join(fixture_dir, "fixtures.json")
+  if os.path.exists(path) and json.load(open(path)) == options:
+    print("Using fixtures %s in %s" % (options, fixture_dir))
+    return
+  if not os.path.isdir(fixture_dir):
+    os.makedirs(fixture_dir)
+  t = time.time()
+  fixtures.write_study(fixture_dir, **options)
+  json.dump(options, open(path, "w"), sort_keys=True)
+  print("Wrote fixtures %s in %s in %.1fs" % (options, fixture_dir, time.time() - t))
+
+
+def run_e2e(gse_id):
+  """Return ({str: (float, float, int)}, Metrics) of one offline run.
+
+  Returns wall seconds, CPU seconds and rows of each step.
+  """
+  # Parse everything in every run: no listing, header or platform caches.
+  GSE.FTP_LISTINGS.clear()
+  steps = {}
+  m = metrics.start(gse_id)
+
+  def step(name, f):
+    t, c = time.time(), metrics.cpu_time()
+    n = f()
+    steps[name] = (time.time() - t, metrics.cpu_time() - c, n)
+
+  params = {'rx_gsm_subject_str': fixtures.RX_SUBJECT_STR}
+  state = {}
+  def populate():
+    state['gse'] = GSE(gse_id, custom_parameters=params)
+    return len(state['gse'].samples)
+  step("GSE.populate", populate)
+  gse = state['gse']
+  def parse_gpl():
+    gse.platform.load()
+    return len(gse.platform.probe_list)
+  step("GPL._parse", parse_gpl)
+  step("GSE.get_rows", lambda: sum([1 for row in gse.get_rows()]))
+  step("EQTLFilter.get_rows",
+       lambda: sum([1 for row in filter.EQTLFilter(gse).get_rows()]))
+  return steps, metrics.stop()
+
+
+def bench_e2e(args):
+  """Time the GSE pipeline end to end on a synthetic study, offline."""
+  if not args or "=" in args[0]:
+    print(USE_MSG)
+    return 1
+  fixture_dir = args[0]
+  options = dict(map(lambda s: s.split('='), args[1:]))
+  repeat = int(options.pop("repeat", 3))
+  for key in ("probes", "samples", "replicates", "files", "seed"):
+    if key in options:
+      options[key] = int(options[key])
+  if "missing" in options:
+    options["missing"] = float(options["missing"])
+  write_fixtures(fixture_dir, options)
+  gse_id = options.get("gse_id", "GSE90001")
+
+  download.set_backend("fixture")
+  FixtureDownload.FIXTURE_DIR = fixture_dir
+  GSE.HEADER_CACHE = HeaderCache(cache_dir=False)
+  GPL.CACHE = None
+  # EQTLFilter writes its spill files in TMP_DIR.
+  tmp_dir = tempfile.mkdtemp(dir=os.environ.get("TMP_DIR") or None)
+  os.environ["TMP_DIR"] = tmp_dir
+
+  best = {}
+  try:
+    for i in range(repeat):
+      steps, m = run_e2e(gse_id)
+      for name, (wall, cpu, n) in steps.items():
+        if name not in best or wall < best[name][0]:
+          best[name] = (wall, cpu, n)
+      print("Run %d: %.3fs" % (i+1, sum([s[0] for s in steps.values()])))
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+  print("Fastest of %d runs:" % repeat)
+  for name in ("GSE.populate", "GPL._parse", "GSE.get_rows", "EQTLFilter.get_rows"):
+    wall, cpu, n = best[name]
+    print("  %-20s %8.3fs wall %8.3fs cpu %9d rows %10.0f rows/s" %
+      (name, wall, cpu, n, n / max(wall, 1e-9)))
+  print("Stages of last run:")
+  for line in m.summary()[1:]:
+    print(line)
+  return 0
+
+
+BENCHMARKS = {
+  'split': bench_split,
+  'gunzip': bench_gunzip,
+  'e2e': bench_e2e,
+}
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 3 or sys.argv[1] not in BENCHMARKS:
+    print(USE_MSG)
+    sys.exit(1)
+  sys.exit(BENCHMARKS[sys.argv[1]](sys.argv[2:]))
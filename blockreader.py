@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""Read and split lines of a file pointer in a background thread.
+
+Each RowBlockReader owns one file pointer. Its thread reads lines, which
+decompresses them (zlib releases the GIL while inflating), splits each line
+into a row, and queues the rows in blocks. Several series matrix files of a
+study are then read at the same time while the calling thread only merges
+blocks of rows.
+
+Reader threads record stage metrics, like downloads which complete while they
+read, into the Metrics of the thread which started them (see metrics).
+"""
+import sys
+import threading
+try:
+  import Queue
+except ImportError:
+  import queue as Queue
+
+import metrics
+
+
+class RowBlockReader(object):
+  """Background reader of blocks of split lines from one file pointer.
+
+  Attributes:
+    fp: iter=>str of open file pointer read by the thread
+    f_split: function(str) => [str] which splits one line into a row
+    block_size: int of number of rows per block
+    done: bool if EOF or an error has been returned to the caller
+  """
+  # Seconds between checks of the stop flag or for keyboard interrupts.
+  POLL_SECONDS = 0.1
+
+  def __init__(self, fp, f_split, block_size=256, max_blocks=8):
+    """Start reader thread.
+
+    Args:
+      fp: iter=>str of open file pointer
+      f_split: function(str) => [str] which splits one line into a row
+      block_size: int of number of rows per block
+      max_blocks: int of number of blocks queued before the thread waits
+    """
+    self.fp = fp
+    self.f_split = f_split
+    self.block_size = block_size
+    self.done = False
+    self._queue = Queue.Queue(max_blocks)
+    self._stopped = threading.Event()
+    self._metrics = metrics.current()
+    self._thread = threading.Thread(target=self._run, name=repr(self))
+    self._thread.daemon = True
+    self._thread.start()
+
+  def __repr__(self):
+    return "[RowBlockReader of %s (%d)]" % (self.fp, id(self))
+
+  def _run(self):
+    """Thread target: queue ("rows", block), then ("eof", None) or ("error", exc_info)."""
+    metrics.bind(self._metrics)
+    try:
+      if hasattr(self.fp, "iter_blocks"):
+        # Read lines a block at a time from streams like gzstream.GzipStream.
+        for lines in self.fp.iter_blocks(self.block_size):
+          if not self._put(("rows", [self.f_split(line) for line in lines])):
+            return
+      else:
+        block = []
+        for line in self.fp:
+          block.append(self.f_split(line))
+          if len(block) >= self.block_size:
+            if not self._put(("rows", block)):
+              return
+            block = []
+        if block and not self._put(("rows", block)):
+          return
+      self._put(("eof", None))
+    except Exception:
+      self._put(("error", sys.exc_info()))
+
+  def _put(self, item):
+    """Return True once `item` is queued or False if reader was stopped."""
+    while not self._stopped.is_set():
+      try:
+        self._queue.put(item, True, self.POLL_SECONDS)
+      except Queue.Full:
+        continue
+      return True
+    return False
+
+  def next_block(self):
+    """Return next block of rows, or [] at EOF. Re-raise reader thread errors.
+
+    Returns:
+      [[str]] of up to self.block_size rows
+    """
+    if self.done:
+      return []
+    while True:
+      try:
+        kind, value = self._queue.get(True, self.POLL_SECONDS)
+      except Queue.Empty:
+        continue
+      break
+    if kind == "rows":
+      return value
+    self.done = True
+    if kind == "error":
+      # Python 3 exceptions keep their traceback of the reader thread.
+      raise value[1]
+    return []
+
+  def stop(self):
+    """Signal thread to stop. A thread blocked in a network read exits later."""
+    self._stopped.set()
+    self.done = True
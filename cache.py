@@ -0,0 +1,102 @@
+#!/usr/bin/python
+"""Inspect and prune the download and GPL cache in CACHE_DIR.
+
+Entries are pruned least recently used first until the cache fits its size
+budget. GPL platform downloads and parsed platforms are pinned and never
+pruned. Pruning is safe while other processes use the cache.
+
+SAMPLE USE:
+$ python cache.py inspect
+$ python cache.py prune max_bytes=50G
+"""
+from __future__ import print_function
+USE_MSG = """USE: python cache.py COMMAND [options]
+
+COMMAND:
+  inspect: print size of cache, pinned and incomplete entries, and largest entries
+  prune: delete least recently used entries over budget and idle incomplete downloads
+
+OPTIONS:
+  cache_dir=str: path to cache directory [default=CACHE_DIR]
+  max_bytes=str: size budget like 50G [default=CACHE_MAX_BYTES]
+  pin=str: regular expression of pinned file names [default=CACHE_PIN or GPL files]
+  top=int: number of largest entries to list by inspect [default=20]
+  dry_run: bool (0 or 1) if prune only lists entries to delete [default=False]
+"""
+
+import sys
+import re
+import time
+
+from download import cachemanager
+
+
+def inspect(manager, top=20):
+  """Print cache size totals and the `top` largest entries."""
+  entries = manager.scan()
+  stats = manager.stats(entries)
+  f = cachemanager.format_bytes
+  print("Cache directory: %s" % manager.get_cache_dir())
+  if manager.max_bytes is not None:
+    print("Budget: %s" % f(manager.max_bytes))
+  print("Total: %s in %d entries" % (f(stats['bytes']), stats['entries']))
+  print("Pinned: %s in %d entries" % (f(stats['pinned_bytes']), stats['pinned']))
+  print("Incomplete: %s in %d entries" %
+    (f(stats['partial_bytes']), stats['partial']))
+  entries.sort(key=lambda e: -e.size)
+  if entries[:top]:
+    print("\nLargest entries:")
+  for entry in entries[:top]:
+    flags = "".join([(entry.pinned and "P") or "-", (entry.partial and "I") or "-"])
+    print("%8s %s %s %s" % (f(entry.size), flags,
+      time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.atime)), entry.key))
+
+
+def prune(manager, dry_run=False):
+  """Prune cache. Print deleted entries."""
+  removed = manager.prune(dry_run=dry_run)
+  for entry in removed:
+    print("%s %8s %s" % ((dry_run and "would delete") or "deleted",
+      cachemanager.format_bytes(entry.size), entry.key))
+  print("%d entries of %s %s." % (len(removed),
+    cachemanager.format_bytes(sum([e.size for e in removed])),
+    (dry_run and "would be deleted") or "deleted"))
+
+
+def main(command, cache_dir=None, max_bytes=None, pin=None, top=20,
+         dry_run=False):
+  manager = cachemanager.from_environ()
+  if cache_dir is not None:
+    manager.cache_dir = cache_dir
+  if max_bytes is not None:
+    manager.max_bytes = cachemanager.parse_bytes(max_bytes)
+  if pin is not None:
+    manager.pin = re.compile(pin)
+  if manager.get_cache_dir() is None:
+    print("Set environ var CACHE_DIR or option cache_dir to the cache directory.")
+    sys.exit(1)
+  if command == "inspect":
+    inspect(manager, int(top))
+  elif command == "prune":
+    if type(dry_run) == str:
+      dry_run = not dry_run.lower() in ('0', 0, False, "", 'false','f', None)
+    prune(manager, dry_run)
+  else:
+    print(USE_MSG)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+
+  if len(sys.argv) == 1 or sys.argv[1].lower().strip('-') in ("h", 'help'):
+    print(USE_MSG)
+    sys.exit(1)
+
+  try:
+    command = sys.argv[1]
+    options = dict(map(lambda s: s.split('='), sys.argv[2:]))
+  except:
+    print(USE_MSG)
+    raise
+
+  main(command, **options)
@@ -1,11 +1,63 @@
 """Library and platform independent HTTP/FTP and GZip handles.
 
-Customize this file to return the appropriate handlers per platform.
+Download is the download backend named by environment variable
+DOWNLOAD_BACKEND, or set by set_backend(), from BACKENDS:
+
+  cached: CachedDownload; fetch urls through the download cache (default)
+  local: LocalDownload; fetch urls without caching
+  mirror: MirrorDownload; read a local mirror of ftp.ncbi.nih.gov/pub/geo in
+    GEO_MIRROR_DIR, else fetch urls through the download cache
+  fixture: FixtureDownload; read synthetic fixture files in FIXTURE_DIR
+
+The backend is looked up when a Download is created, so modules which have
+imported Download use the backend set later.
+
+Downloads read bytes. as_text() returns a reader of str lines of them.
 """
-#import local_download
-import cached_download
-import gzipper
+import os
+
+from . import cached_download
+from . import local_download
+from . import mirror_download
+from . import fixture_download
+from . import gzipper
+from . import textio
+
+BACKENDS = {
+  'cached': cached_download.CachedDownload,
+  'local': local_download.LocalDownload,
+  'mirror': mirror_download.MirrorDownload,
+  'fixture': fixture_download.FixtureDownload,
+}
+DEFAULT_BACKEND = "cached"
+
+_backend = None
+
+
+def set_backend(name):
+  """Use download backend `name` in BACKENDS for new Downloads."""
+  global _backend
+  if name not in BACKENDS:
+    raise ValueError("Unknown download backend '%s'. Choose from %s." %
+      (name, sorted(BACKENDS)))
+  _backend = BACKENDS[name]
+
+
+def get_backend():
+  """Return class of the current download backend."""
+  return _backend
+
+
+def Download(url, **kwds):
+  """Return download handle of `url` from the current backend.
+
+  Args:
+    url: str of url to fetch
+    **kwds: keyword arguments of the backend, like expected_size
+  """
+  return _backend(url, **kwds)
+
 
-#Download = local_download.LocalDownload
-Download = cached_download.CachedDownload
+set_backend(os.environ.get("DOWNLOAD_BACKEND") or DEFAULT_BACKEND)
 Gzipper = gzipper.Gzipper
+as_text = textio.as_text
@@ -0,0 +1,305 @@
+#!/usr/bin/python
+"""Block-compressed, seekable gzip files with a block offset index.
+
+Like BGZF, a block file is a series of independent gzip members of about
+BLOCK_SIZE bytes of data each, so it is a valid gzip file for any gzip reader.
+The index file "<filename>.idx" lists the data and file offsets of each block.
+With the index, a reader starts decompressing at the block which contains any
+data offset, and blocks can be decompressed in parallel threads. Blocks are
+compressed at a fast compression level by default.
+
+SAMPLE USE:
+  fp = BlockWriter("rows.txt.gz")
+  fp.write(data)
+  fp.close()
+  fp = open("rows.txt.gz", offset=123456789)
+  line = fp.readline()
+"""
+import os
+import zlib
+import bisect
+import marshal
+try:
+  import __builtin__ as builtins
+except ImportError:
+  import builtins
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from . import gzstream
+
+# Bytes of data per block before compression.
+BLOCK_SIZE = 65536
+# Zlib compression level of blocks: fast rather than small.
+BLOCK_LEVEL = 1
+# Magic prefix and version of index files.
+MAGIC = b"BLOCKZIP"
+FORMAT_VERSION = 1
+INDEX_SUFFIX = ".idx"
+
+
+def open(filename, offset=0, threads=1):
+  """Return line reader of decompressed data of gzip file from `offset`.
+
+  Files without an index are read from the start, skipping `offset` bytes.
+
+  Args:
+    filename: str of path to block or plain gzip file
+    offset: int of byte offset in decompressed data
+    threads: int of threads which decompress blocks in parallel
+  Returns:
+    BlockStream or gzstream.GzipStream
+  """
+  index = read_index(filename)
+  if index is None:
+    fp = gzstream.GzipStream(filename)
+    left = offset
+    while left > 0:
+      block = fp.read(min(left, BLOCK_SIZE * 16))
+      if not block:
+        break
+      left -= len(block)
+    return fp
+  fp = BlockStream(filename, index, threads)
+  if offset:
+    fp.seek(offset)
+  return fp
+
+
+def read_index(filename):
+  """Return index dict of block file `filename` or None if it has none.
+
+  Index keys are 'data' ([int] of data offset of each block), 'file' ([int]
+  of file offset of each block) and 'size' (int of total bytes of data).
+  """
+  try:
+    fp = builtins.open(filename + INDEX_SUFFIX, "rb")
+  except IOError:
+    return None
+  try:
+    if fp.readline() != b"%s %d\n" % (MAGIC, FORMAT_VERSION):
+      return None
+    index = marshal.load(fp)
+  except (EOFError, ValueError, TypeError):
+    return None
+  finally:
+    fp.close()
+  return index
+
+
+def write_index(filename, index):
+  """Write index dict of block file `filename`, replacing it whole."""
+  filepath = filename + INDEX_SUFFIX
+  fp = builtins.open(filepath + ".tmp", "wb")
+  fp.write(b"%s %d\n" % (MAGIC, FORMAT_VERSION))
+  marshal.dump(index, fp)
+  fp.close()
+  os.rename(filepath + ".tmp", filepath)
+
+
+def append(filename, src_filename):
+  """Append block file `src_filename` and its index to block file `filename`.
+
+  Files without an index are appended as one block.
+  """
+  index = read_index(filename) or _whole_index(filename)
+  src_index = read_index(src_filename) or _whole_index(src_filename)
+  file_size = os.path.getsize(filename)
+  index['data'].extend([x + index['size'] for x in src_index['data']])
+  index['file'].extend([x + file_size for x in src_index['file']])
+  index['size'] += src_index['size']
+  fp_src = builtins.open(src_filename, "rb")
+  fp = builtins.open(filename, "ab")
+  while True:
+    block = fp_src.read(BLOCK_SIZE * 16)
+    if not block:
+      break
+    fp.write(block)
+  fp.close()
+  fp_src.close()
+  write_index(filename, index)
+
+
+def _whole_index(filename):
+  """Return index of a gzip file of unknown blocks as one block."""
+  fp = gzstream.GzipStream(filename)
+  size = 0
+  while True:
+    block = fp.read(BLOCK_SIZE * 16)
+    if not block:
+      break
+    size += len(block)
+  fp.close()
+  if not size:
+    return {'data': [], 'file': [], 'size': 0}
+  return {'data': [0], 'file': [0], 'size': size}
+
+
+class BlockWriter(object):
+  """Writer of a block file and its index.
+
+  Attributes:
+    name: str of path to block file
+    bytes_in: int of bytes of data written
+    bytes_out: int of compressed bytes written
+  """
+  def __init__(self, filename, block_size=None, level=None):
+    """Open new block file for writing.
+
+    Args:
+      filename: str of path to block file
+      block_size: int of bytes of data per block or None for BLOCK_SIZE
+      level: int of zlib compression level or None for BLOCK_LEVEL
+    """
+    self.name = filename
+    self.block_size = block_size or BLOCK_SIZE
+    if level is None:
+      level = BLOCK_LEVEL
+    self.level = level
+    self.fileobj = builtins.open(filename, "wb")
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self._parts = []
+    self._n = 0
+    self._data_offsets = []
+    self._file_offsets = []
+    self.closed = False
+
+  def __repr__(self):
+    return "[BlockWriter %s (%d)]" % (self.name, id(self))
+
+  def write(self, data):
+    """Write str of data."""
+    if not data:
+      return
+    self._parts.append(data)
+    self._n += len(data)
+    if self._n >= self.block_size:
+      self._flush_blocks()
+
+  def _flush_blocks(self, final=False):
+    """Compress and write whole blocks of buffered data; all if `final`."""
+    data = b"".join(self._parts)
+    self._parts, self._n = [], 0
+    i = 0
+    while len(data) - i >= self.block_size or (final and i < len(data)):
+      block = data[i:i+self.block_size]
+      c = zlib.compressobj(self.level, zlib.DEFLATED, gzstream.GZIP_WBITS)
+      out = c.compress(block) + c.flush()
+      self._data_offsets.append(self.bytes_in)
+      self._file_offsets.append(self.bytes_out)
+      self.fileobj.write(out)
+      self.bytes_in += len(block)
+      self.bytes_out += len(out)
+      i += len(block)
+    if i < len(data):
+      self._parts, self._n = [data[i:]], len(data) - i
+
+  def close(self):
+    """Write remaining data and the index. Close file."""
+    if self.closed:
+      return
+    self._flush_blocks(final=True)
+    self.fileobj.close()
+    write_index(self.name, {'data': self._data_offsets,
+                            'file': self._file_offsets, 'size': self.bytes_in})
+    self.closed = True
+
+
+def _decompress(data):
+  return zlib.decompress(data, gzstream.GZIP_WBITS)
+
+
+class BlockStream(gzstream.GzipStream):
+  """Seekable line reader of a block file, as gzstream.GzipStream.
+
+  With threads > 1, the next blocks are decompressed ahead in a thread pool;
+  zlib releases the interpreter lock while it decompresses.
+  """
+  # Blocks decompressed ahead per thread.
+  QUEUE_BLOCKS = 2
+
+  def __init__(self, filename, index, threads=1):
+    """Open block file for reading from the start.
+
+    Args:
+      filename: str of path to block file
+      index: {str: obj} of index of block file
+      threads: int of threads to decompress blocks
+    """
+    gzstream.GzipStream.__init__(self, filename)
+    self.index = index
+    self.threads = threads
+    self._pool = None
+    if threads > 1:
+      self._pool = ThreadPool(threads)
+    self._ends = index['file'][1:] + [os.path.getsize(filename)]
+    # Block number of the last decompressed block, which is in the buffer.
+    self._block = -1
+    self._chunks = self._iter_chunks(0)
+
+  def __repr__(self):
+    return "[BlockStream %s (%d)]" % (self.name, id(self))
+
+  def _read_block(self, i):
+    """Return compressed bytes of block `i`."""
+    self.fileobj.seek(self.index['file'][i])
+    return self.fileobj.read(self._ends[i] - self.index['file'][i])
+
+  def _iter_chunks(self, start):
+    """Yield decompressed blocks from block `start`."""
+    n = len(self.index['file'])
+    if self._pool is None:
+      for i in range(start, n):
+        chunk = _decompress(self._read_block(i))
+        self._block = i
+        yield chunk
+      return
+    results = deque()
+    i = start
+    while i < n or results:
+      while i < n and len(results) < self.threads * self.QUEUE_BLOCKS:
+        results.append(self._pool.apply_async(_decompress, (self._read_block(i),)))
+        i += 1
+      chunk = results.popleft().get()
+      self._block = i - len(results) - 1
+      yield chunk
+
+  def _fill(self):
+    """Return next nonempty decompressed block, or empty string at EOF."""
+    if self.fileobj is None:
+      return b""
+    for chunk in self._chunks:
+      if chunk:
+        return chunk
+    return b""
+
+  def seek(self, offset):
+    """Move to byte `offset` of decompressed data.
+
+    Offsets in the buffered block move in it without decompressing again.
+    """
+    i = bisect.bisect_right(self.index['data'], offset) - 1
+    if i < 0:
+      self._chunks = self._iter_chunks(0)
+      self._block = -1
+      self._buf, self._pos = self._empty, 0
+      return
+    if i == self._block and self._buf:
+      self._pos = offset - self.index['data'][i]
+      if self._pos <= len(self._buf):
+        return
+    self._chunks = self._iter_chunks(i)
+    self._buf = self._next_chunk()
+    self._pos = offset - self.index['data'][i]
+    if self._pos > len(self._buf):
+      # Offset past end of data.
+      self._buf, self._pos = self._empty, 0
+
+  def close(self):
+    """Release buffers, thread pool and file."""
+    if self._pool is not None:
+      self._pool.terminate()
+      self._pool = None
+    self._chunks = iter(())
+    gzstream.GzipStream.close(self)
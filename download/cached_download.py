@@ -5,18 +5,78 @@
 """Library and platform independent HTTP/FTP handles.
 
 Cache directory is set locally by CACHE_DIR.
+
+Downloads which are closed before completion keep their incomplete cache file
+"<name>.cache.tmp" and a resume record "<name>.cache.tmp.resume" of the number
+of bytes cached. The next download of the same url resumes from that byte with
+FTP REST or an HTTP Range request if the remote file size is unchanged.
+
+FTP urls are fetched in logged in sessions reused from ftppool.FTPPool.
+
+Each finalized cache file "<name>.cache" has a metadata file "<name>.cache.meta"
+of its url, the remote file size and modification time, and the time it was
+cached. A cache file is stale and is deleted if the caller expects another
+remote size or modification time, or if it is older than `max_age`.
+
+Only one process or thread at a time downloads a url to the cache. It holds
+the entry's lock (see entrylock) from before it starts the download until it
+closes it. Others requesting the same url wait for the lock, then read the
+finalized cache file or resume the incomplete one, rather than downloading
+the file again.
+
+Cache files are block-compressed gzip files with a block offset index
+"<name>.cache.idx" (see blockzip), so that readers can start at any offset
+and decompress blocks ahead in `read_threads` threads. Downloads which are
+already gzip compressed, like "*.gz" files or HTTP responses of
+Content-Encoding gzip, are written verbatim while they download, so that an
+incomplete download resumes by byte offset. Once complete, verbatim files of
+at least REBLOCK_MIN_BYTES (env CACHE_REBLOCK_MIN_BYTES) are decompressed
+once and rewritten block-compressed, with 'encoding' "gzip-block" for "*.gz"
+files. Such a file is still a gzip file of the same data, so it is returned
+as it is, or decompressed and seekable to callers which pass `gunzip`, like
+readers of GEO series matrix files. Smaller verbatim files keep 'encoding'
+"verbatim": they are single gzip streams, read from the start by one thread.
+
+Reading a cache file marks it as recently used. If CACHE_MAX_BYTES is set,
+least recently used cache files are evicted after downloads (see
+cachemanager).
 """
 import sys
-import urllib
-import urllib2
 import ftplib
+import json
 import re
 import os
+import shutil
+import time
+from itertools import islice
+try:
+  from urllib import urlencode
+  from urllib2 import Request, URLError, urlopen
+except ImportError:
+  from urllib.parse import urlencode
+  from urllib.request import Request, urlopen
+  from urllib.error import URLError
 
-# patched, local version of gzip from Python 3 to handle http streams
-import gzip3 as gzip
+# streaming decompressor for reading lines of gzip streams
+from . import gzstream
+# streaming decompressor which also closes its underlying stream
+from . import gzipper
+# seekable block-compressed cache files
+from . import blockzip
+# pool of logged in FTP sessions
+from . import ftppool
+# size budget and LRU eviction of cache files
+from . import cachemanager
+# per-entry locks of cache files shared by processes
+from . import entrylock
 
-import download
+from . import download
+
+# Application level stage metrics; downloads add their bytes to the current.
+try:
+  import metrics
+except ImportError:
+  metrics = None
 
 # Hack to import application level Log object without adding it to global path
 try:
@@ -32,6 +92,32 @@ if 'CACHE_DIR' in os.environ:
 else:
   CACHE_DIR = None
 
+# FTP sessions shared by all downloads of this process.
+FTP_POOL = ftppool.FTPPool()
+
+# Size budget of CACHE_DIR set by CACHE_MAX_BYTES, checked after downloads.
+CACHE_MANAGER = cachemanager.from_environ()
+
+# Suffixes of the resume record and of the new data segment of a resumed
+#   download, both appended to the incomplete cache file path.
+RESUME_SUFFIX = ".resume"
+SEGMENT_SUFFIX = ".seg"
+# Suffix of metadata file of a finalized cache file.
+META_SUFFIX = ".meta"
+# First bytes of gzip data.
+GZIP_MAGIC = b"\x1f\x8b"
+# Cache file encodings: block-compressed, remote bytes stored as they are, or
+#   a remote gzip file rewritten block-compressed.
+ENC_BLOCK = "block"
+ENC_VERBATIM = "verbatim"
+ENC_GZIP_BLOCK = "gzip-block"
+# Completed verbatim cache files of at least this many bytes are rewritten
+#   block-compressed, so that they are seekable.
+REBLOCK_MIN_BYTES = int(os.environ.get("CACHE_REBLOCK_MIN_BYTES", 1 << 20))
+# Suffix of a verbatim cache file being rewritten block-compressed.
+REBLOCK_SUFFIX = ".reblock"
+RX_CONTENT_RANGE = re.compile(r"bytes\s+(\d+)-\d+/(\d+|\*)", re.I)
+
 def get_cache_name(url):
   """Return cache file name from url."""
   a = re.sub('^https?://','', url)
@@ -40,6 +126,167 @@ def get_cache_name(url):
   return a + ".cache"
 
 
+def read_json(filepath):
+  """Return dict from JSON file or None if it does not exist or is invalid."""
+  try:
+    fp = open(filepath, "rb")
+  except IOError:
+    return None
+  try:
+    d = json.load(fp)
+  except ValueError:
+    d = None
+  fp.close()
+  if not isinstance(d, dict):
+    return None
+  return d
+
+
+def write_json(filepath, d):
+  """Write dict `d` to JSON file, replacing it whole."""
+  fp = open(filepath + ".tmp", "w")
+  json.dump(d, fp)
+  fp.close()
+  os.rename(filepath + ".tmp", filepath)
+
+
+def read_resume_record(tmp_filepath):
+  """Return resume record dict of an incomplete cache file or None.
+
+  Record keys are 'url', 'bytes' (int of bytes cached), 'size' (int of
+  total size in bytes of the remote file, or None if unknown), 'mtime'
+  (str of remote modification time or None) and 'encoding' (str of cache
+  file encoding).
+  """
+  rec = read_json(tmp_filepath + RESUME_SUFFIX)
+  if rec is None or not rec.get('bytes') or not os.path.exists(tmp_filepath):
+    return None
+  return rec
+
+
+def write_resume_record(tmp_filepath, rec):
+  """Write resume record `rec` of incomplete cache file `tmp_filepath`."""
+  write_json(tmp_filepath + RESUME_SUFFIX, rec)
+
+
+def read_meta(filepath):
+  """Return metadata dict of cache file `filepath` or None if it has none.
+
+  Metadata keys are 'url', 'bytes' (int of bytes cached), 'size' (int of
+  remote file size in bytes or None), 'mtime' (str of remote modification
+  time or None), 'etag' (str of HTTP ETag or None), 'time' (float of epoch
+  time when cached), 'encoding' (ENC_BLOCK, ENC_VERBATIM or ENC_GZIP_BLOCK) and
+  'content_encoding' (str of HTTP Content-Encoding of verbatim bytes or None).
+  """
+  return read_json(filepath + META_SUFFIX)
+
+
+def mtime_matches(a, b):
+  """Return if remote modification times `a` and `b` may be the same.
+
+  FTP listings show a time like "Dec 28 07:34" for recent files and a year
+  like "Dec 28 2011" for older files, so only the day is compared if one
+  string has a time and the other has a year.
+  """
+  if a == b:
+    return True
+  a, b = a.split(), b.split()
+  if len(a) != 3 or len(b) != 3 or a[:2] != b[:2]:
+    return False
+  return (":" in a[2]) != (":" in b[2])
+
+
+def remove_cache(filepath):
+  """Delete a finalized cache file, its metadata and index, if any.
+
+  The cache file is deleted first, so that it never exists without metadata.
+  """
+  for path in (filepath, filepath + META_SUFFIX,
+               filepath + blockzip.INDEX_SUFFIX):
+    if os.path.exists(path):
+      os.remove(path)
+
+
+def remove_partial(tmp_filepath):
+  """Delete an incomplete cache file, its resume record and segment, if any."""
+  seg_filepath = tmp_filepath + SEGMENT_SUFFIX
+  reblock_filepath = tmp_filepath + REBLOCK_SUFFIX
+  for filepath in (tmp_filepath + RESUME_SUFFIX, seg_filepath,
+                   seg_filepath + blockzip.INDEX_SUFFIX, reblock_filepath,
+                   reblock_filepath + blockzip.INDEX_SUFFIX, tmp_filepath,
+                   tmp_filepath + blockzip.INDEX_SUFFIX):
+    if os.path.exists(filepath):
+      os.remove(filepath)
+
+
+def rename_cache(src, dest):
+  """Rename block-compressed cache file `src` and its index to `dest`."""
+  if os.path.exists(src + blockzip.INDEX_SUFFIX):
+    os.rename(src + blockzip.INDEX_SUFFIX, dest + blockzip.INDEX_SUFFIX)
+  os.rename(src, dest)
+
+
+class ResumeStream(object):
+  """Stream of an incomplete cache file followed by the rest of its download.
+
+  Reads return the first `offset` bytes of the remote file from the cache file
+  `prefix`, then continue from `fp` which starts at byte `offset`. A line which
+  spans both is returned whole.
+  """
+  def __init__(self, prefix, fp, offset):
+    """Initialize.
+
+    Args:
+      prefix: obj with read(size) and readline() of decompressed cache file
+      fp: file pointer like object of remote file from byte `offset`
+      offset: int of bytes in `prefix`
+    """
+    self.prefix = prefix
+    self.fp = fp
+    self.offset = offset
+    self.n_prefix = 0
+
+  def __repr__(self):
+    return "[ResumeStream at %d of %s (%d)]" % (self.offset, self.fp, id(self))
+
+  def _end_prefix(self):
+    """Close exhausted prefix. Raise IOError if it was not `offset` bytes."""
+    self.prefix.close()
+    self.prefix = None
+    if self.n_prefix != self.offset:
+      raise IOError("Incomplete cache file has %d bytes, not %d as recorded." %
+        (self.n_prefix, self.offset))
+
+  def readline(self):
+    if self.prefix is None:
+      return self.fp.readline()
+    line = self.prefix.readline()
+    self.n_prefix += len(line)
+    if line.endswith(b"\n"):
+      return line
+    self._end_prefix()
+    return line + self.fp.readline()
+
+  def read(self, size=-1):
+    if self.prefix is None:
+      return self.fp.read(size)
+    data = self.prefix.read(size)
+    self.n_prefix += len(data)
+    if 0 <= size == len(data):
+      return data
+    self._end_prefix()
+    if size < 0:
+      return data + self.fp.read()
+    return data + self.fp.read(size - len(data))
+
+  def close(self):
+    if self.prefix is not None:
+      self.prefix.close()
+      self.prefix = None
+    if isinstance(self.fp, ftppool.FTPResponse):
+      self.fp.close()
+
+
 class DownloadIter(object):
   """Iterator which reports download progress and caches downloads to file.
 
@@ -49,11 +296,15 @@ class DownloadIter(object):
   
   Subsequent calls to DownloadIter.close() after DownloadIter.closed = True have
   no effect. A premature call to DownloadIter.close() before it has closed itself
-  will terminate the underlying HTTP connection and discard the open cache file.
+  will terminate the underlying HTTP connection. The incomplete cache file is
+  kept with a resume record if `resumable`, else it is discarded. A read error
+  of the underlying buffer also closes self this way.
   """
   # number of bytes to download before calling 'update' hook (100k)
   REPORT_SIZE = 131072
-  def __init__(self, fp, size=None, cache=None, report=True, finalize=True, ftp=False):
+  def __init__(self, fp, size=None, cache=None, report=True, finalize=True,
+               ftp=False, url=None, resumable=False, offset=0, meta=None,
+               verbatim=None, lock=None):
     """Initialize self.
 
     Args:
@@ -63,6 +314,16 @@ class DownloadIter(object):
       report: bool to report download status
       finalize: bool if close() is called before self.completed, finish 
         downloading before closing buffer and any cache
+      url: str of url of download, for its resume record
+      resumable: bool if bytes read from `fp` are the bytes of the remote
+        file, so that an incomplete cache can be resumed by byte offset
+      offset: int of leading bytes of `fp` already in the incomplete cache
+        file, as from a ResumeStream; these are not written again
+      meta: {str: obj} of remote 'size', 'mtime', 'etag' and
+        'content_encoding' for the cache metadata
+      verbatim: bool if to cache bytes of `fp` as they are rather than
+        block-compressed, or None to do so only if they are gzip data
+      lock: entrylock.EntryLock held for `cache`, released on close
     """
     self.buffer = fp
     self.cache = cache
@@ -72,13 +333,22 @@ class DownloadIter(object):
       self.size = float(self.size)
     self.report = report
     self.finalize = finalize
+    self.url = url
+    self.resumable = resumable
+    self.offset = offset
+    self.meta = meta or {}
+    self.verbatim = verbatim
+    self.reblocked = False
+    self.lock = lock
 
     self.bytes_read = 0
     self.bytes_reported = 0
+    self.bytes_skip = offset
     self.fp_out = None
     self.completed = False
     self.tmp_filepath = None
     self.dest_filepath = None
+    self.seg_filepath = None
     self.closed = False
 
     if cache:
@@ -89,12 +359,30 @@ class DownloadIter(object):
         if "CACHE_DIR" in os.environ:
           CACHE_DIR = os.environ["CACHE_DIR"]
         if CACHE_DIR is None:
-          raise Exception, "Set environ variable CACHE_DIR to a system path that this program can use as a cache directory. For example: `export CACHE_DIR=/home/z/Desktop` or in Python, `os.environ['CACHE_DIR'] = '/my/path'`"
+          raise Exception("Set environ variable CACHE_DIR to a system path that this program can use as a cache directory. For example: `export CACHE_DIR=/home/z/Desktop` or in Python, `os.environ['CACHE_DIR'] = '/my/path'`")
       self.dest_filepath = os.path.join(CACHE_DIR, cache)
       # Add ".tmp" to end of cache filename to indicate cache is incomplete.
       self.tmp_filepath = self.dest_filepath + ".tmp"
-      # Cache files are compressed (even if the underlying data is compressed)
-      self.fp_out = gzip.open(self.tmp_filepath, "wb")
+      if offset:
+        # Write new data to a segment, appended to the cache file on close.
+        self.seg_filepath = self.tmp_filepath + SEGMENT_SUFFIX
+        self._open_out(b"")
+      else:
+        remove_partial(self.tmp_filepath)
+
+  def _open_out(self, block):
+    """Open cache file for writing. Cache gzip data verbatim.
+
+    Args:
+      block: bytes of first data to be written, to detect gzip data
+    """
+    if self.verbatim is None:
+      self.verbatim = block.startswith(GZIP_MAGIC)
+    filepath = self.seg_filepath or self.tmp_filepath
+    if self.verbatim:
+      self.fp_out = open(filepath, "wb")
+    else:
+      self.fp_out = blockzip.BlockWriter(filepath)
 
   def __repr__(self):
     return "[DownloadIter: cache=%s, %d bytes read, closed=%s, buffer=%s (%d)]" % \
@@ -107,12 +395,16 @@ class DownloadIter(object):
     return self
 
   def read(self, *args, **kwds):
-    """Return string. Wrapper for direct access to underlying http buffer."""
+    """Return bytes. Wrapper for direct access to underlying http buffer."""
     # The underlying buffer has been released. Just continue to return empty string
     #   as if the buffer were at EOF even though this handle has been "closed"
     if self.buffer is None:
-      return ""
-    block = self.buffer.read(*args, **kwds)
+      return b""
+    try:
+      block = self.buffer.read(*args, **kwds)
+    except Exception:
+      self._abort()
+      raise
     self._handle_block(block)
     return block
 
@@ -120,23 +412,30 @@ class DownloadIter(object):
     """Internal method for caching and reporting download status.
 
     Args:
-      block: str of data
+      block: bytes of data
     Returns:
       None if download is complete, else return unmodified, nonempty `block`
     """
     self.bytes_read += len(block)
 
-    # Download complete: file.read() == "" means EOF. Return None.
-    if block == "":
+    # Download complete: file.read() == b"" means EOF. Return None.
+    if not block:
       self.completed = True
       if self.report:
         self._report()
       self.close()
       return None
     
-    # Write block to cache (if enabled).
+    # Write block to cache (if enabled), except bytes already cached.
     if self.cache:
-      self.fp_out.write(block)
+      if self.fp_out is None:
+        self._open_out(block)
+      if self.bytes_skip:
+        n = min(self.bytes_skip, len(block))
+        self.bytes_skip -= n
+        self.fp_out.write(block[n:])
+      else:
+        self.fp_out.write(block)
     
     # Report download status (if enabled).
     if self.report:
@@ -151,12 +450,59 @@ class DownloadIter(object):
     """Wrapper for next line iterator to underlying http buffer. 
 
     Returns:
-      str of next line in http buffer
+      bytes of next line in http buffer
     """
-    block = self.buffer.readline()
+    # Released buffer: EOF, as in read().
+    if self.buffer is None:
+      raise StopIteration
+    try:
+      block = self.buffer.readline()
+    except Exception:
+      self._abort()
+      raise
     if not self._handle_block(block):
       raise StopIteration
     return block
+  __next__ = next
+
+  def readlines_block(self, n):
+    """Return list of up to `n` next lines in http buffer; [] at EOF.
+
+    Lines are cached and reported together as one block.
+
+    Args:
+      n: int of maximum number of lines
+    Returns:
+      [bytes] of lines
+    """
+    if self.buffer is None:
+      return []
+    try:
+      if hasattr(self.buffer, "readlines_block"):
+        lines = self.buffer.readlines_block(n)
+      else:
+        lines = list(islice(iter(self.buffer.readline, b""), n))
+    except Exception:
+      self._abort()
+      raise
+    if not self._handle_block(b"".join(lines)):
+      return []
+    return lines
+
+  def iter_blocks(self, n=1024):
+    """Yield lists of up to `n` lines until EOF."""
+    while True:
+      lines = self.readlines_block(n)
+      if not lines:
+        return
+      yield lines
+
+  def _abort(self):
+    """Close self after a read error without finishing the download."""
+    Log.warning("Read error in %s. Closing." % self)
+    self.finalize = False
+    if not self.closed:
+      self.close()
 
   def close(self):
     """Close any open file pointers, close and finalize cache file.
@@ -172,13 +518,10 @@ class DownloadIter(object):
     if self.finalize:
       if not self.completed and self.cache:
         Log.info("Finalizing download of %s." % self)
-        # Read remaining buffer unconditionally. Use iterator if reporting.
+        # Read remaining buffer unconditionally. Use line blocks if reporting.
         if self.report:
-          while True:
-            try:
-              self.next()
-            except StopIteration:
-              break
+          for lines in self.iter_blocks():
+            pass
         else:
           self.read()
         # If not closed in previous read(), try another read().
@@ -190,28 +533,137 @@ class DownloadIter(object):
         # Exit: prior reads in the finalize process already closed self.
         return
 
-    # self.buffer.close() causes bugs with FTP. Python sockets clean up after 
-    #   themselves in garbage collection, so to remove the reference to buffer
-    # self.buffer.close()
+    try:
+      self._close_cache()
+    finally:
+      # Flag self as closed to prevent redundant .close() calls.
+      self.closed = True
+      # Let waiting downloads of the same url read or resume the cache.
+      if self.lock:
+        self.lock.release()
+        self.lock = None
+
+  def _close_cache(self):
+    """Close buffer and cache file. Finalize, keep or delete cache file."""
+    if metrics:
+      metrics.add("download", calls=1, bytes_in=self.bytes_read - self.offset)
+    # self.buffer.close() causes bugs with urllib2 FTP. Python sockets clean up
+    #   after themselves in garbage collection, so to remove the reference to
+    #   buffer. Pooled FTP transfers must be closed to release their session.
+    if isinstance(self.buffer, (ResumeStream, ftppool.FTPResponse)):
+      self.buffer.close()
     self.buffer = None
-    self.fp_out.close()
+    if self.cache and self.completed and self.fp_out is None:
+      # Empty download
+      self._open_out(b"")
+    if self.fp_out:
+      self.fp_out.close()
+      if self.seg_filepath:
+        self._append_segment()
 
     if self.completed:
       Log.info("Download complete. %d bytes read." % (self.bytes_read))
       # Finalize cache.
       if self.cache:
-        os.rename(self.tmp_filepath, self.dest_filepath)
+        if self.verbatim and \
+            os.path.getsize(self.tmp_filepath) >= REBLOCK_MIN_BYTES:
+          self._reblock()
+        meta = {'url': self.url, 'bytes': self.bytes_read, 'time': time.time(),
+                'encoding': self._encoding()}
+        for key in ('size', 'mtime', 'etag', 'content_encoding'):
+          meta[key] = self.meta.get(key)
+        write_json(self.dest_filepath + META_SUFFIX, meta)
+        rename_cache(self.tmp_filepath, self.dest_filepath)
+        remove_partial(self.tmp_filepath)
         Log.info("Cache finalized as '%s'." % (self.dest_filepath))
+        if metrics:
+          metrics.add("download.cache", calls=1, bytes_in=self.bytes_read,
+                      bytes_out=os.path.getsize(self.dest_filepath))
+        CACHE_MANAGER.maybe_prune()
     else:
       Log.info("Download closed before completion. %d bytes read." % \
                (self.bytes_read))
-      # Flush cache.
-      if self.cache:
-        os.remove(self.tmp_filepath)
+      if self.cache and self.resumable and self.bytes_read > self.offset:
+        # Keep incomplete cache to resume from its last byte.
+        write_resume_record(self.tmp_filepath, {
+          'url': self.url, 'bytes': self.bytes_read,
+          'size': self.size and int(self.size), 'mtime': self.meta.get('mtime'),
+          'encoding': self._encoding()})
+        Log.info("Incomplete cache '%s' of %d bytes kept for resume." % \
+                 (self.tmp_filepath, self.bytes_read))
+      elif self.cache and not self.offset:
+        # Flush cache.
+        remove_partial(self.tmp_filepath)
         Log.info("Incomplete cache '%s' deleted." % (self.tmp_filepath))
-        
-    # Flag self as closed to prevent redundant .close() calls.
-    self.closed = True
+
+  def _encoding(self):
+    """Return str of encoding of cache file."""
+    if self.reblocked:
+      # Data of a gzip content encoding is the remote content itself.
+      if self.meta.get('content_encoding') == "gzip":
+        return ENC_BLOCK
+      return ENC_GZIP_BLOCK
+    if self.verbatim:
+      return ENC_VERBATIM
+    return ENC_BLOCK
+
+  def _reblock(self):
+    """Rewrite the complete verbatim cache file block-compressed.
+
+    The gzip data is decompressed once and written as a block file of the same
+    data, so that readers can seek. If the data cannot be decompressed, the
+    verbatim file is kept.
+    """
+    filepath = self.tmp_filepath + REBLOCK_SUFFIX
+    fp = gzstream.open(self.tmp_filepath, "rb")
+    fp_out = blockzip.BlockWriter(filepath)
+    error = None
+    try:
+      while True:
+        data = fp.read(blockzip.BLOCK_SIZE)
+        if not data:
+          break
+        fp_out.write(data)
+    except IOError as e:
+      error = e
+    finally:
+      fp.close()
+      fp_out.close()
+    if error:
+      Log.warning("Cannot rewrite cache '%s' of %s block-compressed: %s" % \
+                  (self.tmp_filepath, self.url, error))
+      for path in (filepath, filepath + blockzip.INDEX_SUFFIX):
+        if os.path.exists(path):
+          os.remove(path)
+      return
+    rename_cache(filepath, self.tmp_filepath)
+    self.reblocked = True
+    Log.info("Rewrote cache '%s' of %s block-compressed." % \
+             (self.tmp_filepath, self.url))
+
+  def _append_segment(self):
+    """Append new data segment of a resumed download to the cache file.
+
+    Verbatim segments are appended as they are. Block files are concatenated
+    with their indexes.
+    The resume record is removed first: it is only valid for the old file.
+    If no new data was read, the cache file and its record are unchanged.
+    """
+    if self.bytes_read > self.offset:
+      filepath = self.tmp_filepath + RESUME_SUFFIX
+      if os.path.exists(filepath):
+        os.remove(filepath)
+      if self.verbatim:
+        fp_seg = open(self.seg_filepath, "rb")
+        fp = open(self.tmp_filepath, "ab")
+        shutil.copyfileobj(fp_seg, fp)
+        fp.close()
+        fp_seg.close()
+      else:
+        blockzip.append(self.tmp_filepath, self.seg_filepath)
+    for filepath in (self.seg_filepath, self.seg_filepath + blockzip.INDEX_SUFFIX):
+      if os.path.exists(filepath):
+        os.remove(filepath)
 
   def _report(self):
     """Hook for reporting download status.
@@ -245,6 +697,7 @@ class CachedDownload(download.Download):
     bytes: number of bytes downloaded
     expected_size: int of expected number of bytes to be downloaded
     url_fetched: str of url actually fetched (e.g., after following redirects)
+    gunzipped: bool if read() returned the decompressed data of a gzip file
   """
   # default headers for HTTP
   HEADERS = {
@@ -254,10 +707,13 @@ class CachedDownload(download.Download):
     'Accept-Language': 'en-US,en;q=0.8'
   }
   RX_FTP = re.compile("^ftp://", re.I)
+  # seconds to wait for another download of the same url to the cache
+  LOCK_TIMEOUT = 4 * 3600
   
   def __init__(self, url, 
                req_data=None, req_headers=None, expected_size=None, report_status=True,
-               write_cache=True, read_cache=True, finalize=True):
+               write_cache=True, read_cache=True, finalize=True,
+               expected_mtime=None, max_age=None, read_threads=1, gunzip=False):
     """Specify HTTP request; init.
 
     Args:
@@ -269,6 +725,12 @@ class CachedDownload(download.Download):
       write_cache: bool to write download to cache (if from network)
       read_cache: bool to read from cache (if it exists)
       finalize: bool if to finalize Download if it's closed before completion
+      expected_mtime: str of remote modification time, as in an FTP listing
+      max_age: float of seconds after which a cache file is stale, or None
+      read_threads: int of threads to decompress blocks of a block-compressed
+        cache file ahead of the reader; verbatim caches use one thread
+      gunzip: bool if read() may return the decompressed data of a cached
+        gzip file, as flagged by self.gunzipped
     """
     # ftp or http?
     if self.RX_FTP.match(url):
@@ -288,6 +750,11 @@ class CachedDownload(download.Download):
       self.expected_size = expected_size
     else:
       self.expected_size = None
+    self.expected_mtime = expected_mtime
+    self.max_age = max_age
+    self.read_threads = read_threads
+    self.gunzip = gunzip
+    self.gunzipped = False
       
     self.rsp_url = None
     self.headers = None
@@ -298,26 +765,82 @@ class CachedDownload(download.Download):
   def __repr__(self):
     return "[CachedDownload %s (%d)]" % (self.url, id(self))
 
+  def is_cached(self):
+    """Return True if this url has a finalized cache file which is not stale."""
+    if CACHE_DIR is None:
+      return False
+    return self._get_cache_filepath() is not None
+
+  def _get_cache_filepath(self):
+    """Return path of finalized cache file of this url, or None.
+
+    A stale cache file is deleted and None is returned.
+    """
+    filepath = os.path.join(CACHE_DIR, self.cache_name)
+    if not os.path.exists(filepath):
+      return None
+    meta = read_meta(filepath) or {}
+    stale = None
+    if self.expected_size and meta.get('size') and \
+        meta['size'] != self.expected_size:
+      stale = "remote size %d, not %d" % (self.expected_size, meta['size'])
+    elif self.expected_mtime and meta.get('mtime') and \
+        not mtime_matches(meta['mtime'], self.expected_mtime):
+      stale = "remote modified %s, not %s" % \
+        (self.expected_mtime, meta['mtime'])
+    elif self.max_age is not None:
+      age = time.time() - (meta.get('time') or os.path.getmtime(filepath))
+      if age > self.max_age:
+        stale = "cached %d seconds ago" % age
+    if stale:
+      Log.info("Deleted stale cache '%s' of %s: %s." % (filepath, self.url, stale))
+      remove_cache(filepath)
+      return None
+    return filepath
+
   def _fetch_from_cache(self):
     """Attempt to fetch a file from cache or return None.
 
     Returns:
-      *iter of open, decompressed file pointer from cache or None.
+      *iter of open file pointer of the remote file's content from cache, or
+        None. Block-compressed cache files are decompressed and seekable.
+        Gzip files are returned as they are, for the caller to decompress
+        once, unless gzip was only their HTTP content encoding. With
+        self.gunzip, gzip files rewritten block-compressed are decompressed
+        and seekable instead, and self.gunzipped is set.
     """
     if CACHE_DIR is None:
-      raise Exception, "Set environ var CACHE_DIR to cache directory."
-    filepath = os.path.join(CACHE_DIR, self.cache_name)
-    if os.path.exists(filepath):
-      return gzip.open(filepath, "rb")
-    else:
+      raise Exception("Set environ var CACHE_DIR to cache directory.")
+    filepath = self._get_cache_filepath()
+    if not filepath:
+      return None
+    meta = read_meta(filepath) or {}
+    # Mark as recently used for LRU eviction.
+    cachemanager.touch(filepath)
+    try:
+      if meta.get('encoding') == ENC_GZIP_BLOCK:
+        if not self.gunzip:
+          return open(filepath, "rb")
+        fp = blockzip.open(filepath, threads=self.read_threads)
+        self.gunzipped = True
+        return fp
+      if meta.get('encoding') != ENC_VERBATIM:
+        return blockzip.open(filepath, threads=self.read_threads)
+      if meta.get('content_encoding') == "gzip":
+        return gzstream.open(filepath, "rb")
+      return open(filepath, "rb")
+    except EnvironmentError as e:
+      # Evicted by another process since it was found.
+      Log.info("Cache '%s' of %s vanished: %s" % (filepath, self.url, e))
       return None
 
-  def fetch(self, data=None, headers=None):
+  def fetch(self, data=None, headers=None, offset=0):
     """Fetch http file from network.
 
     Args:
       headers: {str:str} of additional request HTTP headers
       data: {str:*} of data to be sent via HTTP
+      offset: int of byte offset from which to fetch an FTP file
     Returns:
       [*str] of file pointer-like HTTP stream.
     """
@@ -325,12 +848,12 @@ class CachedDownload(download.Download):
     if self.type == "http":
       rsp = self._fetch_http(data, headers)
     elif self.type == "ftp":
-      rsp = self._fetch_ftp()
+      rsp = self._fetch_ftp(offset)
     else:
       Log.warning("Unknown type, cannot fetch %s for %s." % self.url, self)
       return None
 
-    self.status = 200
+    self.status = getattr(rsp, "code", None) or 200
     # Convert header keys into all lower case.
     self.headers = {}
     for key, value in dict(rsp.info()).items():
@@ -339,22 +862,22 @@ class CachedDownload(download.Download):
     
     return rsp
 
-  def _fetch_ftp(self):
-    """Fetch from FTP. This may use the FTP library directly someday."""
-    return urllib2.urlopen(self.url)
+  def _fetch_ftp(self, offset=0):
+    """Fetch from FTP in a pooled session, from byte `offset`."""
+    return FTP_POOL.open(self.url, offset)
 
   def _fetch_http(self, data=None, headers=None):
     """Fetch from HTTP."""
-    head = self.HEADERS
+    head = dict(self.HEADERS)
     if headers:
       head.update(headers)
-    req = urllib2.Request(self.url, headers=head)
     if data:
-      req.add_data(urllib.urlencode(data))
+      data = urlencode(data).encode("ascii")
+    req = Request(self.url, data=data, headers=head)
 
     try:
-      rsp = urllib2.urlopen(req)
-    except urllib2.URLError:
+      rsp = urlopen(req)
+    except URLError:
       if 'rsp' in locals():
         self.status = rsp.code
       else:
@@ -362,11 +885,77 @@ class CachedDownload(download.Download):
       raise
     return rsp
 
+  def _get_partial(self):
+    """Return resume record of this url's incomplete cache file or None.
+
+    An incomplete cache of another size or modification time than expected is
+    deleted.
+    """
+    if CACHE_DIR is None:
+      return None
+    tmp_filepath = os.path.join(CACHE_DIR, self.cache_name) + ".tmp"
+    rec = read_resume_record(tmp_filepath)
+    if rec is None:
+      return None
+    if rec.get('url') != self.url or \
+        (self.expected_size and rec.get('size') and \
+         rec['size'] != self.expected_size) or \
+        (self.expected_mtime and rec.get('mtime') and \
+         not mtime_matches(rec['mtime'], self.expected_mtime)):
+      Log.info("Deleted incomplete cache '%s' of other url or size: %s" % \
+               (tmp_filepath, rec))
+      remove_partial(tmp_filepath)
+      return None
+    return rec
+
+  def _fetch_resume(self, rec):
+    """Return network stream continuing an incomplete cache, or None.
+
+    Args:
+      rec: {str: obj} resume record of incomplete cache file
+    Returns:
+      (file pointer-like object from byte rec['bytes'], int of total size)
+        or None if the server cannot resume or the remote file changed
+    """
+    offset = rec['bytes']
+    try:
+      if self.type == "ftp":
+        rsp = self.fetch(offset=offset)
+      else:
+        # Ranges of compressed content encodings do not match cached bytes.
+        rsp = self.fetch(headers={
+          'Range': "bytes=%d-" % offset, 'Accept-Encoding': "identity"})
+    except (URLError, EnvironmentError) + ftplib.all_errors as e:
+      Log.info("Cannot resume %s at byte %d: %s" % (self.url, offset, e))
+      return None
+    total_size = None
+    if self.type == "ftp":
+      total_size = rsp.total_size
+    elif self.status == 206:
+      m = RX_CONTENT_RANGE.match(self.headers.get('content-range', ""))
+      if m and int(m.group(1)) == offset:
+        if m.group(2) != "*":
+          total_size = int(m.group(2))
+        elif 'content-length' in self.headers:
+          total_size = offset + int(self.headers['content-length'])
+    for size in (rec.get('size'), self.expected_size):
+      if total_size is not None and size and total_size != size:
+        total_size = None
+    if total_size is None:
+      Log.info("Cannot resume %s at byte %d: status %s, headers %s." % \
+               (self.url, offset, self.status, self.headers))
+      if hasattr(rsp, "close"):
+        rsp.close()
+      return None
+    return rsp, total_size
+
   def read(self):
     """Return a file-pointer-like object to this resource.
+
+    If an incomplete cache of this resource exists, continue its download.
     
     Returns:
-      iter: file-pointer-like str line iterator (uncompressed)
+      iter: file-pointer-like bytes line iterator (uncompressed)
     """
     # Attempt to retreive from cache if possible.
     if self.read_cache:
@@ -375,26 +964,91 @@ class CachedDownload(download.Download):
       fp = None
     if fp:
       Log.info("Fetched %s from cache." % self.url)
+      if metrics:
+        metrics.add("download.cached", calls=1)
       return fp
-    else:
-      Log.info("Downloading %s from network." % self.url)
-    
-    # From HTTP, Fetch request and populate self with response.
-    http_fp = self.fetch()
-    # If compressed, wrap http handle in a gzip decompressor.
-    if self.headers and "content-encoding" in self.headers and \
-        self.headers["content-encoding"] == "gzip":
-      zip_fp = gzip.GzipFile(fileobj=http_fp)
-      fp = zip_fp
-    else:
-      fp = http_fp
-      
+
     # Return download iterator from decompressed HTTP handle.
     if self.write_cache:
       cache = self.cache_name
     else:
       cache = None
 
+    lock = None
+    if cache:
+      lock = self._lock_cache()
+      if lock is None:
+        cache = None
+      elif self.read_cache:
+        # Another download of this url may have finalized the cache meanwhile.
+        fp = self._fetch_from_cache()
+        if fp:
+          lock.release()
+          Log.info("Fetched %s from cache." % self.url)
+          if metrics:
+            metrics.add("download.cached", calls=1)
+          return fp
+    try:
+      return self._read_network(cache, lock)
+    except:
+      if lock:
+        lock.release()
+      raise
+
+  def _lock_cache(self):
+    """Return held entrylock.EntryLock of this url's cache, waiting for
+    another download of this url to close. Return None on timeout, or at once
+    if the calling thread's own download of this url is open.
+    """
+    lock = entrylock.EntryLock(CACHE_DIR or os.environ.get("CACHE_DIR"),
+                               self.cache_name)
+    if lock.acquire(0):
+      return lock
+    if lock.held_by_caller():
+      Log.warning("%s is already open for download to the cache in this thread. Downloading again without cache." % self.url)
+      return None
+    Log.info("Waiting for another download of %s to the cache." % self.url)
+    if lock.acquire(self.LOCK_TIMEOUT):
+      return lock
+    Log.warning("Timed out waiting for another download of %s. Downloading without cache." % self.url)
+    return None
+
+  def _read_network(self, cache, lock):
+    """Return DownloadIter of this url from network, resumed if possible.
+
+    Args:
+      cache: str of cache file name or None if not to cache
+      lock: entrylock.EntryLock held for `cache`, passed to the DownloadIter
+    """
+    # Attempt to resume an incomplete download.
+    rec = None
+    if cache:
+      rec = self._get_partial()
+    if rec:
+      resumed = self._fetch_resume(rec)
+      if resumed:
+        http_fp, size = resumed
+        offset = rec['bytes']
+        Log.info("Resuming download of %s at byte %d of %d." % \
+                 (self.url, offset, size))
+        tmp_filepath = os.path.join(CACHE_DIR, cache) + ".tmp"
+        verbatim = (rec.get('encoding') == ENC_VERBATIM)
+        if verbatim:
+          prefix = open(tmp_filepath, "rb")
+        else:
+          prefix = blockzip.open(tmp_filepath)
+        fp = ResumeStream(prefix, http_fp, offset)
+        meta = {'size': size, 'mtime': self.expected_mtime or rec.get('mtime'),
+                'etag': self.headers.get('etag')}
+        return DownloadIter(fp, cache=cache, size=size, report=self.report_status,
+          finalize=self.finalize, url=self.url, resumable=True, offset=offset,
+          meta=meta, verbatim=verbatim, lock=lock)
+    Log.info("Downloading %s from network." % self.url)
+    
+    # From HTTP, Fetch request and populate self with response.
+    http_fp = self.fetch()
+    content_encoding = self.headers and self.headers.get("content-encoding")
+
     # Get expected download size in bytes.
     if self.headers and 'content-length' in self.headers:
       try:
@@ -403,6 +1057,19 @@ class CachedDownload(download.Download):
         size = None
     else:
       size = None
-      
-    return DownloadIter( \
-      fp, cache=cache, size=size, report=self.report_status, finalize=self.finalize)
+    if self.expected_size and not content_encoding:
+      size = self.expected_size
+    meta = {'size': self.expected_size or size,
+            'mtime': self.expected_mtime or self.headers.get('last-modified'),
+            'etag': self.headers.get('etag'),
+            'content_encoding': content_encoding}
+
+    # Cache compressed bytes verbatim. Only bytes of the remote file itself,
+    #   not of a content encoding, can be resumed by byte offset.
+    fp = DownloadIter(http_fp, cache=cache, size=size, report=self.report_status,
+      finalize=self.finalize, url=self.url, resumable=not content_encoding,
+      meta=meta, verbatim=(content_encoding == "gzip") or None, lock=lock)
+    # If compressed, wrap download in a gzip decompressor which closes it.
+    if content_encoding == "gzip":
+      return gzipper.Gzipper(fileobj=fp)
+    return fp
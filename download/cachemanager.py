@@ -0,0 +1,313 @@
+#!/usr/bin/python
+"""Size accounting and least recently used eviction of the download cache.
+
+Files in CACHE_DIR are grouped into entries: a download cache file
+"<name>.cache" with its metadata, block index and parsed header files; an
+incomplete download "<name>.cache.tmp" with its resume record and segment;
+or a parsed GPL platform file "GPL570.eQTL.gpl". Reading an entry updates the
+modification time of its file, so the newest modification time of an entry's
+files is its last access time.
+
+When the cache exceeds its size budget, least recently used entries are
+deleted until it fits. Pinned entries, by default GPL platform downloads and
+parsed platforms which are costly to download and shared by many studies,
+are never evicted. Incomplete downloads are deleted only when they have not
+been written for PARTIAL_MAX_AGE seconds, and no entry is deleted within
+MIN_IDLE seconds of its last use.
+
+Processes sharing CACHE_DIR prune one at a time under a lock file. Entries
+are deleted under their entry lock (see entrylock), so that entries being
+downloaded are kept, and data file first, so that readers never see a cache
+file without its metadata.
+
+ENVIRONMENT VARIABLES:
+  CACHE_MAX_BYTES: size budget like 50G, 500M or bytes; unset for no limit
+  CACHE_PIN: regular expression of file names of pinned entries
+
+SAMPLE USE:
+  manager = CacheManager(max_bytes=parse_bytes("50G"))
+  print(manager.stats())
+  manager.prune()
+"""
+import os
+import re
+import time
+import errno
+import fcntl
+
+from .entrylock import EntryLock
+
+# Logger import as in cached_download
+try:
+  from logger import Log
+except ImportError:
+  import sys
+  sys.path.append("..")
+  from ..logger import Log
+
+# Default pattern of pinned file names: GPL briefs and data tables, parsed GPLs.
+PIN_PATTERN = r"acc_GPL\d+_|\.gpl$"
+# Name of lock file of pruning processes in the cache directory.
+LOCK_NAME = ".cachemanager.lock"
+# Seconds since last write after which an incomplete download may be deleted.
+PARTIAL_MAX_AGE = 7 * 86400
+# Minimum seconds between automatic prunes of one process.
+CHECK_SECONDS = 60
+# Seconds since last use during which an entry is never evicted, so that
+#   entries being finalized or opened by another process are kept.
+MIN_IDLE = 60
+UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+RX_BYTES = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", re.I)
+
+
+def parse_bytes(s):
+  """Return int of bytes of size str like "50G", "1.5T" or "1024"."""
+  m = RX_BYTES.match(str(s))
+  if not m:
+    raise ValueError("Cannot parse size '%s'. Use a size like 50G." % s)
+  return int(float(m.group(1)) * UNITS[m.group(2).upper()])
+
+
+def format_bytes(n):
+  """Return str of size `n` in bytes like "1.5G"."""
+  for unit in ("T", "G", "M", "K"):
+    if n >= UNITS[unit]:
+      return "%.1f%s" % (n / float(UNITS[unit]), unit)
+  return "%dB" % n
+
+
+def touch(filepath):
+  """Mark cache file as recently used. Ignore missing files."""
+  try:
+    os.utime(filepath, None)
+  except OSError:
+    pass
+
+
+def get_entry_key(name):
+  """Return str of entry key of cache file name, or None if not managed."""
+  if name.startswith("."):
+    return None
+  i = name.find(".cache")
+  if i >= 0:
+    if name[i+6:].startswith(".tmp"):
+      return name[:i+10]
+    return name[:i+6]
+  i = name.find(".gpl")
+  if i >= 0:
+    return name[:i+4]
+  return name
+
+
+class CacheEntry(object):
+  """A group of cache files which are used and deleted together.
+
+  Attributes:
+    key: str of entry name, like "<name>.cache"
+    files: [str] of file paths
+    size: int of total bytes of files
+    atime: float of epoch time of last use
+    pinned: bool if entry is never evicted
+    partial: bool if entry is an incomplete download
+  """
+  def __init__(self, key, pinned=False):
+    self.key = key
+    self.files = []
+    self.size = 0
+    self.atime = 0
+    self.pinned = pinned
+    self.partial = key.endswith(".tmp")
+
+  def __repr__(self):
+    return "[CacheEntry %s: %s (%d)]" % (self.key, format_bytes(self.size), id(self))
+
+  def get_cache_name(self):
+    """Return str of cache file name of the entry, which names its lock."""
+    if self.partial:
+      return self.key[:-4]
+    return self.key
+
+  def remove(self):
+    """Delete files, data file first. Return int of bytes deleted."""
+    n = 0
+    for filepath in sorted(self.files, key=len):
+      try:
+        size = os.path.getsize(filepath)
+        os.remove(filepath)
+        n += size
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+    return n
+
+
+class CacheManager(object):
+  """Size budget and LRU eviction of a cache directory.
+
+  Attributes:
+    cache_dir: str of cache directory or None for CACHE_DIR when used
+    max_bytes: int of size budget in bytes or None for no limit
+    pin: compiled regular expression of pinned file names
+    partial_max_age: float of seconds after which idle partials are deleted
+  """
+  def __init__(self, cache_dir=None, max_bytes=None, pin=None,
+               partial_max_age=PARTIAL_MAX_AGE):
+    """Initialize.
+
+    Args:
+      cache_dir: str of cache directory or None for CACHE_DIR
+      max_bytes: int of size budget in bytes or None for no limit
+      pin: str of regular expression of pinned file names or None
+      partial_max_age: float of seconds after which idle partials are deleted
+    """
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    if pin is None:
+      pin = PIN_PATTERN
+    self.pin = re.compile(pin)
+    self.partial_max_age = partial_max_age
+    self._last_check = 0
+
+  def __repr__(self):
+    return "[CacheManager %s, max %s (%d)]" % \
+      (self.get_cache_dir(), self.max_bytes and format_bytes(self.max_bytes),
+       id(self))
+
+  def get_cache_dir(self):
+    if self.cache_dir is not None:
+      return self.cache_dir
+    return os.environ.get("CACHE_DIR")
+
+  def scan(self):
+    """Return [CacheEntry] of all entries in the cache directory."""
+    cache_dir = self.get_cache_dir()
+    entries = {}
+    for name in os.listdir(cache_dir or "."):
+      key = get_entry_key(name)
+      if key is None:
+        continue
+      filepath = os.path.join(cache_dir, name)
+      try:
+        st = os.stat(filepath)
+      except OSError:
+        # Deleted by another process meanwhile.
+        continue
+      entry = entries.get(key)
+      if entry is None:
+        entry = entries[key] = CacheEntry(key, bool(self.pin.search(key)))
+      entry.files.append(filepath)
+      entry.size += st.st_size
+      entry.atime = max(entry.atime, st.st_mtime)
+    return list(entries.values())
+
+  def stats(self, entries=None):
+    """Return {str: int} of bytes and counts of entries by kind."""
+    if entries is None:
+      entries = self.scan()
+    d = {'bytes': 0, 'entries': 0, 'pinned_bytes': 0, 'pinned': 0,
+         'partial_bytes': 0, 'partial': 0}
+    for entry in entries:
+      d['bytes'] += entry.size
+      d['entries'] += 1
+      for kind in ('pinned', 'partial'):
+        if getattr(entry, kind):
+          d[kind] += 1
+          d[kind + '_bytes'] += entry.size
+    return d
+
+  def _lock(self, block):
+    """Return open lock file, locked, or None if locked elsewhere."""
+    fp = open(os.path.join(self.get_cache_dir() or ".", LOCK_NAME), "a")
+    flags = fcntl.LOCK_EX
+    if not block:
+      flags |= fcntl.LOCK_NB
+    try:
+      fcntl.flock(fp.fileno(), flags)
+    except IOError as e:
+      fp.close()
+      if e.errno in (errno.EAGAIN, errno.EACCES):
+        return None
+      raise
+    return fp
+
+  def prune(self, max_bytes=None, dry_run=False, block=True):
+    """Delete idle partials and least recently used entries over budget.
+
+    Args:
+      max_bytes: int of size budget or None for self.max_bytes
+      dry_run: bool if to only return entries which would be deleted
+      block: bool if to wait for another pruning process, else skip
+    Returns:
+      [CacheEntry] of deleted entries
+    """
+    if max_bytes is None:
+      max_bytes = self.max_bytes
+    lock = self._lock(block)
+    if lock is None:
+      return []
+    try:
+      entries = self.scan()
+      total = sum([entry.size for entry in entries])
+      now = time.time()
+      removed = []
+      for entry in entries:
+        if entry.partial and now - entry.atime > self.partial_max_age:
+          removed.append(entry)
+          total -= entry.size
+      if max_bytes is not None and total > max_bytes:
+        candidates = [e for e in entries if not e.pinned and not e.partial and
+                      now - e.atime > MIN_IDLE]
+        candidates.sort(key=lambda e: e.atime)
+        for entry in candidates:
+          if total <= max_bytes:
+            break
+          removed.append(entry)
+          total -= entry.size
+      if not dry_run:
+        for entry in list(removed):
+          entry_lock = EntryLock(self.get_cache_dir(), entry.get_cache_name())
+          if not entry_lock.acquire(0):
+            # Being downloaded or resumed.
+            removed.remove(entry)
+            total += entry.size
+            continue
+          try:
+            entry.remove()
+          finally:
+            entry_lock.release()
+      if removed:
+        Log.info("%s %d cache entries of %s from %s; %s remain." % \
+          ((dry_run and "Would delete") or "Deleted", len(removed),
+           format_bytes(sum([e.size for e in removed])), self.get_cache_dir(),
+           format_bytes(total)))
+      if max_bytes is not None and total > max_bytes:
+        Log.warning("Cache %s of %s exceeds budget %s after pruning." % \
+          (self.get_cache_dir(), format_bytes(total), format_bytes(max_bytes)))
+      return removed
+    finally:
+      lock.close()
+
+  def maybe_prune(self):
+    """Prune over budget, at most once per CHECK_SECONDS, if no other process
+    is pruning. Log and ignore errors: pruning must not fail downloads.
+    """
+    if self.max_bytes is None:
+      return
+    now = time.time()
+    if now - self._last_check < CHECK_SECONDS:
+      return
+    self._last_check = now
+    try:
+      self.prune(block=False)
+    except EnvironmentError as e:
+      Log.warning("Cannot prune cache %s: %s" % (self.get_cache_dir(), e))
+
+
+def from_environ():
+  """Return CacheManager configured by CACHE_MAX_BYTES and CACHE_PIN."""
+  max_bytes = os.environ.get("CACHE_MAX_BYTES")
+  if max_bytes:
+    max_bytes = parse_bytes(max_bytes)
+  else:
+    max_bytes = None
+  return CacheManager(max_bytes=max_bytes, pin=os.environ.get("CACHE_PIN"))
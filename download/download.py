@@ -1,6 +1,24 @@
 #!/usr/bin/python
+import os
+import time
 
 # Populate this class from children as more Download classes are created.
 class Download(object):
-  """Empty base class for all download instances."""
-  pass
+  """Base class for all download instances."""
+  # FTP LIST line of a file as served by ftp.ncbi.nih.gov.
+  PTN_LIST_LINE = "-r--r--r--   1 ftp      anonymous %10d %s %s\n"
+
+  def list_dir(self, dirpath):
+    """Return bytes of FTP LIST lines of files in local `dirpath`, by name.
+
+    Used by backends which serve FTP directory urls from local directories.
+    """
+    lines = []
+    for name in sorted(os.listdir(dirpath)):
+      st = os.stat(os.path.join(dirpath, name))
+      mtime = time.strftime("%b %d %H:%M", time.localtime(st.st_mtime))
+      lines.append(self.PTN_LIST_LINE % (st.st_size, mtime, name))
+    data = "".join(lines)
+    if not isinstance(data, bytes):
+      data = data.encode("latin-1")
+    return data
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+"""Per-entry lock files of the download cache, shared by processes.
+
+A process which writes cache entry "<name>.cache" or its incomplete download
+"<name>.cache.tmp" holds an exclusive flock of "<name>.cache" in LOCK_DIR
+under the cache directory until the download is finalized or closed. Other
+processes and threads requesting the same url wait for the lock, then read
+the finalized cache file or resume the incomplete download.
+
+A thread never waits for a lock which it holds itself, as when it opens a url
+again while its own download of it is open: acquire() returns False at once.
+
+Locks are released by the kernel when their holder exits, so a crashed
+download never blocks others. Lock files are empty and are never deleted:
+deleting a lock file while another process opens it would let two processes
+lock different files of the same name.
+
+SAMPLE USE:
+  lock = EntryLock(CACHE_DIR, "ftp.ncbi.nih.gov_pub_geo_GSE1.txt.gz.cache")
+  if lock.acquire(timeout=60):
+    try:
+      write_cache()
+    finally:
+      lock.release()
+"""
+import os
+import time
+import errno
+import fcntl
+import threading
+
+# Directory of lock files in the cache directory.
+LOCK_DIR = ".locks"
+# Seconds between attempts to take a lock held by another process.
+POLL_SECONDS = 0.5
+
+# Thread ident of the holder of each lock file path held in this process.
+_holders = {}
+_holders_lock = threading.Lock()
+
+
+class EntryLock(object):
+  """Exclusive lock of one cache entry across processes and threads.
+
+  Attributes:
+    filepath: str of path to lock file
+    locked: bool if this object holds the lock
+  """
+  def __init__(self, cache_dir, name):
+    """Initialize unlocked.
+
+    Args:
+      cache_dir: str of cache directory
+      name: str of cache file name of the entry
+    """
+    self.filepath = os.path.join(cache_dir or ".", LOCK_DIR, name)
+    self.fp = None
+
+  def __repr__(self):
+    return "[EntryLock %s, locked=%s (%d)]" % (self.filepath, self.locked, id(self))
+
+  @property
+  def locked(self):
+    return self.fp is not None
+
+  def held_by_caller(self):
+    """Return bool if the calling thread holds this entry's lock, through
+    this or another EntryLock."""
+    with _holders_lock:
+      return _holders.get(self.filepath) == threading.current_thread().ident
+
+  def _hold(self, fp):
+    """Hold lock of locked open lock file `fp` in the calling thread."""
+    self.fp = fp
+    with _holders_lock:
+      _holders[self.filepath] = threading.current_thread().ident
+
+  def _open(self):
+    try:
+      return open(self.filepath, "a")
+    except IOError as e:
+      if e.errno != errno.ENOENT:
+        raise
+    try:
+      os.mkdir(os.path.dirname(self.filepath))
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+    return open(self.filepath, "a")
+
+  def acquire(self, timeout=None):
+    """Take lock. Return bool if it was taken.
+
+    Args:
+      timeout: float of seconds to wait for another holder, 0 to not wait,
+        or None to wait until it is released; the calling thread never
+        waits for itself
+    Returns:
+      bool if this object now holds the lock
+    """
+    if self.fp is not None:
+      return True
+    if self.held_by_caller():
+      return False
+    # Each open file has its own flock, so threads of one process exclude
+    #   each other as processes do.
+    fp = self._open()
+    if timeout is None:
+      fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+      self._hold(fp)
+      return True
+    deadline = time.time() + timeout
+    while True:
+      try:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._hold(fp)
+        return True
+      except IOError as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+          fp.close()
+          raise
+      if time.time() >= deadline:
+        fp.close()
+        return False
+      time.sleep(POLL_SECONDS)
+
+  def release(self):
+    """Release lock, if held."""
+    if self.fp is not None:
+      fp, self.fp = self.fp, None
+      with _holders_lock:
+        _holders.pop(self.filepath, None)
+      fp.close()
@@ -62,8 +62,8 @@ class InsertGene(RowFilter):
     # This logic may warrant something more sophesticated in the future.
     # For example, it may be provided by the GPL object.
     if "GENE_SYMBOL" not in self.platform.col_titles:
-      raise ValueError, "GENE_SYM not in %s. GPL col titles are: %s" \
-         % (self.gse.platform, self.gse.platform.col_titles)
+      raise ValueError("GENE_SYM not in %s. GPL col titles are: %s"
+         % (self.gse.platform, self.gse.platform.col_titles))
     # update gse col_titles to include new gene_sym row
     self._insert(gse.col_titles, "GENE_SYM")
 
@@ -92,8 +92,8 @@ class RemoveNonGene(RowFilter):
 
     # Get gene_symb col from GSE (and verify it exists)
     if "GENE_SYMBOL" not in self.col_titles:
-      raise ValueError, "GENE_SYM not in %s (maybe this filter is misordered?) GSE col titles are: %s" \
-         % (self.gse, self.gse.col_titles)
+      raise ValueError("GENE_SYM not in %s (maybe this filter is misordered?) GSE col titles are: %s"
+         % (self.gse, self.gse.col_titles))
     self.input_sym_col = self.gse.col_titles.index("GENE_SYMBOL")
     
   def get(self, row):
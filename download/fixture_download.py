@@ -0,0 +1,103 @@
+#!/usr/bin/python
+"""Offline stand-in for Download which serves synthetic GEO fixture files.
+
+Urls of GSE briefs, GPL quick views and data tables, series matrix FTP
+directory listings and series matrix files are mapped to files in a fixture
+directory written by fixtures.py:
+
+  <fixture_dir>/GSE1.brief.txt            GSE.PTN_GSE_BRIEF
+  <fixture_dir>/GPL1.quick.txt            GPL.PTN_GPL_QUICK
+  <fixture_dir>/GPL1.data.txt             GPL.PTN_GPL
+  <fixture_dir>/GSE1/                     GSE.PTN_GSE_SERIES_DIR, listed
+  <fixture_dir>/GSE1/GSE1_series_matrix.txt.gz
+
+Directory listings are formatted as FTP LIST lines from the size and
+modification time of the files, as parsed by geo.FTPFile.
+
+Environment variables:
+FIXTURE_DIR: path to fixture directory
+
+SAMPLE USE:
+  FixtureDownload.FIXTURE_DIR = "fixtures"
+  fp = FixtureDownload(GSE.PTN_GSE_BRIEF % {'id': "GSE90001"}).read()
+"""
+import io
+import os
+import re
+
+from . import download
+
+
+class FixtureDownload(download.Download):
+  """Download which reads fixture files instead of fetching urls.
+
+  Attributes:
+    url: str of url to fetch
+    filepath: str of path of fixture file or directory of `url`
+    bytes: int of number of bytes served
+  """
+  # Fixture directory; None to read FIXTURE_DIR from the environment when used.
+  FIXTURE_DIR = None
+  # (compiled regex, file name pattern) of urls to fixture paths.
+  URL_PATHS = [
+    (re.compile(r"acc=(GSE\d+)&targ=self&view=brief&form=text"), "%s.brief.txt"),
+    (re.compile(r"acc=(GPL\d+)&targ=self&view=quick&form=text"), "%s.quick.txt"),
+    (re.compile(r"acc=(GPL\d+)&targ=gpl&view=data&form=text"), "%s.data.txt"),
+    (re.compile(r"/SeriesMatrix/(GSE\d+)/?$"), "%s"),
+    (re.compile(r"/SeriesMatrix/(GSE\d+/[^/]+)$"), "%s"),
+  ]
+
+  def __init__(self, url, **kwds):
+    """Initialize.
+
+    Args:
+      url: str of url to fetch
+      **kwds: consume keyword arguments of CachedDownload (for compatibility)
+    """
+    self.url = url
+    self.filepath = self.get_path(url)
+    self.bytes = 0
+
+  def __repr__(self):
+    return "[FixtureDownload %s (%d)]" % (self.url, id(self))
+
+  @classmethod
+  def get_fixture_dir(cls):
+    if cls.FIXTURE_DIR is not None:
+      return cls.FIXTURE_DIR
+    return os.environ.get("FIXTURE_DIR", "")
+
+  @classmethod
+  def get_path(cls, url, fixture_dir=None):
+    """Return str of path of fixture file or directory of `url`.
+
+    Args:
+      url: str of GEO url
+      fixture_dir: str of fixture directory or None for get_fixture_dir()
+    Raises:
+      IOError: if `url` is not a recognized GEO url
+    """
+    for rx, ptn in cls.URL_PATHS:
+      m = rx.search(url)
+      if m:
+        if fixture_dir is None:
+          fixture_dir = cls.get_fixture_dir()
+        return os.path.join(fixture_dir, ptn % m.group(1))
+    raise IOError("No fixture file for url %s." % url)
+
+  def is_cached(self):
+    """Return True: fixtures are local files, so there is nothing to prefetch."""
+    return True
+
+  def read(self):
+    """Return open file of the fixture, or of its listing if a directory.
+
+    Returns:
+      file: open file of fixture contents, compressed if the file is
+    """
+    if os.path.isdir(self.filepath):
+      listing = self.list_dir(self.filepath)
+      self.bytes = len(listing)
+      return io.BytesIO(listing)
+    self.bytes = os.path.getsize(self.filepath)
+    return open(self.filepath, "rb")
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+"""Pool of logged in FTP sessions for downloads from the same hosts.
+
+urllib2 opens a new control connection, logs in and changes directory for
+every FTP url. FTPPool keeps idle ftplib sessions per host and user and reuses
+them for the next transfer, so that a study of many files pays for the
+connection setup once. Directory listings are not cached here: they are
+cached with their time to live by the callers, like CachedDownload.
+
+Transfers stream from the data connection through FTPResponse, which returns
+its session to the pool when the transfer reaches EOF.
+
+Processes forked from a process with idle sessions, like batch.py workers,
+share their control connections. A pool forgets sessions inherited from
+another process without closing them, and connects its own.
+
+SAMPLE USE:
+  pool = FTPPool()
+  fp = pool.open("ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SeriesMatrix/GSE25935/")
+  for line in fp:
+    print(line)
+"""
+import os
+import io
+import threading
+import ftplib
+try:
+  from urllib import unquote
+  from urlparse import urlparse
+except ImportError:
+  from urllib.parse import unquote, urlparse
+
+from logger import Log
+
+
+class FTPResponse(object):
+  """File pointer like FTP data connection of a RETR, possibly resumed.
+
+  At EOF, the transfer is completed and the session is returned to its pool.
+  A close() before EOF aborts the transfer and discards the session.
+
+  Attributes:
+    rest: int of byte offset from which the file is transferred
+    total_size: int of remote file size in bytes or None if unknown
+  """
+  def __init__(self, ftp, conn, url, rest=0, total_size=None, pool=None,
+               key=None):
+    """Initialize.
+
+    Args:
+      ftp: ftplib.FTP of logged in control connection
+      conn: socket of open data connection
+      url: str of url of file
+      rest: int of byte offset of transfer
+      total_size: int of remote file size in bytes or None
+      pool: FTPPool to return `ftp` to at EOF, or None to quit it
+      key: tuple of session key of `ftp` in `pool`
+    """
+    self.ftp = ftp
+    self.conn = conn
+    self.fp = conn.makefile("rb")
+    self.url = url
+    self.rest = rest
+    self.total_size = total_size
+    self.pool = pool
+    self.key = key
+
+  def __repr__(self):
+    return "[FTPResponse %s from %d (%d)]" % (self.url, self.rest, id(self))
+
+  def read(self, size=-1):
+    if self.fp is None:
+      return b""
+    block = self.fp.read(size)
+    # Socket file reads are short only at EOF.
+    if size < 0 or len(block) < size:
+      self._finish()
+    return block
+
+  def readline(self):
+    if self.fp is None:
+      return b""
+    line = self.fp.readline()
+    if not line:
+      self._finish()
+    return line
+
+  def info(self):
+    if self.total_size is None:
+      return {}
+    return {'content-length': str(self.total_size - self.rest)}
+
+  def geturl(self):
+    return self.url
+
+  def _close_data(self):
+    self.fp.close()
+    self.conn.close()
+    self.fp = self.conn = None
+
+  def _finish(self):
+    """Complete transfer at EOF and release session."""
+    self._close_data()
+    ftp, self.ftp = self.ftp, None
+    try:
+      ftp.voidresp()
+    except ftplib.all_errors as e:
+      Log.info("Discarded FTP session after transfer of %s: %s" % (self.url, e))
+      ftp.close()
+      return
+    if self.pool:
+      self.pool.release(self.key, ftp)
+    else:
+      _quit(ftp)
+
+  def close(self):
+    """Abort transfer if not at EOF. Discard its session."""
+    if self.fp is None:
+      return
+    self._close_data()
+    ftp, self.ftp = self.ftp, None
+    ftp.close()
+
+
+class ListingResponse(object):
+  """File pointer like FTP directory listing read from memory."""
+  def __init__(self, data, url):
+    self.fp = io.BytesIO(data)
+    self.url = url
+
+  def __repr__(self):
+    return "[ListingResponse %s (%d)]" % (self.url, id(self))
+
+  def read(self, size=-1):
+    return self.fp.read(size)
+
+  def readline(self):
+    return self.fp.readline()
+
+  def info(self):
+    return {'content-length': str(len(self.fp.getvalue()))}
+
+  def geturl(self):
+    return self.url
+
+  def close(self):
+    pass
+
+
+def _quit(ftp):
+  """Politely close FTP session `ftp`."""
+  try:
+    ftp.quit()
+  except ftplib.all_errors:
+    ftp.close()
+
+
+class FTPPool(object):
+  """Thread safe pool of idle, logged in ftplib sessions per host and user.
+
+  Attributes:
+    max_idle: int of maximum number of idle sessions kept per host and user
+    timeout: float of socket timeout in seconds
+  """
+  def __init__(self, max_idle=4, timeout=60):
+    """Initialize empty pool.
+
+    Args:
+      max_idle: int of maximum number of idle sessions per host and user
+      timeout: float of socket timeout in seconds
+    """
+    self.max_idle = max_idle
+    self.timeout = timeout
+    # {(host, port, user, passwd): [ftplib.FTP]} of idle sessions
+    self._idle = {}
+    self._lock = threading.Lock()
+    # Process ID of the owner of the sessions in _idle.
+    self._pid = os.getpid()
+    self.n_connects = 0
+
+  def __repr__(self):
+    self._check_pid()
+    with self._lock:
+      n = sum([len(x) for x in self._idle.values()])
+    return "[FTPPool: %d idle sessions, %d connects (%d)]" % \
+      (n, self.n_connects, id(self))
+
+  def _check_pid(self):
+    """Forget idle sessions inherited from a parent process.
+
+    The parent still uses their control connections, so they are neither
+    quit nor closed. A lock inherited while held would never be released.
+    """
+    if self._pid == os.getpid():
+      return
+    self._lock = threading.Lock()
+    self._idle = {}
+    self._pid = os.getpid()
+
+  def _connect(self, key):
+    """Return new logged in binary mode session for `key`."""
+    host, port, user, passwd = key
+    ftp = ftplib.FTP()
+    try:
+      ftp.connect(host, port, self.timeout)
+      ftp.login(user, passwd)
+      ftp.voidcmd("TYPE I")
+    except:
+      ftp.close()
+      raise
+    with self._lock:
+      self.n_connects += 1
+    Log.info("Opened FTP session to %s@%s:%d." % (user, host, port))
+    return ftp
+
+  def acquire(self, key):
+    """Return (ftplib.FTP, bool if reused) of a session for `key`."""
+    self._check_pid()
+    with self._lock:
+      idle = self._idle.get(key)
+      if idle:
+        return idle.pop(), True
+    return self._connect(key), False
+
+  def release(self, key, ftp):
+    """Return idle session `ftp` to pool, or quit it if the pool is full."""
+    self._check_pid()
+    with self._lock:
+      idle = self._idle.setdefault(key, [])
+      if len(idle) < self.max_idle:
+        idle.append(ftp)
+        return
+    _quit(ftp)
+
+  def close(self):
+    """Quit all idle sessions of this process."""
+    self._check_pid()
+    with self._lock:
+      sessions = [ftp for idle in self._idle.values() for ftp in idle]
+      self._idle.clear()
+    for ftp in sessions:
+      _quit(ftp)
+
+  def open(self, url, rest=0):
+    """Return file pointer like response of FTP file or directory `url`.
+
+    Urls ending in "/" are directories; their listing is returned.
+
+    Args:
+      url: str of ftp:// url
+      rest: int of byte offset from which to transfer a file
+    Returns:
+      FTPResponse or ListingResponse
+    """
+    parts = urlparse(url)
+    key = (parts.hostname, parts.port or ftplib.FTP_PORT,
+           unquote(parts.username or "anonymous"),
+           unquote(parts.password or ""))
+    path = unquote(parts.path) or "/"
+    if path.endswith("/"):
+      return ListingResponse(self._list(key, url, path), url)
+    ftp, rsp = self._call(key, url,
+                          lambda ftp: self._retr(ftp, key, url, path, rest))
+    return rsp
+
+  def _call(self, key, url, f):
+    """Return (ftplib.FTP, f(session)) of a pooled session of `key`.
+
+    A reused session may have timed out on the server. If so, `f` is called
+    once more in a new session. On other errors, the session is released if
+    it is still usable or else closed, and the error is raised.
+    """
+    ftp, reused = self.acquire(key)
+    while True:
+      try:
+        return ftp, f(ftp)
+      except ftplib.error_perm:
+        self.release(key, ftp)
+        raise
+      except (ftplib.error_temp, ftplib.error_reply, EnvironmentError,
+              EOFError) as e:
+        ftp.close()
+        if not reused:
+          raise
+        Log.info("Reconnecting stale FTP session for %s: %s" % (url, e))
+        ftp, reused = self._connect(key), False
+      except:
+        ftp.close()
+        raise
+
+  def _retr(self, ftp, key, url, path, rest):
+    """Start transfer of `path` in session `ftp`. Return FTPResponse."""
+    total_size = None
+    if rest:
+      try:
+        total_size = ftp.size(path)
+      except ftplib.error_perm:
+        total_size = None
+    conn, size = ftp.ntransfercmd("RETR %s" % path, rest or None)
+    if total_size is None and size is not None and not rest:
+      total_size = size
+    return FTPResponse(ftp, conn, url, rest, total_size, self, key)
+
+  def _list(self, key, url, path):
+    """Return bytes of listing of directory `path`."""
+    lines = []
+    def list_lines(ftp):
+      del lines[:]
+      ftp.retrlines("LIST %s" % path, lines.append)
+      # retrlines() leaves the session in ASCII mode.
+      ftp.voidcmd("TYPE I")
+    ftp, _ = self._call(key, url, list_lines)
+    self.release(key, ftp)
+    data = "".join([line + "\n" for line in lines])
+    if not isinstance(data, bytes):
+      data = data.encode("latin-1")
+    return data
@@ -1,10 +1,10 @@
 #!/usr/bin/python
 """GZip handler which closes its underlying fileobj when closed. 
-Uses local version of gzip3 library backported from Python 3.
+Uses local streaming gzip decompressor gzstream.
 """
-import gzip3 as gzip
+from . import gzstream
 
-class Gzipper(gzip.GzipFile):
+class Gzipper(gzstream.GzipStream):
   """Wrapper for gzip which closes underlying streams when closed."""
   def close(self):
     """Close underlying fileobj, then close self."""
@@ -0,0 +1,234 @@
+#!/usr/bin/python
+"""Streaming, read-only gzip decompressor for lines of large text files.
+
+GzipStream reads a compressed stream, like an HTTP response, in blocks and
+decompresses each block once. Decompressed data is never concatenated to a
+growing buffer: a line is sliced from the current decompressed chunk, or
+joined once from the chunks that it spans. Reading a line of n bytes costs
+O(n) even for series matrix lines of several megabytes.
+
+Lines are returned one at a time by readline() or next(), or in lists of
+lines by readlines_block(n) and iter_blocks(n). Lines are bytes in mode "rb".
+In mode "r" on Python 3, each decompressed chunk is decoded once as latin-1
+to str, so lines are str and string offsets are still byte offsets.
+"""
+import zlib
+try:
+  import __builtin__ as builtins
+except ImportError:
+  import builtins
+
+# Zlib window bits for a gzip header and trailer with a maximum window.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def open(filename, mode="rb"):
+  """Shorthand for GzipStream(filename, mode)."""
+  return GzipStream(filename, mode)
+
+
+class GzipStream(object):
+  """File-like reader of decompressed lines of a gzip file or stream.
+
+  Concatenated gzip members are read as one stream, as by gzip. Zero byte
+  padding between or after members is ignored.
+
+  Attributes:
+    fileobj: obj with read(size) of compressed data or None when closed
+    name: str of filename or repr of fileobj
+    closed: bool if stream is closed
+  """
+  # Bytes of compressed data read from fileobj at a time.
+  READ_SIZE = 65536
+  # Default number of lines per block from iter_blocks().
+  BLOCK_LINES = 1024
+
+  def __init__(self, filename=None, mode="rb", fileobj=None):
+    """Open stream for reading.
+
+    Args:
+      filename: str of path to gzip file; ignored if `fileobj` is set
+      mode: str of read mode, "r" for str lines or "rb" for bytes lines
+      fileobj: obj with read(size) of compressed data
+    """
+    if mode and 'r' not in mode:
+      raise ValueError("GzipStream is read only; mode '%s' unsupported." % mode)
+    self.myfileobj = None
+    if fileobj is None:
+      fileobj = self.myfileobj = builtins.open(filename, "rb")
+      self.name = filename
+    else:
+      self.name = getattr(fileobj, "name", repr(fileobj))
+    self.fileobj = fileobj
+    self.closed = False
+    # Decode chunks to str in text mode; str is bytes on Python 2.
+    self.text = bool(mode) and 'b' not in mode and str is not bytes
+    self._nl = "\n" if self.text else b"\n"
+    self._empty = self._nl[:0]
+    self._eof = False
+    # Decompressor of the current gzip member, or None between members.
+    self._d = None
+    # Compressed bytes read from fileobj but not yet decompressed.
+    self._pending = b""
+    # Current decompressed chunk and read position in it.
+    self._buf = self._empty
+    self._pos = 0
+
+  def __repr__(self):
+    return "[GzipStream %s (%d)]" % (self.name, id(self))
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    line = self.readline()
+    if not line:
+      raise StopIteration
+    return line
+  __next__ = next
+
+  def _next_chunk(self):
+    """Return next chunk from _fill(), decoded in text mode."""
+    chunk = self._fill()
+    if self.text:
+      return chunk.decode("latin-1")
+    return chunk
+
+  def _fill(self):
+    """Return next nonempty decompressed chunk, or empty string at EOF."""
+    while True:
+      if self._pending:
+        data, self._pending = self._pending, b""
+      else:
+        if self._eof or self.fileobj is None:
+          return b""
+        data = self.fileobj.read(self.READ_SIZE)
+        if not data:
+          self._eof = True
+          self._finish()
+          return b""
+      if self._d is None:
+        data = data.lstrip(b"\x00")
+        if not data:
+          continue
+        self._d = zlib.decompressobj(GZIP_WBITS)
+      try:
+        chunk = self._d.decompress(data)
+      except zlib.error as e:
+        raise IOError("Cannot decompress %s: %s" % (self, e))
+      if self._d.unused_data:
+        # End of member: the rest of `data` starts the next member, if any.
+        self._pending = self._d.unused_data
+        self._d = None
+      if chunk:
+        return chunk
+
+  def _finish(self):
+    """Verify that compressed stream did not end inside a gzip member."""
+    d, self._d = self._d, None
+    if d is None:
+      return
+    ended = getattr(d, "eof", None)
+    if ended is None:
+      # Older zlib modules have no `eof`: a finished decompressor does not
+      # consume more input, but passes it to unused_data.
+      try:
+        d.decompress(b"\x00")
+        ended = d.unused_data == b"\x00"
+      except zlib.error:
+        ended = False
+    if not ended:
+      raise IOError("Compressed stream %s ended inside a gzip member." % self)
+
+  def readline(self):
+    """Return next line including its newline, or empty string at EOF."""
+    buf, pos, nl = self._buf, self._pos, self._nl
+    i = buf.find(nl, pos)
+    if i >= 0:
+      self._pos = i + 1
+      return buf[pos:i+1]
+    # Line continues in following chunks: collect its parts and join once.
+    parts = [buf[pos:]]
+    while True:
+      chunk = self._next_chunk()
+      if not chunk:
+        self._buf, self._pos = self._empty, 0
+        return self._empty.join(parts)
+      i = chunk.find(nl)
+      if i >= 0:
+        parts.append(chunk[:i+1])
+        self._buf, self._pos = chunk, i + 1
+        return self._empty.join(parts)
+      parts.append(chunk)
+
+  def readlines_block(self, n):
+    """Return list of up to `n` next lines; fewer only at EOF.
+
+    Args:
+      n: int of maximum number of lines
+    Returns:
+      [str] of lines including newlines, or [] at EOF
+    """
+    lines, nl = [], self._nl
+    while len(lines) < n:
+      buf, pos = self._buf, self._pos
+      i = buf.find(nl, pos)
+      while i >= 0 and len(lines) < n:
+        lines.append(buf[pos:i+1])
+        pos = i + 1
+        i = buf.find(nl, pos)
+      self._pos = pos
+      if len(lines) >= n:
+        break
+      line = self.readline()
+      if not line:
+        break
+      lines.append(line)
+    return lines
+
+  def iter_blocks(self, n=None):
+    """Yield lists of up to `n` lines until EOF.
+
+    Args:
+      n: int of lines per block or None for self.BLOCK_LINES
+    """
+    if n is None:
+      n = self.BLOCK_LINES
+    while True:
+      lines = self.readlines_block(n)
+      if not lines:
+        return
+      yield lines
+
+  def read(self, size=-1):
+    """Return up to `size` decompressed bytes, or all if `size` < 0."""
+    buf, pos = self._buf, self._pos
+    if 0 <= size <= len(buf) - pos:
+      self._pos = pos + size
+      return buf[pos:pos+size]
+    parts = [buf[pos:]]
+    n = len(parts[0])
+    self._buf, self._pos = self._empty, 0
+    while size < 0 or n < size:
+      chunk = self._next_chunk()
+      if not chunk:
+        break
+      if size >= 0 and n + len(chunk) > size:
+        parts.append(chunk[:size-n])
+        self._buf, self._pos = chunk, size - n
+        break
+      parts.append(chunk)
+      n += len(chunk)
+    return self._empty.join(parts)
+
+  def close(self):
+    """Release buffers. Close fileobj only if opened from a filename."""
+    self.fileobj = None
+    self._d = None
+    self._pending = b""
+    self._buf = self._empty
+    self._pos = 0
+    if self.myfileobj:
+      self.myfileobj.close()
+      self.myfileobj = None
+    self.closed = True
@@ -16,18 +16,21 @@ The gzip file handle cannot directly accept an http "file handle" without raisin
     pos = self.fileobj.tell()   # Save current position
 AttributeError: addinfourl instance has no attribute 'tell'
 
-The fix is to the the backported gzip library from Python 3.
+The fix is the streaming gzip decompressor Gzipper, which only calls read().
 """
 import sys
-import urllib
-import urllib2
 import re
 import logging
+try:
+  from urllib import urlencode
+  from urllib2 import Request, URLError, urlopen
+except ImportError:
+  from urllib.parse import urlencode
+  from urllib.request import Request, urlopen
+  from urllib.error import URLError
 
-# patched, local version of gzip from Python 3 to handle http streams
-import gzip3 as gzip
-
-import download
+from . import download
+from . import gzipper
 
 
 # class DownloadIter:
@@ -56,7 +59,8 @@ class LocalDownload(download.Download):
   }
   RX_FTP = re.compile("^ftp://", re.I)
   
-  def __init__(self, url, req_data=None, req_headers=None, expected_size=None):
+  def __init__(self, url, req_data=None, req_headers=None, expected_size=None,
+               **kwds):
     """Specify HTTP request; init.
 
     Args:
@@ -100,17 +104,17 @@ class LocalDownload(download.Download):
       head = {}
     if headers:
       head.update(headers)
+    if data:
+      data = urlencode(data).encode("ascii")
     if head:
-      req = urllib2.Request(self.url, headers=head)
+      req = Request(self.url, data=data, headers=head)
     else:
-      req = urllib2.Request(self.url)
-    if data:
-      req.add_data(urllib.urlencode(data))
+      req = Request(self.url, data=data)
 
     # Fetch request.
     try:
-      rsp = urllib2.urlopen(self.url)
-    except urllib2.URLError:
+      rsp = urlopen(self.url)
+    except URLError:
       self.status = rsp.code
       raise
     self.status = 200
@@ -125,14 +129,14 @@ class LocalDownload(download.Download):
     Args:
       **kwds: arguments passed to self.fetch
     Returns:
-      iter: file-pointer-like str line iterator (uncompressed)
+      iter: file-pointer-like bytes line iterator (uncompressed)
     """
     # Fetch request and populate self with response.
     http_fp = self.fetch()
     # If compressed, decompress string before return
     if "Content-Encoding" in self.headers and \
         self.headers["Content-Encoding"] == "gzip":
-      zip_fp = gzip.GzipFile(fileobj=http_fp)
+      zip_fp = gzipper.Gzipper(fileobj=http_fp)
       return zip_fp
     else:
       return http_fp
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+"""Download backend which reads a local mirror of ftp.ncbi.nih.gov/pub/geo.
+
+Urls are mapped to files of the mirror directory GEO_MIRROR_DIR, a copy of
+ftp://ftp.ncbi.nih.gov/pub/geo like one made by rsync:
+
+  ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SeriesMatrix/GSE2034/...
+    => DATA/SeriesMatrix/GSE2034/...
+    or series/GSE2nnn/GSE2034/matrix/...
+  GSE.PTN_GSE_BRIEF of GSE2034
+    => ^SERIES section of series/GSE2nnn/GSE2034/soft/GSE2034_family.soft.gz
+  GPL.PTN_GPL and GPL.PTN_GPL_QUICK of GPL96
+    => ^PLATFORM section of platforms/GPLnnn/GPL96/soft/GPL96_family.soft.gz
+
+Files are returned as open file handles of the mirror: gzip series matrix
+files are decompressed by the reader as they are read, without being copied
+or recompressed into the download cache. Directories are listed as FTP LIST
+lines. Urls which are not in the mirror are fetched by FALLBACK.
+
+Environment variables:
+GEO_MIRROR_DIR: path to local mirror of ftp.ncbi.nih.gov/pub/geo
+
+SAMPLE USE:
+  fp = MirrorDownload(GSE.PTN_GSE_SERIES_DIR % {'id': "GSE2034"}).read()
+"""
+import io
+import os
+import re
+
+from . import download
+from . import gzipper
+from . import cached_download
+
+try:
+  from logger import Log
+except ImportError:
+  import sys
+  sys.path.append("..")
+  from ..logger import Log
+
+
+def get_stub(acc):
+  """Return str of GEO mirror range directory of accession like "GSE2nnn"."""
+  prefix, digits = acc[:3], acc[3:]
+  return "%s%snnn" % (prefix, digits[:-3])
+
+
+class SoftSection(object):
+  """Line iterator of one "^" section of a SOFT file, like ^PLATFORM.
+
+  Lines are bytes, as read from `fp`. Closing the section closes the
+  underlying file.
+  """
+  def __init__(self, fp, head):
+    """Skip lines of `fp` to the first line starting with bytes `head`.
+
+    Raises:
+      IOError: if `fp` has no line starting with `head`
+    """
+    self.fp = fp
+    self.closed = False
+    self._done = False
+    self._head = None
+    for line in fp:
+      if line.startswith(head):
+        self._head = line
+        break
+    else:
+      fp.close()
+      raise IOError("No %s section in %s." % (head, fp))
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    if self._head is not None:
+      line, self._head = self._head, None
+      return line
+    if self._done:
+      raise StopIteration
+    line = next(self.fp)
+    # The next section ends this one.
+    if line.startswith(b"^"):
+      self._done = True
+      raise StopIteration
+    return line
+  __next__ = next
+
+  def close(self):
+    if not self.closed:
+      self.fp.close()
+      self.closed = True
+
+
+class MirrorDownload(download.Download):
+  """Download which reads files of a local GEO mirror, else FALLBACK.
+
+  Attributes:
+    url: str of url to fetch
+    filepath: str of path of mirror file or directory of `url`, or None
+    section: bytes of SOFT section head to read from filepath, or None
+    bytes: int of number of bytes of the served file
+  """
+  # Mirror directory; None to read GEO_MIRROR_DIR from the environment.
+  MIRROR_DIR = None
+  # Download class of urls not in the mirror; None to raise IOError.
+  FALLBACK = cached_download.CachedDownload
+  RX_FTP_GEO = re.compile(r"^ftp://ftp\.ncbi\.nih\.gov/pub/geo/(.*)$", re.I)
+  RX_SERIES_MATRIX = re.compile(r"^DATA/SeriesMatrix/(GSE\d+)/?(.*)$")
+  RX_GSE_BRIEF = re.compile(r"acc=(GSE\d+)&targ=self&view=brief&form=text")
+  RX_GPL = re.compile(r"acc=(GPL\d+)&targ=(?:gpl&view=data|self&view=quick)&form=text")
+
+  def __init__(self, url, **kwds):
+    """Initialize.
+
+    Args:
+      url: str of url to fetch
+      **kwds: keyword arguments passed to FALLBACK if `url` is not mirrored
+    """
+    self.url = url
+    self.bytes = 0
+    self.filepath, self.section = self.get_path(url)
+    self.fallback = None
+    if self.filepath is None:
+      if self.FALLBACK is None:
+        raise IOError("%s is not in GEO mirror %s." % (url, self.get_mirror_dir()))
+      Log.info("%s is not in GEO mirror %s. Using %s." % \
+        (url, self.get_mirror_dir(), self.FALLBACK.__name__))
+      self.fallback = self.FALLBACK(url, **kwds)
+
+  def __repr__(self):
+    return "[MirrorDownload %s (%d)]" % (self.url, id(self))
+
+  @classmethod
+  def get_mirror_dir(cls):
+    if cls.MIRROR_DIR is not None:
+      return cls.MIRROR_DIR
+    return os.environ.get("GEO_MIRROR_DIR")
+
+  @classmethod
+  def get_candidates(cls, url):
+    """Return [(str, bytes)] of mirror path relative to the mirror directory
+    and SOFT section head or None, in order of preference.
+    """
+    m = cls.RX_GSE_BRIEF.search(url)
+    if m:
+      gse_id = m.group(1)
+      return [(os.path.join("series", get_stub(gse_id), gse_id, "soft",
+                            "%s_family.soft.gz" % gse_id), b"^SERIES")]
+    m = cls.RX_GPL.search(url)
+    if m:
+      gpl_id = m.group(1)
+      return [(os.path.join("platforms", get_stub(gpl_id), gpl_id, "soft",
+                            "%s_family.soft.gz" % gpl_id), b"^PLATFORM")]
+    m = cls.RX_FTP_GEO.match(url)
+    if not m:
+      return []
+    path = m.group(1)
+    candidates = [(path, None)]
+    # Series matrix files moved from DATA/SeriesMatrix to series/*/matrix.
+    m = cls.RX_SERIES_MATRIX.match(path)
+    if m:
+      gse_id, name = m.groups()
+      candidates.append(
+        (os.path.join("series", get_stub(gse_id), gse_id, "matrix", name), None))
+    return candidates
+
+  @classmethod
+  def get_path(cls, url):
+    """Return (str, bytes) of existing mirror path of `url` and its SOFT
+    section head or None, or (None, None) if `url` is not mirrored.
+    """
+    mirror_dir = cls.get_mirror_dir()
+    if not mirror_dir:
+      return None, None
+    for path, section in cls.get_candidates(url):
+      path = os.path.join(mirror_dir, path)
+      if os.path.exists(path):
+        return path, section
+    return None, None
+
+  def is_cached(self):
+    """Return bool if `url` is in the mirror or cached by FALLBACK."""
+    if self.fallback is not None:
+      return getattr(self.fallback, "is_cached", lambda: False)()
+    return True
+
+  def read(self):
+    """Return open file of the mirror file, its SOFT section or its listing.
+
+    Returns:
+      file: file-pointer-like line iterator; as compressed as the mirror file,
+        except for SOFT sections which are decompressed
+    """
+    if self.fallback is not None:
+      return self.fallback.read()
+    if os.path.isdir(self.filepath):
+      listing = self.list_dir(self.filepath)
+      self.bytes = len(listing)
+      return io.BytesIO(listing)
+    self.bytes = os.path.getsize(self.filepath)
+    fp = open(self.filepath, "rb")
+    if self.section is None:
+      return fp
+    if self.filepath.endswith(".gz"):
+      fp = gzipper.Gzipper(fileobj=fp, mode='rb')
+    return SoftSection(fp, self.section)
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+"""Str line readers of the byte streams returned by download backends.
+
+Download handles return bytes, as read from the network or the cache. GEO
+text is parsed as str. On Python 2, str is bytes and streams are used as they
+are. On Python 3, TextLines decodes each line, or each block of lines, once
+as latin-1: every byte is one character, so no line fails to decode and
+lengths of lines are their byte lengths, as for byte offsets of headers.
+
+Gzip streams decode whole decompressed chunks instead: open them with
+Gzipper(fileobj=fp, mode='r').
+
+SAMPLE USE:
+  fp = as_text(Download(url).read())
+  for line in fp:
+    print(line)
+"""
+from itertools import islice
+
+# Encoding of GEO text which maps each byte to one character.
+ENCODING = "latin-1"
+
+
+def as_text(fp):
+  """Return str line reader of byte stream `fp`; `fp` if it reads str."""
+  if str is bytes or getattr(fp, "text", False):
+    return fp
+  return TextLines(fp)
+
+
+class TextLines(object):
+  """Line iterator of str decoded from a file pointer of bytes.
+
+  Other attributes, like close() or closed, are those of the stream.
+
+  Attributes:
+    fp: file pointer like iterator of bytes lines
+    text: True: lines are str
+  """
+  text = True
+
+  def __init__(self, fp):
+    self.fp = fp
+
+  def __repr__(self):
+    return "[TextLines of %s (%d)]" % (self.fp, id(self))
+
+  def __getattr__(self, name):
+    return getattr(self.fp, name)
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    return next(self.fp).decode(ENCODING)
+  __next__ = next
+
+  def readline(self):
+    return self.fp.readline().decode(ENCODING)
+
+  def read(self, size=-1):
+    return self.fp.read(size).decode(ENCODING)
+
+  def readlines_block(self, n):
+    """Return list of up to `n` next str lines; [] at EOF."""
+    if hasattr(self.fp, "readlines_block"):
+      lines = self.fp.readlines_block(n)
+    else:
+      lines = list(islice(self.fp, n))
+    return [line.decode(ENCODING) for line in lines]
+
+  def iter_blocks(self, n=1024):
+    """Yield lists of up to `n` str lines until EOF."""
+    while True:
+      lines = self.readlines_block(n)
+      if not lines:
+        return
+      yield lines
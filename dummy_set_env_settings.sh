@@ -4,3 +4,6 @@ export ENV=SERVER
 export CACHE_DIR=$HOME/cache
 export TMP_DIR=$CACHE_DIR
 export LOGFILE=$HOME/app_logs/log.txt
+# Read GEO files from a local mirror of ftp.ncbi.nih.gov/pub/geo, if any.
+#export DOWNLOAD_BACKEND=mirror
+#export GEO_MIRROR_DIR=/data/mirror/pub/geo
@@ -3,6 +3,7 @@
 Script wrapper for geo_api. 
 Does not handle pseudo-super or super studies.
 """
+from __future__ import print_function
 USE_MSG = "USE: python fetch.py GSE_ID [GPL_ID] > mymatrix.tab 2> mymatrix_log.txt"
 
 from geo import *
@@ -27,7 +28,7 @@ def fetch(gse, gpl=None):
     for i, v in enumerate(row):
       if v == "None":
         row[i] = ""
-    print "\t".join(row)
+    print("\t".join(row))
     
     
 if __name__ == "__main__":
@@ -38,5 +39,5 @@ if __name__ == "__main__":
     # GSE id, plus GPL platform for pseudo-studies
     fetch(sys.argv[1], sys.argv[2])
   else:
-    print USE_MSG
+    print(USE_MSG)
     sys.exit(1)
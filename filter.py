@@ -11,9 +11,20 @@ import random
 import time
 import math
 
+# NumPy is optional. It is only required by the "numpy" EQTLFilter engine.
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
 import geo
+import spill
+import metrics
 from logger import Log
 
+# Recognized EQTLFilter row engines.
+ENGINES = ("python", "numpy")
+
 class MalformedFilterError(Exception):
   pass
 
@@ -35,7 +46,7 @@ def temp_file_name(name=""):
     path = os.environ['TMP_DIR']
   else:
     # The temporary, working directory should also be environment sensitive.
-    raise Exception, "Set environment variable TMP_DIR to some path."
+    raise Exception("Set environment variable TMP_DIR to some path.")
   return os.path.join(path, filename)
 
 def get_float(s):
@@ -53,6 +64,25 @@ def get_float(s):
   else:
     return x
 
+def format_float(x):
+  """Return float as str, written the same under Python 2 and Python 3.
+
+  Python 3 writes floats with repr(), Python 2 str() with 12 significant
+  digits. Use the Python 2 format so filtered output does not depend on
+  the interpreter version.
+
+  Args:
+    x: float or None
+  Returns:
+    str of `x` with 12 significant digits, or "None"
+  """
+  if x is None:
+    return "None"
+  s = "%.12g" % x
+  if s.lstrip('-').isdigit():
+    s += ".0"
+  return s
+
 def merge_titles(values):
   """Return merged values as a ';' delimited concatenation.
 
@@ -93,6 +123,106 @@ def merge_floats(values):
   return s
 
 
+class ColumnPlan(object):
+  """Column merge plan compiled once from an EQTLFilter column map.
+
+  Attributes:
+    col_map: {int:set(int)} of disjoint column equivalence classes
+    n_cols: int of number of columns in an unmerged row
+    classes: [(bool, [int])] of (merge, column numbers) per merged column, in
+      merged column order. Columns not to be merged are copied unmerged.
+    gather: np.array int of shape (n merged value columns, max class size) of
+      value column numbers (column number - 1) per merged non-ID column,
+      padded with -1, or None if NumPy is not installed
+  """
+  def __init__(self, col_map, n_cols):
+    """Compile plan.
+
+    Args:
+      col_map: {int:set(int)} of disjoint column equivalence classes
+      n_cols: int of number of columns in an unmerged row
+    """
+    self.col_map = col_map
+    self.n_cols = n_cols
+    self.classes = []
+    consumed_cols = set()
+    for i in range(n_cols):
+      # Ignore consumed columns
+      if i in consumed_cols:
+        continue
+      # Trivially add columns with an undefined equivalence class.
+      if col_map[i] is None:
+        cols = [i]
+        merge = False
+      else:
+        # Keep set iteration order so that values are merged in the same order.
+        cols = list(col_map[i])
+        merge = True
+      self.classes.append((merge, cols))
+      consumed_cols.update(cols)
+
+    # Verify that all columns have been consumed
+    if n_cols != len(consumed_cols) or len(self.classes) != len(col_map):
+      raise MalformedFilterError(("Mismatch in column merge plan. " +
+        "#cols in: row=%d, consumed=%d, classes=%d, col_map=%d") % \
+        (n_cols, len(consumed_cols), len(self.classes), len(col_map)))
+
+    # Value columns exclude the first, ID column.
+    if np is not None:
+      value_classes = [cols for merge, cols in self.classes[1:]]
+      width = max([len(cols) for cols in value_classes] + [1])
+      self.gather = np.empty((len(value_classes), width), dtype=int)
+      self.gather.fill(-1)
+      for k, cols in enumerate(value_classes):
+        self.gather[k, :len(cols)] = [j-1 for j in cols]
+    else:
+      self.gather = None
+
+  def __repr__(self):
+    return "[ColumnPlan %d to %d columns (%d)]" % \
+      (self.n_cols, len(self.classes), id(self))
+
+  def merge(self, row, f_merge):
+    """Return column-merged row.
+
+    Args:
+      row: [value] of column values
+      f_merge: function([values]) with which to merge column class values
+    Return:
+      [value] of merged column values
+    """
+    if len(row) != self.n_cols:
+      raise MalformedFilterError("Row of %d columns does not fit %s." % (len(row), self))
+    return [f_merge([row[j] for j in cols]) if merge else row[cols[0]]
+            for merge, cols in self.classes]
+
+  def merge_block(self, values, present):
+    """Return merged block of value columns like merge(row, merge_floats).
+
+    Values are summed one class member at a time for all classes and rows,
+    in the same order as merge_floats(), so that averages are identical.
+
+    Args:
+      values: np.array float64 of shape (n rows, n_cols-1) of non-ID values
+      present: np.array bool mask of present values in `values`
+    Returns:
+      (np.array float64, np.array bool) of merged values and mask of present
+        merged values; merged values with no present values are NaN
+    """
+    shape = (values.shape[0], self.gather.shape[0])
+    v_sum = np.zeros(shape, dtype=np.float64)
+    n_sum = np.zeros(shape, dtype=int)
+    for r in range(self.gather.shape[1]):
+      idx = self.gather[:, r]
+      k = idx >= 0
+      p = present[:, idx[k]]
+      v_sum[:, k] += np.where(p, values[:, idx[k]], 0.0)
+      n_sum[:, k] += p
+    merged_present = n_sum > 0
+    merged = np.where(merged_present, v_sum / np.maximum(n_sum, 1), np.nan)
+    return merged, merged_present
+
+
 class EQTLFilter(Filter):
   """Filter a compiled GSE dataset.
    Consider adding a "read_data" function; I may not need to emit lines.
@@ -101,37 +231,65 @@ class EQTLFilter(Filter):
     gse: geo.GSE populated study data instance 
     col_titles: [str] of column titles of filtered data matrix
     col_map: {int:set(int)} of disjoint column equivalence classes
+    col_plan: ColumnPlan compiled from col_map or None if not yet compiled
     rows_filtered: [str] of line ids filtered for missing a gene symbol
     rows_per_gene: {str: set(str)} of gene symbols to row ids
     row_stats: {str: {'num_values': int, 'mean': float, 'std': float}} per rowID
       note: only rows not in rows_filtered are in row_stats
+    row_nums: {str: int} of row ID to row number of rows in row_stats; ties
+      in row selection go to the first row, and without a spill, selected
+      rows are re-read by row number
+    engine: str in ENGINES of the row engine used in filter pass 1
+    spill: bool if filter pass 1 spills rows to a temporary file; if False,
+      the final pass re-reads selected rows by byte offset from the series
+      matrix files, seeking where they are seekable and otherwise in one
+      forward pass
+    read_threads: int of threads to decompress cache files in filter pass 1
   """
-  def __init__(self, gse, merge_cols=True, percentile=.75):
+  # Number of rows parsed into one float matrix by the "numpy" engine.
+  ROW_BLOCK_SIZE = 2048
+  
+  def __init__(self, gse, merge_cols=True, percentile=.75, engine="python",
+               spill=True, read_threads=1):
     """Initialize filter. Requires populated gse.
 
     Args:
       gse: GSE instance associated with row_iter
       merge_cols: bool if to merge columns if able
       percentile: float 0<x<=1 of top percent by std to keep
+      engine: str in ENGINES; "numpy" computes row statistics in row blocks
+      spill: bool to spill rows in pass 1; if False, keep only row statistics
+        and row offsets, and re-read the selected rows in the final pass
+      read_threads: int of threads to decompress block-compressed cache files
+        of the study ahead of filter pass 1
     """
     # 1. Require that GSE is populated and is of correct type.
     # ==========
     if not gse.populated:
-      raise geo.NotPopulatedError, "%s must be populated to filter rows." % gse
+      raise geo.NotPopulatedError("%s must be populated to filter rows." % gse)
     if gse.type != "eQTL":
-      raise geo.StudyTypeMismatch, "%s must be type 'eQTL', not '%s'." % \
-        (gse, gse.type)
+      raise geo.StudyTypeMismatch("%s must be type 'eQTL', not '%s'." %
+        (gse, gse.type))
+    if engine not in ENGINES:
+      raise ValueError("Unknown engine '%s'. Choose from %s." % (engine, ENGINES))
+    if engine == "numpy" and np is None:
+      raise ImportError("Engine 'numpy' requires NumPy, which is not installed.")
 
     # 2. Set Attributes.
     # ==========
     self.gse = gse
     self.col_titles = self.gse.col_titles[:]
     self.col_map = None
+    self.col_plan = None
     self.rows_filtered = []
     self.rows_per_gene = {}
     self.row_stats = {}
+    self.row_nums = {}
     self.merge_cols = merge_cols
     self.percentile = percentile
+    self.engine = engine
+    self.spill = spill
+    self.read_threads = read_threads
     
     # 3. Get column map for column merging.
     # ==========
@@ -140,22 +298,29 @@ class EQTLFilter(Filter):
 
     # If there are more samples than unique subjects, then create column map.
     if self.merge_cols and n_samples > n_uniques:
-      self.col_map = self._make_col_map()
       rx_str = self.gse.parameters['rx_gsm_subject_str']
-      Log.info(("Created column merge map for %s (%d samples to %d subjects)" +\
-        " with rx '%s'") % \
-        (self.gse, n_samples, n_uniques, rx_str))
+      # Reuse the compiled plan of previous filters of the same study.
+      if rx_str in self.gse.col_plans:
+        self.col_plan = self.gse.col_plans[rx_str]
+        self.col_map = self.col_plan.col_map
+        Log.info("Reused column merge plan %s for %s.", self.col_plan, self.gse)
+      else:
+        self.col_map = self._make_col_map()
+        self.col_plan = ColumnPlan(self.col_map, len(self.col_titles))
+        self.gse.col_plans[rx_str] = self.col_plan
+        Log.info("Created column merge map for %s (%d samples to %d subjects)"
+          " with rx '%s'", self.gse, n_samples, n_uniques, rx_str)
       # Verify that column merge map is reasonable (num uniques + 1 for ID column)
       if len(self.col_map) != n_uniques + 1:
-        Log.warning("Column merge map has %d classes, expected %d in %s." % \
-                    (len(self.col_map), n_uniques, self))
+        Log.warning("Column merge map has %d classes, expected %d in %s.",
+                    len(self.col_map), n_uniques, self)
         
     # No column merging scheme can exist. Do not create a col_map.
     else:
       # Retrieve the regular expression used
       rx_str = self.gse.parameters['rx_gsm_subject_str']
-      Log.info("No column merge map created for %s using rx '%s'. Merge_cols flag is %s" % \
-        (self.gse, rx_str, self.merge_cols))
+      Log.info("No column merge map created for %s using rx '%s'. Merge_cols flag is %s",
+               self.gse, rx_str, self.merge_cols)
 
   def __repr__(self):
     return "[EQTLFilter => %s (%d)]" % (self.gse, id(self))
@@ -169,13 +334,13 @@ class EQTLFilter(Filter):
     Returns:
       *[str] of filtered rows of data split by columns
     """
-    Log.info("Initiated filter %s for rows of %s" % (self, self.gse))
+    Log.info("Initiated filter %s for rows of %s", self, self.gse)
     if self.col_map:
-      Log.info("self.col_map exists. Merge %d to %d columns for %s" % \
-               (len(self.col_titles), len(self.col_map), self))
+      Log.info("self.col_map exists. Merge %d to %d columns for %s",
+               len(self.col_titles), len(self.col_map), self)
     else:
-      Log.info("No col_map. Will not merge %d columns for %s." % \
-               (len(self.col_titles), self))
+      Log.info("No col_map. Will not merge %d columns for %s.",
+               len(self.col_titles), self)
 
     # 0. Determine best gene name column in case GENE_SYMBOL does not exist.
     # ==========
@@ -192,11 +357,14 @@ class EQTLFilter(Filter):
         break
     # Verify that a column was chosen to identify the row.
     if gene_symbol_name:
-      Log.info("Selected column '%s=>%s' to best represent gene name for %s." %\
-        (gene_symbol_name, actual_column_name, self.gse.platform))
+      Log.info("Selected column '%s=>%s' to best represent gene name for %s.",
+        gene_symbol_name, actual_column_name, self.gse.platform)
     else:
-      raise MalformedFilterError, "Cannot select gene symbol column from %s" % \
-        (self.gse.platform)
+      raise MalformedFilterError("Cannot select gene symbol column from %s" %
+        (self.gse.platform))
+    # Only special columns like gene symbols are read from GPL row descriptions.
+    if not self.gse.platform.loaded:
+      self.gse.platform.load(special_only=True)
     
     # 1. Update column titles accounting for merged columns.
     # ==========
@@ -207,20 +375,175 @@ class EQTLFilter(Filter):
     # self.col_titles[0] should always be "ID_REF"
     col_titles_prefix = ["ID_REF", gene_symbol_name, "NUM_VALUES", "MEAN", "STD"]
     self.col_titles = col_titles_prefix + self.col_titles[1:]
-    Log.info("Added %s, NUM_VALUES, MEAN, STD to col titles for %s." %\
-             (gene_symbol_name, self))
+    Log.info("Added %s, NUM_VALUES, MEAN, STD to col titles for %s.",
+             gene_symbol_name, self)
              
-    # Open new temporary file. XXX RENAME
-    filepath = temp_file_name("%s.rowmerge" % self.gse.id)
-    fp_out = open(filepath, "w")
+    # Open series matrix files. Without a spill, record the decompressed byte
+    #   offset of each row to re-read selected rows.
+    index = None
+    if not self.spill:
+      index = geo.RowIndex()
+    study_rows = self.gse.open_rows(index, self.read_threads)
+    spill_rows = self.spill
+    if index is not None and not index.complete:
+      Log.warning("Cannot re-read selected rows of %s by offset (%s). Spilling rows instead for %s.",
+                  self.gse, index.reason, self)
+      spill_rows = True
+
+    # Open new temporary spill file of (NUM_VALUES, MEAN, STD, values...) rows.
+    # Without a spill, only row statistics are kept through filter pass 1.
+    n_spill_cols = len(self.col_titles) - 2
+    if spill_rows:
+      filepath = temp_file_name("%s.rowmerge" % self.gse.id)
+      fp_out = spill.SpillWriter(filepath, n_spill_cols)
+    else:
+      fp_out = None
 
-    # 2: @DATAPASS 1: Merge columns, add gene symbol, filter non-genes.
-    # ==========
-    Log.info(("Started filter 1 in %s for %s: find and add gene, merge cols. " +
-             "(This may take a while.)") % (self, self.gse))
+    # Spill files are deleted when the final pass ends or the rows are closed.
+    rows = None
+    try:
+      # 2: @DATAPASS 1: Merge columns, add gene symbol, filter non-genes.
+      # ==========
+      Log.info("Started filter 1 in %s for %s: find and add gene, merge cols. "
+               "(This may take a while.)", self, self.gse)
+      # Pass 1 time includes reading rows, as stage "gse.get_rows".
+      with metrics.stage("filter.pass1") as stage:
+        if self.engine == "numpy":
+          num_rows = self._filter_rows_numpy(study_rows, gene_symbol_name, fp_out)
+        else:
+          num_rows = self._filter_rows(study_rows, gene_symbol_name, fp_out)
+        if fp_out is not None:
+          fp_out.close()
+        stage.rows = num_rows
+
+      # Log results of filter pass 1
+      # ==========
+      n = len(self.rows_filtered)
+      n_gene_rows = num_rows-n
+      mean_rows_per_gene = float(num_rows-n)/len(self.rows_per_gene)
+    
+      if num_rows != self.gse.est_num_row:
+        Log.warning("Num rows read(%d) not num rows expected(%d) for %s",
+                    num_rows, self.gse.est_num_row, self)
+      Log.info("Filter 1 complete for %s. "
+        "%d of %d (%.2f%%) rows removed for no gene symbol. %d rows remain.",
+        self, n, num_rows, (n/float(num_rows))*100, n_gene_rows)
+      Log.info("Number of unique genes: %d, %.1f mean num rows per gene.",
+        len(self.rows_per_gene), mean_rows_per_gene)
+
+      # 3: Choose representative genes from self.row_stats and self.rows_per_gene
+      # ==========
+      # Row IDs are returned sorted by row standard deviation in decreasing order.
+      with metrics.stage("filter.select") as stage:
+        if self.engine == "numpy":
+          selected_row_ids = self._select_gene_rows_numpy()
+        else:
+          selected_row_ids = self._select_gene_rows()
+        stage.rows = len(selected_row_ids)
+
+      n_single_gene_rows = len(selected_row_ids)
+      Log.info("Selected %d of %d rows for %d genes by maximum row mean.",
+        n_single_gene_rows, n_gene_rows, len(self.rows_per_gene))
+    
+      # Select top percentile by std. Convert type to set for easier membership tests.
+      x = int(len(selected_row_ids)*self.percentile)
+      selected_row_ids = set(selected_row_ids[:x])
+      threshold_num_rows = len(selected_row_ids)
+      assert(x == threshold_num_rows)
+      Log.info("Selected top %d%% of rows (%d of %d) by standard deviation.",
+        self.percentile*100, threshold_num_rows, n_single_gene_rows)
       
+      # FINAL PASS: YIELD FILTERED LINES
+      # ===========
+      # Yield (modified) column titles.
+      yield self.col_titles[:]
+    
+      # Only yield rows whose row_id is in the selected_row_ids list.
+      if spill_rows:
+        rows = self._read_spill(filepath, n_spill_cols, selected_row_ids)
+      else:
+        rows = self._reread_rows(gene_symbol_name, selected_row_ids, index)
+      num_yielded_rows = 0
+      for row in metrics.timed("filter.pass2", rows):
+        num_yielded_rows += 1
+        yield row
+
+      # All lines yielded. Check number of lines yielded with expected value.
+      if num_yielded_rows != threshold_num_rows:
+        Log.warning("%d yielded rows != %d expected number of rows.",
+          num_yielded_rows, threshold_num_rows)
+      else:
+        Log.info("Filter complete. yielded %d rows.", num_yielded_rows)
+    finally:
+      # Close the spill reader before its files are deleted.
+      if rows is not None:
+        rows.close()
+      if fp_out is not None:
+        fp_out.close()
+        spill.remove(filepath)
+      
+      
+  def _read_spill(self, filepath, n_cols, selected_row_ids):
+    """Yield selected rows from the spill file written in filter pass 1.
+
+    Args:
+      filepath: str of path to spill file
+      n_cols: int of number of floats per spilled row
+      selected_row_ids: set(str) of row IDs to yield
+    Yields:
+      [str] of filtered row columns
+    """
+    fp = spill.SpillReader(filepath, n_cols)
+    try:
+      for i, row_id in enumerate(fp.row_ids):
+        if row_id in selected_row_ids:
+          values = fp.read(i)
+          yield [row_id, fp.gene_syms[i], str(int(values[0]))] + [format_float(x) for x in values[1:]]
+    finally:
+      fp.close()
+
+  def _reread_rows(self, gene_symbol_name, selected_row_ids, index):
+    """Yield selected rows read again by byte offset, as without a spill.
+
+    Only selected rows are read, merged and converted to floats. Their
+    statistics are taken from self.row_stats computed in filter pass 1.
+
+    Args:
+      gene_symbol_name: str of special GPL column name used as the gene name
+      selected_row_ids: set(str) of row IDs to yield
+      index: geo.RowIndex of rows recorded in filter pass 1
+    Yields:
+      [str] of filtered row columns
+    """
+    row_nums = sorted([self.row_nums[row_id] for row_id in selected_row_ids])
+    Log.info("Re-reading %d selected rows of %s by offset without a spill for %s.",
+      len(row_nums), self.gse, self)
+    for n, row in zip(row_nums, self.gse.get_rows_at(index, row_nums)):
+      row_id = row[0]
+      if self.row_nums.get(row_id) != n:
+        raise MalformedFilterError("Re-read row %s at row %d, not a selected row of filter pass 1 for %s." %
+          (row_id, n, self))
+      gene_sym = self.gse.platform.get_column(row_id, gene_symbol_name)
+      if self.col_map:
+        row = self._merge_cols(row, merge_floats)
+      else:
+        row = [get_float(x) for x in row]
+      stats = self.row_stats[row_id]
+      yield [row_id, gene_sym, str(stats['num_values'])] + [format_float(x) for x in
+        [stats['mean'], stats['std']] + row[1:]]
+
+  def _filter_rows(self, rows, gene_symbol_name, fp_out):
+    """Filter pass 1 one row at a time. Spill surviving rows to `fp_out`.
+
+    Args:
+      rows: iter of [str] of study rows
+      gene_symbol_name: str of special GPL column name used as the gene name
+      fp_out: spill.SpillWriter of temporary spill file or None for no spill
+    Returns:
+      int of number of rows read
+    """
     num_rows = 0
-    for row in self.gse.get_rows():
+    for row in rows:
       # TODO: Add status reporting to console
       num_rows += 1
 
@@ -232,6 +555,7 @@ class EQTLFilter(Filter):
         continue # skip this row
       else:
         self.rows_per_gene.setdefault(gene_sym, set()).add(row_id)
+      self.row_nums[row_id] = num_rows - 1
       
       # Merge columns using column mapping of series matrix columns.
       # Also, transform row into "floats" and None
@@ -239,11 +563,11 @@ class EQTLFilter(Filter):
         # XXX_merge_cols is slow, perhaps due to float conversions.
         row = self._merge_cols(row, merge_floats)
       else:
-        row = map(get_float, row)
+        row = [get_float(x) for x in row]
 
       # Compute mean and standard deviation of all non-ID columns
       # check for None specifically since a valid value could be 0
-      filtered_row = filter(lambda x: x is not None, row[1:])
+      filtered_row = [x for x in row[1:] if x is not None]
       std = calc_std(filtered_row)
       mean = calc_mean(filtered_row)
       num_values = len(filtered_row)
@@ -251,86 +575,163 @@ class EQTLFilter(Filter):
       self.row_stats[row_id] = \
         {'num_values': num_values, 'mean': mean, 'std': std}
 
-      # Insert (gene_sym, size, mean, std) into second column
-      row = [row_id , gene_sym, num_values, mean, std] + row[1:]
+      # Spill (size, mean, std) and values as floats, indexed by row ID.
+      if fp_out is not None:
+        fp_out.write(row_id, gene_sym, [num_values, mean, std] + row[1:])
+    return num_rows
 
-      # Write row to temporary file.
-      # TODO: I may want to compress my row by converting it to a pickle.
-      # pickling a list of floats uses 2/3 space and takes 1/2 compute time.
-      fp_out.write("\t".join(map(str, row)))
-      fp_out.write("\n")
-    fp_out.close()
+  def _select_gene_rows(self):
+    """Return the highest mean row ID per gene, sorted by decreasing std.
 
-    # Log results of filter pass 1
-    # ==========
-    n = len(self.rows_filtered)
-    n_gene_rows = num_rows-n
-    mean_rows_per_gene = float(num_rows-n)/len(self.rows_per_gene)
-    
-    if num_rows != self.gse.est_num_row:
-      Log.warning("Num rows read(%d) not num rows expected(%d) for %s" % \
-                  (num_rows, self.gse.est_num_row, self))
-    Log.info(("Filter 1 complete for %s. " + \
-      "%d of %d (%.2f%%) rows removed for no gene symbol. %d rows remain.") % \
-      (self, n, num_rows, (n/float(num_rows))*100, n_gene_rows))
-    Log.info("Number of unique genes: %d, %.1f mean num rows per gene." % \
-      (len(self.rows_per_gene), mean_rows_per_gene))
-
-    # 3: Choose representative genes from self.row_stats and self.rows_per_gene
-    # ==========
-    # select all rows for a gene. If a gene 
+    Ties in mean within a gene and in std go to the first row by row number.
+
+    Returns:
+      [str] of row IDs, one per gene in self.rows_per_gene
+    """
+    row_stats, row_nums = self.row_stats, self.row_nums
     selected_row_ids = []
     for gene, row_ids in self.rows_per_gene.items():
       # If only a single row for this gene exists, choose it.
       if len(row_ids) == 1:
-        best_row_id = row_ids.pop()
-      # Else, choose row with the highest mean value. 
+        best_row_id = next(iter(row_ids))
+      # Else, choose row with the highest mean value, the first of equals.
       else:
-        s = sorted(row_ids, key=lambda x: self.row_stats[x]['mean'])
-        best_row_id = s[-1]
+        best_row_id = max(row_ids,
+          key=lambda x: (row_stats[x]['mean'], -row_nums[x]))
       # Add this row_id to the accepted list
       selected_row_ids.append(best_row_id)
 
-    n_single_gene_rows = len(selected_row_ids)
-    Log.info("Selected %d of %d rows for %d genes by maximum row mean." % \
-      (n_single_gene_rows, n_gene_rows, len(self.rows_per_gene)))
-
     # Sort row_ids by row standard deviation in decreasing order.
-    selected_row_ids.sort(key=lambda x: self.row_stats[x]['std'], reverse=True)
-    
-    # Select top percentile by std. Convert type to set for easier membership tests.
-    x = int(len(selected_row_ids)*self.percentile)
-    selected_row_ids = set(selected_row_ids[:x])
-    threshold_num_rows = len(selected_row_ids)
-    assert(x == threshold_num_rows)
-    Log.info("Selected top %d%% of rows (%d of %d) by standard deviation." % 
-      (self.percentile*100, threshold_num_rows, n_single_gene_rows))
-      
-    # FINAL PASS: YIELD FILTERED LINES
-    # ===========
-    # Open temporary file generated in first pass.
-    fp = open(filepath, "r")
+    selected_row_ids.sort(key=lambda x: (-row_stats[x]['std'], row_nums[x]))
+    return selected_row_ids
 
-    # Yield (modified) column titles.
-    yield self.col_titles[:]
-    
-    # For each line, only yield if the row_id is in the selected_row_ids list.
-    num_yielded_rows = 0
-    for line in fp:
-      row = line.strip().split("\t")
+  def _filter_rows_numpy(self, rows, gene_symbol_name, fp_out):
+    """Filter pass 1 in blocks of rows parsed into float64 matrices.
+
+    Spills the same rows as self._filter_rows(). Per row statistics are also
+    kept as arrays for self._select_gene_rows_numpy().
+
+    Args:
+      rows: iter of [str] of study rows
+      gene_symbol_name: str of special GPL column name used as the gene name
+      fp_out: spill.SpillWriter of temporary spill file or None for no spill
+    Returns:
+      int of number of rows read
+    """
+    self._block_row_ids = []
+    self._block_stats = []
+    gene_codes = {}
+    num_rows = 0
+    block, syms = [], []
+    for row in rows:
+      num_rows += 1
       row_id = row[0]
-      if row_id in selected_row_ids:
-        num_yielded_rows += 1
-        yield row
+      gene_sym = self.gse.platform.get_column(row_id, gene_symbol_name)
+      if not gene_sym:
+        self.rows_filtered.append(row_id)
+        continue
+      self.rows_per_gene.setdefault(gene_sym, set()).add(row_id)
+      self.row_nums[row_id] = num_rows - 1
+      block.append(row)
+      syms.append(gene_sym)
+      if len(block) >= self.ROW_BLOCK_SIZE:
+        self._filter_block_numpy(block, syms, gene_codes, fp_out)
+        block, syms = [], []
+    if block:
+      self._filter_block_numpy(block, syms, gene_codes, fp_out)
+    return num_rows
+
+  def _filter_block_numpy(self, rows, syms, gene_codes, fp_out):
+    """Merge, compute statistics for, and write one block of rows.
+
+    Args:
+      rows: [[str]] of unmerged series matrix rows
+      syms: [str] of gene symbols aligned to `rows`
+      gene_codes: {str: int} of gene symbol to integer gene code; updated
+      fp_out: spill.SpillWriter of temporary spill file or None for no spill
+    """
+    row_ids = [row[0] for row in rows]
+    values, present = self._parse_block(rows)
+    if self.col_map:
+      values, present = self.col_plan.merge_block(values, present)
+
+    # Sum left to right as calc_mean and calc_std do so that the statistics
+    #   are identical to those of the python engine, not merely close.
+    num_values = present.sum(axis=1)
+    if (num_values < 2).any():
+      i = int(np.argmin(num_values))
+      raise ZeroDivisionError("Row %s has %d values; cannot compute std in %s." %
+        (row_ids[i], num_values[i], self))
+    x = np.where(present, values, 0.0)
+    means = np.add.accumulate(x, axis=1)[:, -1] / num_values
+    d = np.where(present, values - means[:, np.newaxis], 0.0)
+    stds = np.sqrt(np.add.accumulate(d * d, axis=1)[:, -1] / (num_values - 1))
+
+    for row_id, n, mean, std in \
+          zip(row_ids, num_values.tolist(), means.tolist(), stds.tolist()):
+      self.row_stats[row_id] = {'num_values': n, 'mean': mean, 'std': std}
+    codes = [gene_codes.setdefault(sym, len(gene_codes)) for sym in syms]
+    self._block_row_ids.extend(row_ids)
+    self._block_stats.append((np.array(codes), means, stds))
+
+    # Spill the block exactly as self._filter_rows() spills each row.
+    if fp_out is not None:
+      block = np.empty((len(rows), values.shape[1] + 3), dtype=np.float64)
+      block[:, 0] = num_values
+      block[:, 1] = means
+      block[:, 2] = stds
+      block[:, 3:] = np.where(present, values, spill.MISSING)
+      fp_out.write_block(row_ids, syms, block)
+
+  def _parse_block(self, rows):
+    """Return float64 matrix of non-ID values and mask of present values.
+
+    Values that get_float() cannot convert are NaN in the matrix and False in
+    the mask. The mask distinguishes missing values from literal "nan" values.
+
+    Args:
+      rows: [[str]] of series matrix rows of equal length
+    Returns:
+      (np.array float64, np.array bool) each of shape (len(rows), n_cols-1)
+    """
+    n_cols = len(self.gse.col_titles)
+    values = np.empty((len(rows), n_cols-1), dtype=np.float64)
+    present = np.ones(values.shape, dtype=bool)
+    for i, row in enumerate(rows):
+      if len(row) != n_cols:
+        raise MalformedFilterError("Row %s has %d columns, expected %d, in %s. Use engine 'python'." %
+          (row[0], len(row), n_cols, self))
+      try:
+        values[i] = [float(x) for x in row[1:]]
+      except ValueError:
+        floats = [get_float(x) for x in row[1:]]
+        present[i] = [x is not None for x in floats]
+        values[i] = [np.nan if x is None else x for x in floats]
+    return values, present
+
+  def _select_gene_rows_numpy(self):
+    """Return self._select_gene_rows() computed on row statistic arrays.
+
+    Ties go to the first row, as in self._select_gene_rows(): arrays are in
+    row order.
+
+    Returns:
+      [str] of row IDs, one per gene in self.rows_per_gene
+    """
+    if not self._block_stats:
+      return []
+    codes, means, stds = [np.concatenate(a) for a in zip(*self._block_stats)]
+    # Sort rows by gene, then by mean, then by decreasing row order. The last
+    #   row per gene has the max mean and is the first of equal means.
+    rows = np.arange(len(codes))
+    order = np.lexsort((-rows, means, codes))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = codes[order][1:] != codes[order][:-1]
+    best = order[last]
+    # Sort by row standard deviation in decreasing order, then by row order.
+    best = best[np.lexsort((best, -stds[best]))]
+    return [self._block_row_ids[i] for i in best.tolist()]
 
-    # All lines yielded. Check number of lines yielded with expected value.
-    if num_yielded_rows != threshold_num_rows:
-      Log.warning("%d yielded rows != %d expected number of rows." % \
-        (num_yielded_rows, threshold_num_rows))
-    else:
-      Log.info("Filter complete. yielded %d rows." % (num_yielded_rows))
-      
-      
   def _merge_cols(self, row, f_merge):
     """Return column-merged row.
 
@@ -342,40 +743,12 @@ class EQTLFilter(Filter):
     """
     # Verify that the row aligns with the column map and that the map exists.
     if not self.col_map:
-      raise MalformedFilterError, \
-        "_merge_cols() called, but col_map does not exist for %s" % self
-    
-    # Merge columns per row.
-    new_row = []
-    consumed_cols = set()
-    # For each column in this row from the left:
-    for i, col in enumerate(row):
-        
-      # Ignore consumed columns
-      if i in consumed_cols:
-        continue
-        
-      # Trivially add columns with an undefined equivalence class.
-      if self.col_map[i] is None:
-        consumed_cols.add(i)
-        new_row.append(col)
-        continue
-
-      # Merge all values of equivalence class and append aggregate value.
-      s = [row[j] for j in self.col_map[i]]
-      v = f_merge(s)
-      new_row.append(v)
-      # Consume all columns in equivalence class.
-      consumed_cols.update(self.col_map[i])
-
-    # Verify that all columns in row have been consumed
-    if len(row) != len(consumed_cols) or len(new_row) != len(self.col_map):
-      raise MalformedFilterError, \
-        ("Mismatch in column merge for %s. " % self) + \
-        "#cols in: row=%d, consumed=%d, new_row=%d, col_map=%d" % \
-        (len(row), len(consumed_cols), len(new_row), len(self.col_map))
-          
-    return new_row
+      raise MalformedFilterError("_merge_cols() called, but col_map does not exist for %s" %
+        self)
+    # Compile the column map once, not once per row.
+    if self.col_plan is None:
+      self.col_plan = ColumnPlan(self.col_map, len(self.gse.col_titles))
+    return self.col_plan.merge(row, f_merge)
     
   def _make_col_map(self):
     """Return column equivalence class map used in per-row column merging.
@@ -383,6 +756,10 @@ class EQTLFilter(Filter):
     Returns:
       {int, set(int)} of (unmodified) row id equivalence classes
     """
+    # Map each column title to its first col num, as list.index() would.
+    col_idx = {}
+    for i, title in enumerate(self.col_titles):
+      col_idx.setdefault(title, i)
     # Set of columns already mapped.
     consumed_cols = set()
     # int=>set(int) of first col num representative to its equivalence class.
@@ -392,13 +769,20 @@ class EQTLFilter(Filter):
       if title not in self.gse.samples:
         col_map[i] = None
         consumed_cols.add(i)
+      # Column was already mapped with the other replicates of its subject.
+      elif i in consumed_cols:
+        continue
       else:
         # Select sample's subject from GSM object given this column title.
         subject = self.gse.samples[title].subject
         # For each GSM ID mapped to this subject:
         for gsm in self.gse.subject_gsms[subject]:
           # Get corresponding col num j for this gsm. j may equal i.
-          j = self.col_titles.index(gsm)
+          try:
+            j = col_idx[gsm]
+          except KeyError:
+            raise MalformedFilterError("%s of subject '%s' not in column titles of %s." %
+              (gsm, subject, self.gse))
           # Ignore consumed columns.
           if j in consumed_cols:
             continue
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+"""Write synthetic GEO study files for offline tests and benchmarks.
+
+Writes a GSE brief, a GPL quick view and data table, and gzip compressed
+series matrix files of an eQTL expression study into a fixture directory, in
+the layout served by download.fixture_download.FixtureDownload. Values are
+pseudo-random but reproducible from `seed`.
+
+Samples are replicates of subjects, titled like "subject3_rep2", and are
+split by columns into `files` series matrix files as GEO splits large studies.
+Populate the study with GSE parameter 'rx_gsm_subject_str' set to
+RX_SUBJECT_STR to merge replicates.
+
+SAMPLE USE:
+$ python fixtures.py fixtures probes=20000 samples=40 replicates=2 files=2
+"""
+from __future__ import print_function
+USE_MSG = """USE: python fixtures.py fixture_dir [options]
+
+OPTIONS:
+  gse_id=str: GSE ID of study [default=GSE90001]
+  gpl_id=str: GPL ID of platform [default=GPL90001]
+  probes=int: number of probe rows [default=20000]
+  samples=int: number of sample columns [default=40]
+  replicates=int: number of samples per subject [default=2]
+  missing=float: fraction of missing values [default=0.01]
+  files=int: number of series matrix files to split samples into [default=1]
+  seed=int: random seed [default=0]
+"""
+
+import sys
+import os
+import gzip
+import codecs
+import random
+
+from geo import GSE, GPL
+from download.fixture_download import FixtureDownload
+
+# GSE parameter 'rx_gsm_subject_str' to split sample titles to (subject, rep).
+RX_SUBJECT_STR = r"([^_]+)(?:_rep(\d+))?"
+# Missing value as written in series matrix files.
+MISSING = "null"
+# Fraction of probes without a gene symbol.
+NO_GENE_RATE = 0.05
+# Mean number of probes per gene.
+PROBES_PER_GENE = 2
+# Date of all fixture records.
+STATUS = "Public on Jan 01 2012"
+GPL_COLUMNS = [
+  ("ID", "Probe identifier"),
+  ("Symbol", "Gene symbol"),
+  ("Entrez_Gene_ID", "Entrez gene identifier"),
+  ("RefSeq_ID", "RefSeq accession"),
+  ("Probe_Sequence", "Probe sequence"),
+]
+
+
+def get_series_filenames(gse_id, files):
+  """Return [str] of series matrix file names of a study split in `files`."""
+  if files == 1:
+    return ["%s_series_matrix.txt.gz" % gse_id]
+  return ["%s_series_matrix-%d.txt.gz" % (gse_id, i+1) for i in range(files)]
+
+
+def make_probes(rnd, probes):
+  """Return [(str, str, str, str)] of probe ID, gene symbol, Entrez ID, RefSeq."""
+  n_genes = max(probes // PROBES_PER_GENE, 1)
+  rows = []
+  for i in range(probes):
+    probe_id = "ILMN_%07d" % (i+1)
+    if rnd.random() < NO_GENE_RATE:
+      rows.append((probe_id, "", "", ""))
+      continue
+    gene = rnd.randint(1, n_genes)
+    rows.append((probe_id, "GENE%d" % gene, str(100000 + gene), "NM_%06d" % gene))
+  return rows
+
+
+def make_samples(gse_id, samples, replicates):
+  """Return [(str, str)] of GSM ID and title of each sample."""
+  base = int(gse_id[3:]) * 1000
+  rows = []
+  for i in range(samples):
+    subject = "subject%d" % (i // replicates + 1)
+    if replicates > 1:
+      title = "%s_rep%d" % (subject, i % replicates + 1)
+    else:
+      title = subject
+    rows.append(("GSM%d" % (base + i + 1), title))
+  return rows
+
+
+def write_gse_brief(fp, gse_id, gpl_id, samples):
+  """Write GSE brief text of study with [(gsm_id, title)] `samples`."""
+  fp.write("^SERIES = %s\n" % gse_id)
+  fp.write("!Series_title = Synthetic expression study %s\n" % gse_id)
+  fp.write("!Series_geo_accession = %s\n" % gse_id)
+  fp.write("!Series_status = %s\n" % STATUS)
+  fp.write("!Series_summary = Synthetic expression profiles of replicated subjects.\n")
+  fp.write("!Series_type = Expression profiling by array\n")
+  fp.write("!Series_platform_id = %s\n" % gpl_id)
+  for gsm_id, title in samples:
+    fp.write("!Series_sample_id = %s\n" % gsm_id)
+
+
+def write_gpl_header(fp, gpl_id):
+  """Write GPL header lines through the column title line."""
+  fp.write("^PLATFORM = %s\n" % gpl_id)
+  fp.write("!Platform_title = Synthetic expression beadchip %s\n" % gpl_id)
+  fp.write("!Platform_geo_accession = %s\n" % gpl_id)
+  fp.write("!Platform_status = %s\n" % STATUS)
+  fp.write("!Platform_technology = oligonucleotide beads\n")
+  fp.write("!Platform_organism = Homo sapiens\n")
+  fp.write("!Platform_description = Synthetic gene expression array.\n")
+  for title, desc in GPL_COLUMNS:
+    fp.write("#%s = %s\n" % (title, desc))
+  fp.write("!platform_table_begin\n")
+  fp.write("\t".join([title for title, desc in GPL_COLUMNS]) + "\n")
+
+
+def write_gpl_data(fp, gpl_id, probes, rnd):
+  """Write GPL data table of `probes`."""
+  write_gpl_header(fp, gpl_id)
+  for probe in probes:
+    seq = "".join([rnd.choice("ACGT") for i in range(50)])
+    fp.write("\t".join(probe + (seq,)) + "\n")
+  fp.write("!platform_table_end\n")
+
+
+def write_series_matrix(fp, gse_id, gpl_id, probes, samples, values):
+  """Write series matrix file of `samples` columns of `values`.
+
+  Args:
+    fp: file to write
+    gse_id: str of GSE ID
+    gpl_id: str of GPL ID
+    probes: [tuple] of probe rows, probe ID first
+    samples: [(str, str)] of GSM ID and title of the columns of this file
+    values: [[str]] of row of values of `samples` per probe
+  """
+  def sample_line(key, values):
+    fp.write("!Sample_%s\t%s\n" % (key, "\t".join(['"%s"' % v for v in values])))
+
+  fp.write('!Series_title\t"Synthetic expression study %s"\n' % gse_id)
+  fp.write('!Series_geo_accession\t"%s"\n' % gse_id)
+  fp.write('!Series_status\t"%s"\n' % STATUS)
+  fp.write('!Series_platform_id\t"%s"\n' % gpl_id)
+  fp.write("\n")
+  sample_line("title", [title for gsm_id, title in samples])
+  sample_line("geo_accession", [gsm_id for gsm_id, title in samples])
+  sample_line("status", [STATUS] * len(samples))
+  sample_line("source_name_ch1", ["peripheral blood"] * len(samples))
+  sample_line("organism_ch1", ["Homo sapiens"] * len(samples))
+  sample_line("characteristics_ch1",
+    ["gender: %s" % ("female", "male")[int(gsm_id[3:]) % 2]
+     for gsm_id, title in samples])
+  sample_line("characteristics_ch1", ["tissue: blood"] * len(samples))
+  sample_line("platform_id", [gpl_id] * len(samples))
+  sample_line("data_row_count", [len(probes)] * len(samples))
+  fp.write("!series_matrix_table_begin\n")
+  fp.write('"ID_REF"\t%s\n' % "\t".join(['"%s"' % gsm_id for gsm_id, title in samples]))
+  for probe, row in zip(probes, values):
+    fp.write('"%s"\t%s\n' % (probe[0], "\t".join(row)))
+  fp.write("!series_matrix_table_end\n")
+
+
+def make_values(rnd, n_probes, n_samples, missing):
+  """Return [[str]] of expression values of each probe and sample."""
+  rows = []
+  for i in range(n_probes):
+    mean = rnd.uniform(6, 12)
+    std = rnd.uniform(0.05, 1.5)
+    row = []
+    for j in range(n_samples):
+      if rnd.random() < missing:
+        row.append(MISSING)
+      else:
+        row.append("%.4f" % rnd.gauss(mean, std))
+    rows.append(row)
+  return rows
+
+
+def write_study(fixture_dir, gse_id="GSE90001", gpl_id="GPL90001", probes=20000,
+                samples=40, replicates=2, missing=0.01, files=1, seed=0):
+  r"""Write fixture files of a synthetic study and its platform.
+
+  Args:
+    fixture_dir: str of path to fixture directory
+    gse_id: str of GSE ID like GSE\d+
+    gpl_id: str of GPL ID like GPL\d+
+    probes: int of number of probe rows
+    samples: int of number of sample columns
+    replicates: int of number of samples per subject
+    missing: float of fraction of missing values
+    files: int of number of series matrix files to split samples into
+    seed: int of random seed
+  Returns:
+    [str] of paths of written files
+  """
+  if files < 1 or files > samples:
+    raise ValueError("Cannot split %d samples into %d files." % (samples, files))
+  rnd = random.Random(seed)
+  probe_rows = make_probes(rnd, probes)
+  sample_rows = make_samples(gse_id, samples, replicates)
+  values = make_values(rnd, probes, samples, missing)
+  paths = []
+
+  def open_url(ptn, id):
+    path = FixtureDownload.get_path(ptn % {'id': id}, fixture_dir)
+    paths.append(path)
+    return open(path, "w")
+
+  fp = open_url(GSE.PTN_GSE_BRIEF, gse_id)
+  write_gse_brief(fp, gse_id, gpl_id, sample_rows)
+  fp.close()
+  fp = open_url(GPL.PTN_GPL_QUICK, gpl_id)
+  write_gpl_header(fp, gpl_id)
+  fp.close()
+  fp = open_url(GPL.PTN_GPL, gpl_id)
+  write_gpl_data(fp, gpl_id, probe_rows, rnd)
+  fp.close()
+
+  series_dir = FixtureDownload.get_path(
+    GSE.PTN_GSE_SERIES_DIR % {'id': gse_id}, fixture_dir)
+  if not os.path.isdir(series_dir):
+    os.makedirs(series_dir)
+  for name in os.listdir(series_dir):
+    os.remove(os.path.join(series_dir, name))
+  # Split samples by columns into files of nearly equal size.
+  for i, filename in enumerate(get_series_filenames(gse_id, files)):
+    a, b = i * samples // files, (i+1) * samples // files
+    path = os.path.join(series_dir, filename)
+    # Fixture text is ASCII; gzip files write bytes on Python 3.
+    fp = codecs.getwriter("latin-1")(gzip.open(path, "wb"))
+    write_series_matrix(fp, gse_id, gpl_id, probe_rows, sample_rows[a:b],
+                        [row[a:b] for row in values])
+    fp.close()
+    paths.append(path)
+  return paths
+
+
+def main(fixture_dir, **kwds):
+  for key in ("probes", "samples", "replicates", "files", "seed"):
+    if key in kwds:
+      kwds[key] = int(kwds[key])
+  if "missing" in kwds:
+    kwds["missing"] = float(kwds["missing"])
+  if not os.path.isdir(fixture_dir):
+    os.makedirs(fixture_dir)
+  for path in write_study(fixture_dir, **kwds):
+    print("%10d %s" % (os.path.getsize(path), path))
+
+
+if __name__ == "__main__":
+
+  if len(sys.argv) < 2 or sys.argv[1].lower().strip('-') in ("h", 'help'):
+    print(USE_MSG)
+    sys.exit(1)
+
+  try:
+    fixture_dir = sys.argv[1]
+    options = dict(map(lambda s: s.split('='), sys.argv[2:]))
+  except:
+    print(USE_MSG)
+    raise
+
+  main(fixture_dir, **options)
@@ -6,12 +6,22 @@ Andrew D. Yates
 import re
 import csv
 import sys
+import time
+import array
+from itertools import islice
 
 from download import Download
-# patched, local version of gzip from Python 3 to handle http streams, stream closes
+# streaming gzip decompressor of http streams which closes them when closed
 from download import Gzipper
+# str lines of byte streams of downloads
+from download import as_text
 
-from logger import Log
+from blockreader import RowBlockReader
+from gpltable import GPLTable
+from gplcache import GPLCache
+from headercache import HeaderCache
+from logger import Log, LimitedLog
+import metrics
 
 RECOGNIZED_STUDY_TYPES = set(["eQTL", "SNP", "SUPER"])
 # Default "no-merging" sample title pattern
@@ -32,7 +42,7 @@ class StudyTypeMismatch(Exception):
 
 # TODO: this should be loaded from an external settings file.
 GSE_SETTINGS = {
-  'GSE25935': {'rx_gsm_subject_str': "([^_]+)(?:_rep(\d+))?" },
+  'GSE25935': {'rx_gsm_subject_str': r"([^_]+)(?:_rep(\d+))?" },
 }
 
 # TODO: this should be loaded from an external settings file.
@@ -59,7 +69,7 @@ def keyword_score(title, desc, keywords):
 
 
 class GSE(object):
-  """A GEO genetic study.
+  r"""A GEO genetic study.
 
   Attributes:
     id: str of GSE ID like GSE\d+
@@ -78,6 +88,10 @@ class GSE(object):
     subject_gsms: {str: [str]} of title_subject => [GSM ID]
     est_num_row: int of number of data rows expected
     col_titles: [str] of column titles in order from series matrix files
+    col_plans: {str: filter.ColumnPlan} of column merge plans cached by filters
+      per 'rx_gsm_subject_str'
+    data_offsets: {str: int} of series matrix url to byte offset of its first
+      data line in the decompressed file, from its parsed header
     selected_platform_id: str of specified GPL of this pseudo substudy
     _id_col_idx: [int] of columns representing ID_REF
 
@@ -86,12 +100,12 @@ class GSE(object):
   """
   # Related to GSE Brief SOFT text files.
   PTN_GSE_BRIEF = "http://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc=%(id)s&targ=self&view=brief&form=text"
-  RX_SERIES = re.compile("\^SERIES = (\w+)")
-  RX_HEADER = re.compile("^!Series_(\S+) = ?(.*)$")
-  RX_SUBSTUDY = re.compile("^SuperSeries of: (GSE\d+)$")
+  RX_SERIES = re.compile(r"\^SERIES = (\w+)")
+  RX_HEADER = re.compile(r"^!Series_(\S+) = ?(.*)$")
+  RX_SUBSTUDY = re.compile(r"^SuperSeries of: (GSE\d+)$")
   # Related to GSE series matrix SOFT text files.
   PTN_GSE_SERIES_DIR = "ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SeriesMatrix/%(id)s/"
-  RX_SAMPLE_HEADER = re.compile("^!Sample_(\w+)\t(.+)$")
+  RX_SAMPLE_HEADER = re.compile(r"^!Sample_(\w+)\t(.+)$")
   HEAD_END_LINE = "!series_matrix_table_begin"
 
   EQTL_TYPE_LINES = set([
@@ -103,10 +117,23 @@ class GSE(object):
     ])
   # keep newline for easier detection
   END_LINE = "!series_matrix_table_end\n"
+  # Read multiple series matrix files in parallel threads, in blocks of rows.
+  PARALLEL_READ = True
+  READ_BLOCK_SIZE = 256
+  READ_QUEUE_BLOCKS = 8
+  # Seconds for which series matrix FTP listings are reused from memory or
+  #   the download cache before they are listed again.
+  LISTING_TTL = 86400
+  # {str: (float, [FTPFile])} of series directory url to (time listed, files)
+  FTP_LISTINGS = {}
+  # Parsed series matrix headers shared by all processes using CACHE_DIR.
+  HEADER_CACHE = HeaderCache()
+  # Bytes of decompressed data read at a time while skipping a header.
+  SKIP_READ_SIZE = 1048576
 
   def __init__(self, gse_id, super_id=None, custom_parameters=None, \
                populate=True, platform_id=None):
-    """Initialize GSE object.
+    r"""Initialize GSE object.
     Warning: if "populate" is False, the __init__ blocks serial execution
       to populate itself which may be slow if from disk or from FTP.
 
@@ -117,8 +144,8 @@ class GSE(object):
       populate: bool to populate this object immediately on instantiation
       platform_id: str of one of multiple GPLs, flags "pseudo" if not None
     """
-    Log.info("Initializing new GEO object (%d) for GSE_ID: %s, GPL_ID: %s" % \
-      (id(self), gse_id, platform_id))
+    Log.info("Initializing new GEO object (%d) for GSE_ID: %s, GPL_ID: %s",
+             id(self), gse_id, platform_id)
     self.id = gse_id
     self.attr = {}
     self.type = None
@@ -130,14 +157,16 @@ class GSE(object):
     # selected_platform_id is only used for pseudo substudies
     self.selected_platform_id = platform_id
     if self.pseudo:
-      Log.info("Flagged %s (%d) as pseudo during init, platform_id = %s" %\
-        (gse_id, id(self), platform_id))
+      Log.info("Flagged %s (%d) as pseudo during init, platform_id = %s",
+               gse_id, id(self), platform_id)
     
     self.substudies = {}
     self.platform = None
     self.samples = {}
     self.subject_gsms = {}
     self.col_titles = []
+    self.col_plans = {}
+    self.data_offsets = {}
     self.est_num_row = None
 
     # Set mutable parameters to default values
@@ -157,19 +186,20 @@ class GSE(object):
 
   def populate(self):
     """Load and set values to all object attributes."""
-    Log.info("Populating %s..." % self)
+    Log.info("Populating %s...", self)
     if self.populated:
-      Log.warning("%s is already populated." % self)
+      Log.warning("%s is already populated.", self)
       return
     
     if self.type == "SUPER":
-      Log.info("Populating SuperStudy %s." % self)
+      Log.info("Populating SuperStudy %s.", self)
       for study in self.substudies.values():
         study.populate()
     else:
       # Do the actual hard work of loading and setting attributes.
-      self._populate()
-    Log.info("%s Populated." % self)
+      with metrics.stage("gse.populate"):
+        self._populate()
+    Log.info("%s Populated.", self)
       
     self.populated = True
 
@@ -182,22 +212,40 @@ class GSE(object):
 
     # TODO: if pseudo, only load series matrix files with same GPL
 
-    # 3. Open and decompress each file as a list of file pointers.
+    # 3. Parse headers of each file, from the header cache if possible.
     # ==========
-    Log.info("Fetching %d file(s): %s" % (len(ftp_files), ftp_files))
-    fps = self._open_ftp_files(ftp_files, finalize=False)
+    headers = [self.HEADER_CACHE.get(f) for f in ftp_files]
+    missing = [f for f, header in zip(ftp_files, headers) if header is None]
+    metrics.add("gse.header_cached", calls=len(ftp_files) - len(missing))
+    Log.info("Fetching %d of %d file(s) for headers: %s",
+             len(missing), len(ftp_files), missing)
+    fps = dict(zip([f.url for f in missing],
+                   self._open_ftp_files(missing, finalize=False)))
+    try:
+      for i, ftp_file in enumerate(ftp_files):
+        if headers[i] is None:
+          fp = fps.pop(ftp_file.url)
+          Log.info("Parsing header from file pointer %s", fp)
+          try:
+            with metrics.stage("gse.header") as stage:
+              headers[i] = self._parse_header(fp)
+              stage.bytes_in = headers[i]['offset']
+          finally:
+            fp.close()
+          self.HEADER_CACHE.put(ftp_file, headers[i])
+        self.data_offsets[ftp_file.url] = headers[i]['offset']
+    except:
+      self._close_files(fps.values())
+      raise
 
-    # 4. Populate GSM sample objects from series matrix files. 
+    # 4. Populate GSM sample objects from series matrix headers.
     # ==========
-    for fp in fps:
-      Log.info("Populating GSMs from file pointer %s" % (fp))
-      self._populate_gsms(fp)
-      Log.info("GSMs Populated from file pointer, closing %s" % (fp))
-      # fp now points to first line after header
+    for header in headers:
+      self._populate_gsms(header['sample_attrs'])
       
     # Check that GSM samples have been populated.
     # Sometimes, not all samples are included in substudies.
-    empty_keys = filter(lambda x: not self.samples[x].populated, self.samples)
+    empty_keys = [x for x in self.samples if not self.samples[x].populated]
     n_empty = len(empty_keys)
     if n_empty > 0:
       # If this is a pseudo-study, then filter samples expected from the super study
@@ -205,17 +253,16 @@ class GSE(object):
       if self.pseudo:
         for key in empty_keys:
           del self.samples[key]
-        Log.info("Filtered %d of %d samples from series matrix for %s." % \
-          (len(self.samples), n_empty+len(self.samples), self))
+        Log.info("Filtered %d of %d samples from series matrix for %s.",
+                 len(self.samples), n_empty+len(self.samples), self)
       else:
-        Log.warning("Not all samples in %s (only %d of %d) have attributes." % \
-          (self, n_empty, len(self.samples)))
+        Log.warning("Not all samples in %s (only %d of %d) have attributes.",
+                    self, n_empty, len(self.samples))
 
-    # 5. Populate column titles given fp pointing after header. Close fp.
+    # 5. Populate column titles in file order.
     # ==========
-    for fp in fps:
-      self._populate_col_titles(fp)
-      fp.close()
+    for header in headers:
+      self._populate_col_titles(header['col_titles'])
 
     # 6. Estimate number of data rows from first sample attribute "data_row_count"
     # ==========
@@ -224,79 +271,107 @@ class GSE(object):
       try:
         s = [int(q.attr['data_row_count'][0]) for q in self.samples.values()]
         self.est_num_row = max(s)
-      except Exception, e:
-        Log.warning("Could not estimate number of data rows for %s: %s" % \
-          (self, e))
+      except Exception as e:
+        Log.warning("Could not estimate number of data rows for %s: %s", self, e)
         
 
     # 7. Log population result and statistics
     # ==========
     # warn about unexpected population results
     if len(self.col_titles) == 0:
-      Log.warning("0 column titles populated for %s.")
+      Log.warning("0 column titles populated for %s.", self)
     if len(self.samples) == 0:
-      Log.warning("0 Samples populated for %s.")
+      Log.warning("0 Samples populated for %s.", self)
     if len(self.subject_gsms) == 0:
-      Log.warning("0 Subjects populated for %s.")
+      Log.warning("0 Subjects populated for %s.", self)
       
-    Log.info(("Populated substudy %s. Cols=%d, Samples=%d, Subjects=%d, " 
-             + "Expected Rows=%d") % \
-             (self, len(self.col_titles), len(self.samples), \
-              len(self.subject_gsms), self.est_num_row))
+    Log.info("Populated substudy %s. Cols=%d, Samples=%d, Subjects=%d, "
+             "Expected Rows=%d", self, len(self.col_titles), len(self.samples),
+             len(self.subject_gsms), self.est_num_row)
 
 
-  def _open_ftp_files(self, ftp_files, finalize=True):
+  def _open_ftp_files(self, ftp_files, finalize=True, read_threads=1):
     """Return list of open, decompressed file pointers from file list.
 
     Args:
       ftp_files: [FTPFile] of files to open for downloading
       finalize: bool to open files for complete (rather than partial) download
+      read_threads: int of threads to decompress block-compressed cache files
     Returns:
       [*str] of open file pointer-like objects for each file in `ftp_files`
     """
     fps = []
-    for ftp_file in ftp_files:
-      handle = Download(ftp_file.url, finalize=finalize)
-      http_fp = handle.read()
-      if ftp_file.compressed:
-        # closing this file pointer should close the underlying buffer.
-        zip_fp = Gzipper(fileobj=http_fp, mode='r')
-        fps.append(zip_fp)
-      else:
-        fps.append(http_fp)
+    try:
+      for ftp_file in ftp_files:
+        handle = Download(ftp_file.url, expected_size=ftp_file.size,
+                          expected_mtime=ftp_file.mtime, finalize=finalize,
+                          read_threads=read_threads, gunzip=True)
+        http_fp = handle.read()
+        # Gzip files rewritten block-compressed in the cache are decompressed
+        #   and seekable already.
+        if ftp_file.compressed and not getattr(handle, "gunzipped", False):
+          # closing this file pointer should close the underlying buffer.
+          # Text mode decodes each decompressed chunk, not each line.
+          zip_fp = Gzipper(fileobj=http_fp, mode='r')
+          fps.append(zip_fp)
+        else:
+          fps.append(as_text(http_fp))
+    except:
+      # Release files already opened, and their download cache locks.
+      self._close_files(fps)
+      raise
     return fps
 
+  def _close_files(self, fps):
+    """Close open file pointers `fps` after an error. Log errors of closing."""
+    for fp in fps:
+      try:
+        fp.close()
+      except Exception as e:
+        Log.warning("Cannot close %s for %s: %s", fp, self, e)
+
   def _get_ftp_files(self):
     """Return list of FTP page objects from ftp page.
 
     Returns:
       [FTPFile] from GSE_SERIES FTP page.
     """
-    ftp_files = []
     root_url = self.PTN_GSE_SERIES_DIR % {'id': self.id}
-    handle = Download(root_url)
-    http_fp = handle.read()
-    for line in http_fp:
-      f = FTPFile(root_url, line.strip())
-      ftp_files.append(f)
-    http_fp.close()
+    ftp_files = self._list_ftp_dir(root_url)
 
     # If this is pseudo-study, an FTP file may refer to a sibling study.
     # Filter all ftp files that do not include this study's GPL ID 
     if self.pseudo:
       n = len(ftp_files)
       s = self.selected_platform_id.lower()
-      gpl_ftp_files = filter(lambda x: s in x.filename.lower(), ftp_files)
+      gpl_ftp_files = [x for x in ftp_files if s in x.filename.lower()]
       if len(gpl_ftp_files) == 0:
-        Log.warn("No FTP files found with platform ID in file name. Return all %d file names."%n)
+        Log.warning("No FTP files found with platform ID in file name. Return all %d file names.", n)
         gpl_ftp_files = ftp_files
-      Log.info("Selected %d of %d ftp files by '%s' in filename for %s." % \
-         (len(gpl_ftp_files), n, s, self))
+      Log.info("Selected %d of %d ftp files by '%s' in filename for %s.",
+               len(gpl_ftp_files), n, s, self)
     else:
       gpl_ftp_files = ftp_files
     
     return gpl_ftp_files
     
+  def _list_ftp_dir(self, root_url):
+    """Return [FTPFile] of FTP directory `root_url`, listed at most once per
+    LISTING_TTL seconds. Listings are shared by all GSE objects.
+    """
+    listed = self.FTP_LISTINGS.get(root_url)
+    if listed and time.time() - listed[0] < self.LISTING_TTL:
+      return listed[1]
+    ftp_files = []
+    handle = Download(root_url, max_age=self.LISTING_TTL)
+    http_fp = as_text(handle.read())
+    for line in http_fp:
+      if line.strip():
+        ftp_files.append(FTPFile(root_url, line.strip()))
+    http_fp.close()
+    self.FTP_LISTINGS[root_url] = (time.time(), ftp_files)
+    return ftp_files
+    
   def __repr__(self):
     if not self.pseudo:
       return "[GEO %s (%d)]" % (self.id, id(self))
@@ -307,10 +382,11 @@ class GSE(object):
   def _load_brief(self):
     """Fetch, open, and load GSE brief metadata into attributes."""
     url = self.PTN_GSE_BRIEF % {'id': self.id}
-    handle = Download(url)
-    http_fp = handle.read()
-    self._parse_brief(http_fp)
-    http_fp.close()
+    with metrics.stage("gse.brief"):
+      handle = Download(url)
+      http_fp = as_text(handle.read())
+      self._parse_brief(http_fp)
+      http_fp.close()
 
   def _parse_brief(self, fp):
     """Parse GSE text brief from GEO website.
@@ -320,17 +396,16 @@ class GSE(object):
     """
     # 1. Verify fp by consuming the first line for its study id.
     # ==========
-    line = fp.next().strip()
+    line = next(fp).strip()
     try:
       series_id = self.RX_SERIES.match(line).group(1)
     except:
-      raise MalformedDataError, \
-        "Cannot recognize GSE ID in line %s while fetching GEO ID '%s'" \
-        % (line, self.id)
+      raise MalformedDataError("Cannot recognize GSE ID in line %s while fetching GEO ID '%s'"
+        % (line, self.id))
     if series_id != self.id:
-      raise MalformedDataError, \
-          "GSE ID %s differs from requested ID %s." % (series_id, self.id)
-    Log.info("Successfully fetched brief for %s from line '%s'." % (self, line))
+      raise MalformedDataError("GSE ID %s differs from requested ID %s." %
+        (series_id, self.id))
+    Log.info("Successfully fetched brief for %s from line '%s'.", self, line)
 
     # 2. Interpret next lines as "!" prefixed attributes.
     # ==========
@@ -341,8 +416,8 @@ class GSE(object):
       try:
         key, value = self.RX_HEADER.match(line).groups()
       except:
-        raise MalformedDataError, "Cannot parse header line '%s' in %s" % \
-          (line, self)
+        raise MalformedDataError("Cannot parse header line '%s' in %s" %
+          (line, self))
       key, value = key.strip(), value.strip()
       
       # Add header to attribute dict.
@@ -368,8 +443,8 @@ class GSE(object):
     # If any substudies exist, then this is type "SUPER"
     if self.substudies:
       self.type = "SUPER"
-      Log.info("%s assigned type '%s' because it contains substudies %d %s." % \
-               (self, self.type, len(self.substudies), self.substudies))
+      Log.info("%s assigned type '%s' because it contains substudies %d %s.",
+               self, self.type, len(self.substudies), self.substudies)
     
     # If multiple platfomms for the same study, this study is "pseudo super"
     # ==========
@@ -377,10 +452,11 @@ class GSE(object):
       self.type = "SUPER"
       self.pseudo = True
       n_platforms = len(self.attr["platform_id"])
-      Log.info("No platform_id specified for %s, but platform is ambiguous." % self)
-      Log.info("%s assigned type '%s' because it contains %d platforms %s." % \
-               (self, self.type, n_platforms, self.attr["platform_id"]))
-      Log.info("Set pseudo=True for %s. Creating %d pseudo-substudies..." % (self, n_platforms))
+      Log.info("No platform_id specified for %s, but platform is ambiguous.", self)
+      Log.info("%s assigned type '%s' because it contains %d platforms %s.",
+               self, self.type, n_platforms, self.attr["platform_id"])
+      Log.info("Set pseudo=True for %s. Creating %d pseudo-substudies...",
+               self, n_platforms)
       # Create pseudo-substudies, one per GPL
       for line in self.attr["platform_id"]:
         gse_id = self.id
@@ -390,7 +466,7 @@ class GSE(object):
 
     # If this is a super study, population is complete. Exit.
     if self.type == "SUPER":
-      Log.info("Population complete for superstudy %s." % self)
+      Log.info("Population complete for superstudy %s.", self)
       return
 
     # ------
@@ -414,14 +490,13 @@ class GSE(object):
     # Determine that there exists some overlap between declared
     #   study types and supported study types
     if not (type_set & (self.EQTL_TYPE_LINES | self.SNP_TYPE_LINES)):
-      Log.warning("No type recognized in declared types for %s. Types: %s" % \
-                  (self, type_set))
+      Log.warning("No type recognized in declared types for %s. Types: %s",
+                  self, type_set)
     # Report multiple study types in a leaf study.
     if len(type_set) > 1:
-      Log.info("Multiple study type declarations %s for %s." % \
-                  (self.attr["type"], self))
+      Log.info("Multiple study type declarations %s for %s.", self.attr["type"], self)
     elif len(type_set) == 0:                  
-      Log.warning("Missing study type declaration for %s." % self)
+      Log.warning("Missing study type declaration for %s.", self)
 
     
     # 5.1. If this is a pseudo substudy, don't rely on the given study types from the
@@ -430,14 +505,12 @@ class GSE(object):
     if self.pseudo:
       # Create study platform with declaring a type
       gpl_id = self.selected_platform_id
-      Log.info("Attempting to determine pseudo substudy %s type from %s" % \
-        (self, gpl_id))
-      self.platform = GPL(gpl_id, study_type=None) # the GPL type is as yet unknown
+      Log.info("Attempting to determine pseudo substudy %s type from %s", self, gpl_id)
+      self.platform = GPL.get(gpl_id, study_type=None) # the GPL type is as yet unknown
       # Use the study type guessed by the study platform based on its definition
       self.type = self.platform.type
       # Report final study type determined.
-      Log.info("%s assigned type %s from platform %s." % \
-               (self, self.type, self.platform))
+      Log.info("%s assigned type %s from platform %s.", self, self.type, self.platform)
 
     # 5.2 This is not a pseudo substudy; determine type from study description
     # ----------
@@ -450,38 +523,54 @@ class GSE(object):
         self.type = "SNP"
       # Report unrecognized type.
       else:
-        Log.warning("Unrecognized study type descriptions %s for %s." % \
-          (self.attr["type"], self))
+        Log.warning("Unrecognized study type descriptions %s for %s.",
+                    self.attr["type"], self)
         self.type = "OTHER"
       # Report final study type determined.
-      Log.info("%s assigned type %s given type description '%s'." % \
-               (self, self.type, self.attr["type"]))
+      Log.info("%s assigned type %s given type description '%s'.",
+               self, self.type, self.attr["type"])
       # Create study platform given determined study type
       gpl_id = self.attr["platform_id"][0]
-      self.platform = GPL(gpl_id, study_type=self.type) # GPL type known.
+      self.platform = GPL.get(gpl_id, study_type=self.type) # GPL type known.
 
     # Populate complete for substudy.
     # ==========
-    Log.info("Population complete for substudy %s." % self)
+    Log.info("Population complete for substudy %s.", self)
 
       
-  def get_rows(self):
+  def get_rows(self, read_threads=1):
     """Yield rows of unfiltered, compiled series matrix data.
     Populate all child objects (platforms, samples) if not already populated.
 
+    Args:
+      read_threads: int of threads to decompress blocks of each
+        block-compressed cache file ahead; see download.cached_download
     Yields:
       [str] of columns of data per row
     """
-    Log.info("Yielding data rows for %s..." % self)
+    for row in self.open_rows(read_threads=read_threads):
+      yield row
+
+  def open_rows(self, index=None, read_threads=1):
+    """Open series matrix files now. Return iterator of rows as get_rows().
+
+    Args:
+      index: RowIndex in which to record byte offsets of the lines of each
+        row, or None. Offsets are recorded only if index.complete.
+      read_threads: int of threads to decompress blocks of each
+        block-compressed cache file ahead
+    Returns:
+      iter of [str] of columns of data per row
+    """
+    Log.info("Yielding data rows for %s...", self)
     
     # If this is a super series, raise an exception. 
     if self.type == "SUPER":
-      raise SuperStudyAccessError, \
-        "%s is a super study. Get data rows from substudies %s." % \
-        (self.id, self.substudies)
+      raise SuperStudyAccessError("%s is a super study. Get data rows from substudies %s." %
+        (self.id, self.substudies))
     # If this is not yet populated, warn in logs and populate self.
     if not self.populated:
-      Log.warning("%s get_rows() called before populating; populating." % self)
+      Log.warning("%s get_rows() called before populating; populating.", self)
       self.populate()
 
     # 0. Load GPL platform row definition (if not already loaded)
@@ -489,7 +578,7 @@ class GSE(object):
     if not self.platform.loaded:
       self.platform.load()
     else:
-      Log.warning("%s of %s already loaded." % (self.platform, self))
+      Log.info("%s of %s already loaded.", self.platform, self)
 
     # 1. Get list of series matrix data files.
     # ==========
@@ -497,76 +586,203 @@ class GSE(object):
 
     # 2. Open and decompress each file as a list of file pointers.
     # ==========
-    Log.info("Fetching %d file(s): %s" % (len(ftp_files), ftp_files))
-    fps = self._open_ftp_files(ftp_files)
-    
-    # 3. Consume GSE Series Matrix headers.
-    # ==========
-    for fp in fps:
-      self._consume_header(fp)
+    # Time opening files and skipping headers; rows are timed as read.
+    with metrics.stage("gse.open"):
+      Log.info("Fetching %d file(s): %s", len(ftp_files), ftp_files)
+      fps = self._open_ftp_files(ftp_files, read_threads=read_threads)
+
+      # 3. Skip GSE Series Matrix headers to the known offset of data lines,
+      #   else consume headers line by line.
+      # ==========
+      positions = []
+      try:
+        for ftp_file, fp in zip(ftp_files, fps):
+          offset = self.data_offsets.get(ftp_file.url)
+          if offset:
+            self._skip_bytes(fp, offset)
+            positions.append(offset)
+            continue
+          offset = self._consume_header(fp)
+          # 4. Consume GSE Series Matrix column title lines
+          # ==========
+          line = next(fp)
+          # ID_REF should be in the column titles. Warn if it is not.
+          if "ID_REF" not in line:
+            Log.warning("'%s' may not be column title line as expected for %s.",
+                        line, self)
+          positions.append(offset + len(line))
+      except:
+        self._close_files(fps)
+        raise
 
-    # 4. Consume GSE Series Matrix column title lines
-    # ==========
-    for fp in fps:
-      line = fp.next()
-      # ID_REF should be in the column titles. Warn if it is not.
-      if "ID_REF" not in line:
-        Log.warning("'%s' may not be column title line as expected for %s." % \
-                    line, self)
+    if index is not None:
+      index.start([f.url for f in ftp_files], fps, positions)
+      if not index.complete:
+        index = None
+    return self._iter_rows(fps, index)
 
+  def _iter_rows(self, fps, index):
+    """Yield rows of opened series matrix files `fps`. Count and log rows."""
     # 5. Read study data in parallel. Call row hook function for each line.
     # ==========
     n_rows = 0
-    for row in self._yield_rows(fps):
+    for row in metrics.timed("gse.get_rows", self._yield_rows(fps, index)):
       n_rows += 1
       yield row
 
     # 6. Report row yield.
     # ==========
-    Log.info("Yielded %d rows of data, %d expected for %s." % \
-             (n_rows, self.est_num_row, self))
+    Log.info("Yielded %d rows of data, %d expected for %s.",
+             n_rows, self.est_num_row, self)
     if n_rows != self.est_num_row:
-      Log.warning("Yielded num rows(%d) not expected num(%d) for %s" % \
-                  (n_rows, self.est_num_row, self))
+      Log.warning("Yielded num rows(%d) not expected num(%d) for %s",
+                  n_rows, self.est_num_row, self)
 
 
-  def _yield_rows(self, fps):
+  def _yield_rows(self, fps, index=None):
     """Yield a row of data from a list of parallel file iterators.
 
     Args:
       fps: [iter=>str] of parallel file pointers
+      index: RowIndex in which to record byte offsets of rows, or None
+    Yields:
+      [str] of columns of values
+    """
+    # Log a few malformed rows of a study, and count the rest.
+    warnings = LimitedLog(Log, self)
+    try:
+      # Decompress and split multiple files in parallel reader threads.
+      if self.PARALLEL_READ and len(fps) > 1:
+        rows = self._yield_rows_parallel(fps, warnings, index)
+      else:
+        rows = self._yield_rows_serial(fps, warnings, index)
+      for row in rows:
+        yield row
+    finally:
+      warnings.summary()
+
+  def _yield_rows_serial(self, fps, warnings, index=None):
+    """Yield rows like self._yield_rows() reading files in turn.
+
+    Args:
+      fps: [iter=>str] of parallel file pointers
+      warnings: LimitedLog of malformed row warnings
+      index: RowIndex in which to record byte offsets of rows, or None
     Yields:
       [str] of columns of values
     """
     # Generator loop: read from each fp and yield one row per iteration.
     while True:
       try:
-        lines = [fp.next() for fp in fps]
+        lines = [next(fp) for fp in fps]
       except StopIteration:
         # Verify that all fp have reached end of file.
         if not self._verify_all_fp_at_eof(fps):
-          raise MalformedDataError, \
-            "EOF mismatch while reading %d series matrix files for %s." % \
-            (len(fps), self)
+          raise MalformedDataError("EOF mismatch while reading %d series matrix files for %s." %
+            (len(fps), self))
         else:
-          Log.info("All %d files read to EOF for %s." % (len(fps), self))
+          Log.info("All %d files read to EOF for %s.", len(fps), self)
         # OK: all file pointers stopped simultaneously. Break generator loop.
         break
         
       # check for !series_matrix_table_end end line, do not yield this line
       if "!series_matrix_table_end\n" in lines:
+        if index is not None:
+          index.skip([len(line) for line in lines])
         continue
+      if index is not None:
+        index.add([len(line) for line in lines])
       
       # Merge lines into a single row
       row = self._merge_csv_row_lines(lines)
       # Warn if number of columns does not match column titles
       if len(row) != len(self.col_titles):
-        Log.warning(("Parsed row of %d columns != expected %d columns. " + \
-                    "GSE object: %s, lines: %s") % \
-                    (len(row), len(self.col_titles), self, lines))
+        warnings.warning("columns", "Parsed row of %d columns != expected %d "
+                         "columns. GSE object: %s, lines: %s", len(row),
+                         len(self.col_titles), self, lines)
       # Finally, yield one combined row of data in the Generator loop
       yield row
 
+  def _yield_rows_parallel(self, fps, warnings, index=None):
+    """Yield rows like self._yield_rows() from one reader thread per file.
+
+    Args:
+      fps: [iter=>str] of parallel file pointers
+      warnings: LimitedLog of malformed row warnings
+      index: RowIndex in which to record byte offsets of rows, or None
+    Yields:
+      [str] of columns of values
+    """
+    end_id = self.END_LINE.strip()
+    if index is None:
+      f_split = self._split_line
+    else:
+      # Readers also return the length of each line for its byte offset.
+      f_split = lambda line: (len(line), self._split_line(line))
+    readers = [RowBlockReader(fp, f_split, self.READ_BLOCK_SIZE,
+                              self.READ_QUEUE_BLOCKS) for fp in fps]
+    Log.info("Reading %d files in parallel threads for %s.", len(fps), self)
+    try:
+      while True:
+        blocks = [reader.next_block() for reader in readers]
+        n = min([len(block) for block in blocks])
+        for i in range(n):
+          rows = [block[i] for block in blocks]
+          if index is not None:
+            sizes = [x[0] for x in rows]
+            rows = [x[1] for x in rows]
+          # check for !series_matrix_table_end end line, do not yield this row
+          if any([row and row[0] == end_id for row in rows]):
+            if index is not None:
+              index.skip(sizes)
+            continue
+          if index is not None:
+            index.add(sizes)
+          row = self._merge_rows(rows)
+          # Warn if number of columns does not match column titles
+          if len(row) != len(self.col_titles):
+            warnings.warning("columns", "Parsed row of %d columns != expected "
+                             "%d columns. GSE object: %s, rows: %s", len(row),
+                             len(self.col_titles), self, rows)
+          yield row
+        # Blocks are the same size until the end of the longest file.
+        if any([len(block) != n for block in blocks]):
+          raise MalformedDataError("EOF mismatch while reading %d series matrix files for %s." %
+            (len(fps), self))
+        if n == 0:
+          Log.info("All %d files read to EOF for %s.", len(fps), self)
+          break
+    finally:
+      for reader in readers:
+        reader.stop()
+
+  @staticmethod
+  def _split_line(line):
+    """Return series matrix line split into a row of column values.
+
+    Lines are split on tabs directly unless they contain quotes other than
+    around the row ID. Only those lines are parsed with the csv module.
+
+    Args:
+      line: str of tab delimited, optionally quoted, series matrix line
+    Returns:
+      [str] of column values, as from csv.reader([line], delimiter="\t")
+    """
+    s = line.rstrip("\r\n")
+    if '"' not in s:
+      if not s:
+        return []
+      return s.split("\t")
+    # Common case: only the row ID is quoted, like "1007_s_at"\t7.3\t...
+    i = s.find("\t")
+    if i > 1 and s[0] == '"' and s[i-1] == '"' and \
+        s.find('"', 1) == i-1 and s.find('"', i) == -1:
+      row = s[i:].split("\t")
+      row[0] = s[1:i-1]
+      return row
+    # An unclosed quote keeps the line end in its value, as csv.reader does.
+    return next(csv.reader([line], delimiter="\t"))
+
   def _merge_csv_row_lines(self, lines):
     """Return row from list of csv lines of text. Verify that row ids align.
 
@@ -576,25 +792,48 @@ class GSE(object):
       [str] row of column values from compiling `lines` in order
     """
     # Given a list of lines, split them as csv, combine, and return row.
-    row_id = None
-    row = []
-    for line in lines:
-      s = csv.reader([line], delimiter="\t").next()
-
-      # Verify that row IDs match. Discard superfluous row IDs.
-      if row_id is None:
-        row_id = s[0]
-        row.extend(s)
-      else:
-        alt_id = s[0]
+    row = self._split_line(lines[0])
+    row_id = row[0]
+    for line in lines[1:]:
+      i = line.find("\t")
+      # Fast path: compare the row ID in place and split only the values.
+      if i > 0 and line.find('"', i) == -1:
+        alt_id = line[:i]
+        if alt_id[0] == '"' and alt_id[-1] == '"' and len(alt_id) > 1 and \
+            alt_id.find('"', 1) == len(alt_id)-1:
+          alt_id = alt_id[1:-1]
+        elif '"' in alt_id:
+          alt_id = self._split_line(line)[0]
         if alt_id != row_id:
-          raise MalformedDataError, \
-            "Row ID Mismatch: %s != %s in GSE %s" % (alt_id, row_id, self.id)
-        # Do not add the redundant matching row id.
-        row.extend(s[1:])
-        
+          raise MalformedDataError("Row ID Mismatch: %s != %s in GSE %s" %
+            (alt_id, row_id, self.id))
+        row.extend(line[i+1:].rstrip("\r\n").split("\t"))
+      else:
+        self._extend_row(row, self._split_line(line))
     return row
 
+  def _merge_rows(self, rows):
+    """Return row from list of split rows. Verify that row ids align.
+
+    Args:
+      rows: [[str]] of adjacent split series matrix data rows; modified
+    Returns:
+      [str] row of column values from compiling `rows` in order
+    """
+    row = rows[0]
+    for s in rows[1:]:
+      self._extend_row(row, s)
+    return row
+
+  def _extend_row(self, row, s):
+    """Extend merged `row` by split row `s` without its matching row ID."""
+    # Verify that row IDs match. Discard superfluous row IDs.
+    if s[0] != row[0]:
+      raise MalformedDataError("Row ID Mismatch: %s != %s in GSE %s" %
+        (s[0], row[0], self.id))
+    # Do not add the redundant matching row id.
+    row.extend(islice(s, 1, None))
+
   @staticmethod
   def _verify_all_fp_at_eof(fps):
     """Return True if all fp throw StopIteration, i.e., all fps @ EOF
@@ -606,29 +845,76 @@ class GSE(object):
     """
     for fp in fps:
       try:
-        fp.next()
+        next(fp)
       except StopIteration:
         pass # OK, EOF
       else:
         return False # FAIL: StopIteration should have been raised.
     return True # Success: no failures
     
-  def _populate_col_titles(self, fp):
+  def get_rows_at(self, index, row_nums):
+    """Yield rows at positions `row_nums` by their byte offsets in `index`.
+
+    Series matrix files are opened again, usually from the download cache.
+    Seekable files move to each row. Other files are read forward to it.
+
+    Args:
+      index: RowIndex recorded by open_rows() while reading all rows
+      row_nums: [int] of increasing row positions, from 0
+    Yields:
+      [str] of columns of values per row
+    """
+    ftp_files = self._get_ftp_files()
+    if [f.url for f in ftp_files] != index.urls:
+      raise MalformedDataError("Series matrix files %s of %s are not those of %s." %
+        (ftp_files, self, index))
+    fps = self._open_ftp_files(ftp_files)
+    try:
+      for fp in fps:
+        if not is_seekable(fp):
+          Log.info("%s of %s is not seekable. Reading forward to selected rows.",
+                   fp, self)
+      positions = [0] * len(fps)
+      for i in row_nums:
+        lines = []
+        for k, fp in enumerate(fps):
+          offset = index.offsets[k][i]
+          if positions[k] != offset:
+            self._move_to(fp, positions[k], offset)
+          line = fp.readline()
+          positions[k] = offset + len(line)
+          lines.append(line)
+        yield self._merge_csv_row_lines(lines)
+    finally:
+      for fp in fps:
+        fp.close()
+
+  def _move_to(self, fp, pos, offset):
+    """Move `fp` from byte `pos` to byte `offset` of decompressed data.
+
+    Files which are not seekable are read forward, so `offset` >= `pos`.
+    """
+    if is_seekable(fp):
+      fp.seek(offset)
+    elif offset < pos:
+      raise MalformedDataError("Cannot move back from byte %d to %d in %s for %s." %
+        (pos, offset, fp, self))
+    else:
+      self._skip_bytes(fp, offset - pos)
+
+  def _populate_col_titles(self, row):
     """Populate column titles. 
     
-    Assume that fp order is preserved, that is, the order in which column titles
-      are populated now will be the order in which they will be read from later.
+    Assume that file order is preserved, that is, the order in which column
+      titles are populated now will be the order in which they will be read
+      from later.
     
     Args:
-      fp: iter=>str of file pointer pointing to column titles
+      row: [str] of column titles of one series matrix file
     """
-    line = fp.next()
-    row = csv.reader([line], delimiter="\t", quotechar='"').next()
-      
     # Verify that first column title is ID_REF per file.
     if row[0] != "ID_REF":
-      raise MalformedDataError, \
-        "ID_REF not first column title in %s for %s." % (line, self)
+      raise MalformedDataError("ID_REF not first column title in %s for %s." % (row, self))
 
     # Only add the first ID_REF column title.
     if len(self.col_titles) == 0:
@@ -637,29 +923,57 @@ class GSE(object):
       self.col_titles.extend(row[1:])
 
   def _consume_header(self, fp):
-    """Consume series matrix header."""
+    """Consume series matrix header. Return int of bytes consumed."""
     num_lines_consumed = 0
+    num_bytes_consumed = 0
     for line in fp:
       num_lines_consumed += 1
+      num_bytes_consumed += len(line)
       if line.strip() == self.HEAD_END_LINE:
         break
-    Log.info("Consumed %d lines from %s for %s" % \
-             (num_lines_consumed, self, fp))
+    Log.info("Consumed %d lines from %s for %s", num_lines_consumed, self, fp)
+    return num_bytes_consumed
+
+  def _skip_bytes(self, fp, n):
+    """Read and discard `n` decompressed bytes of `fp`, like a header.
 
-  def _populate_gsms(self, fp):
-    """Populate GSM list from series matrix SOFT "!" headers.
-    Modifies `fp` to point to first line after headers.
+    Seekable cache files move to the offset without decompressing the
+    header. Raise MalformedDataError if `fp` has fewer bytes.
+    """
+    if is_seekable(fp):
+      fp.seek(n)
+      Log.info("Seeked to data at byte %d of %s for %s", n, fp, self)
+      return
+    left = n
+    while left > 0:
+      block = fp.read(min(left, self.SKIP_READ_SIZE))
+      if not block:
+        raise MalformedDataError("EOF after %d of %d header bytes of %s for %s." %
+          (n - left, n, fp, self))
+      left -= len(block)
+    Log.info("Skipped %d header bytes of %s for %s", n, fp, self)
+
+  def _parse_header(self, fp):
+    """Return parsed series matrix header from top of `fp`.
+    Modifies `fp` to point to first data line.
 
     Args:
-      fp: iter of str lines of GSE "!" headers; fp points to top of file.
+      fp: iter of str lines of series matrix file; fp points to top of file.
+    Returns:
+      {str: obj} of header with keys:
+        'sample_attrs': {str: [[str]]} of !Sample_ attribute to rows of values
+        'col_titles': [str] of column titles
+        'offset': int of byte offset of first data line
     """
     # sample_attrs[key] = [[str]]
     sample_attrs = {}
+    offset = 0
     
     for line in fp:
+      offset += len(line)
       line = line.strip()
       
-      # Exit loop leaving fp pointing at first line after header.
+      # Exit loop leaving fp pointing at column title line after header.
       if line == self.HEAD_END_LINE:
         break
 
@@ -668,16 +982,28 @@ class GSE(object):
       if m:
         key, values = m.groups()
         # Split line by tabs into columns
-        row = csv.reader([values], delimiter="\t", quotechar='"').next()
+        row = next(csv.reader([values], delimiter="\t", quotechar='"'))
 
         # Add this row to list of values for this attribute.
         sample_attrs.setdefault(key, []).append(row)
 
+    line = next(fp)
+    offset += len(line)
+    col_titles = next(csv.reader([line], delimiter="\t", quotechar='"'))
+    return {'sample_attrs': sample_attrs, 'col_titles': col_titles,
+            'offset': offset}
+
+  def _populate_gsms(self, sample_attrs):
+    """Populate GSM list from parsed series matrix SOFT "!Sample_" headers.
+
+    Args:
+      sample_attrs: {str: [[str]]} of !Sample_ attribute to rows of values
+    """
     # All header lines have been consumed.
     # Map column entries per row to GSE samples instances by GSE ID order.
     # We assume that there exists only one row for "geo_accession"
     sample_list = sample_attrs["geo_accession"][0]
-    Log.info("Populating %d GSM samples for %s" % (len(sample_list), self))
+    Log.info("Populating %d GSM samples for %s", len(sample_list), self)
 
     # Use position "i" to map this sample with its column of attributes.
     for i, gsm_id in enumerate(sample_list):
@@ -697,6 +1023,81 @@ class GSE(object):
       sample.split_derivatives()
     
 
+def is_seekable(fp):
+  """Return True if file pointer `fp` can seek, like a cache or local file."""
+  seekable = getattr(fp, "seekable", None)
+  if seekable is not None:
+    return seekable()
+  return hasattr(fp, "seek")
+
+
+class RowIndex(object):
+  """Byte offsets of the lines of each row in the decompressed series matrix
+  files of a study.
+
+  GSE.open_rows() records offsets while it reads all rows. GSE.get_rows_at()
+  then reads selected rows again: seekable files, like large gzip files which
+  download caches rewrite block-compressed (see download.cached_download),
+  move to each row. Other files, like small gzip files cached as they are, are
+  decompressed again in one forward pass that discards the lines between
+  selected rows.
+
+  Attributes:
+    urls: [str] of series matrix file urls, in column order
+    seekable: bool if all files are seekable
+    complete: bool if the data offsets of all files are known, so that
+      selected rows can be read again
+    reason: str of why rows cannot be read again, or None
+    offsets: [array.array] of int per file of the byte offset of the line of
+      each row in the decompressed file
+  """
+  def __init__(self):
+    self.urls = []
+    self.seekable = False
+    self.complete = False
+    self.reason = None
+    self.offsets = []
+    self._positions = []
+
+  def __repr__(self):
+    return "[RowIndex of %d rows in %d files (%d)]" % \
+      (len(self), len(self.urls), id(self))
+
+  def __len__(self):
+    if not self.offsets:
+      return 0
+    return len(self.offsets[0])
+
+  def start(self, urls, fps, positions):
+    """Start index of opened files.
+
+    Args:
+      urls: [str] of series matrix file urls
+      fps: [obj] of opened file pointers of `urls`
+      positions: [int or None] of byte offset of the first data line of each
+        file, or None if not known
+    """
+    self.urls = urls
+    self.seekable = all(is_seekable(fp) for fp in fps)
+    if None in positions:
+      self.reason = "unknown data offsets of %s" % \
+        [url for url, pos in zip(urls, positions) if pos is None]
+    self.complete = self.reason is None
+    self.offsets = [array.array('l') for url in urls]
+    self._positions = list(positions)
+
+  def add(self, sizes):
+    """Add a row of lines of `sizes` bytes, one line per file."""
+    for k, size in enumerate(sizes):
+      self.offsets[k].append(self._positions[k])
+      self._positions[k] += size
+
+  def skip(self, sizes):
+    """Skip lines of `sizes` bytes which are not rows, one line per file."""
+    for k, size in enumerate(sizes):
+      self._positions[k] += size
+
+
 class FTPFile(object):
   """An abstract data file object.
 
@@ -705,6 +1106,7 @@ class FTPFile(object):
     filename: str of file name
     compressed: bool if this file seemed to be compressed
     size: int of reported file size in bytes
+    mtime: str of reported modification time like "Dec 28 07:34"
 
   FTP line format:
   -r--r--r--   1 ftp      anonymous 52831430 Dec 28 07:34 GSE25935_series_matrix-1.txt.gz
@@ -716,9 +1118,10 @@ class FTPFile(object):
       dir_url: str of full ftp path to this file's container
       ftp_line: str of whitespace delimited remote file attributes
     """
-    s = re.split("\s+", ftp_line.strip())
+    s = re.split(r"\s+", ftp_line.strip())
     self.filename = s[8]
     self.size = int(s[4])
+    self.mtime = " ".join(s[5:8])
     self.compressed = (self.filename.split(".")[-1].lower() == "gz")
     self.url = "%s/%s" % (dir_url.rstrip('/'), self.filename)
 
@@ -731,12 +1134,15 @@ class GPL(object):
 
   Attributes:
     id: str of GEO id like GPL4133
-    row_desc: {str: {str: str}} of row ids to dict of col_title=>value per row
+    table: GPLTable of loaded row descriptions or None if not loaded
+    row_desc: {str: {str: str}} of row ids to dict of col_title=>value per row;
+      the GPLTable self.table (or {} if not loaded)
     probe_list: [str] of probe IDs in row order in the order loaded
     probe_idx_map: {str:int} of probe ID to row index in self.probe_list (from zero)
     type: str in RECOGNIZED_STUDY_TYPES of platform type
     populated: bool if this GPL has metadata
     loaded: bool if this GPL has row descriptions
+    loaded_cols: set of str of loaded column titles or None if all are loaded
     col_titles: [str] of column titles in order they appear in GPL text matrix
     col_desc: {str:str} of column names to descriptions
     attrs: {str: [str]} of GPL attributes
@@ -746,17 +1152,20 @@ class GPL(object):
       Recognized parameters:
         all KEYWORDS column names, for example:
         'GENE_SYMBOL': str of column title containing a row's gene symbol
+    cache_key: (str, str) of (id, study_type) if shared through GPL.CACHE
   """
   PTN_GPL = "http://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc=%(id)s&targ=gpl&view=data&form=text"
   PTN_GPL_QUICK = "http://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc=%(id)s&targ=self&view=quick&form=text"
   PTN_GPL_FULL = "http://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc=GPL570&targ=gpl&view=full&form=text"
-  RX_PLATFORM = re.compile("^\^PLATFORM = (\w+)")
+  RX_PLATFORM = re.compile(r"^\^PLATFORM = (\w+)")
   # matches key, value
   RX_HEADER = re.compile("^#([^=]+?) = ?(.*)")
   RX_ATTR = re.compile("^!Platform_([^=]+?) = ?(.*)")
   HEAD_END_LINE = "!platform_table_begin"
   TABLE_END_LINE = "!platform_table_end"
   IGNORE_SAMPLE_IDS = True # set to False to load 'sample_id' attribute list from GPL file definition.
+  # Shared cache of parsed GPLs used by GPL.get(). Set to None to disable.
+  CACHE = GPLCache()
 
   # Use these keywords to find special columns and determine study type
   # {type: {col_name: [key_words]}}
@@ -790,22 +1199,22 @@ class GPL(object):
   COL_TYPE_RX = {
     # see: http://www.genenames.org/guidelines.html
     'GENE_SYMBOL': '[A-Z][a-zA-Z0-9-]+',
-    'ENTREZ_GENE_ID': '\d+',
+    'ENTREZ_GENE_ID': r'\d+',
     # http://useast.ensembl.org/Help/View?id=143
-    'ENSEMBL_ID': 'ENS[A-Z]{1,3}\d{11}',
+    'ENSEMBL_ID': r'ENS[A-Z]{1,3}\d{11}',
     # http://www.ncbi.nlm.nih.gov/Sequin/acc.html    
-    'GENBANK_ACC': '[A-Z]{1,5}[_-]?\d{2,8}',
+    'GENBANK_ACC': r'[A-Z]{1,5}[_-]?\d{2,8}',
     # http://www.ncbi.nlm.nih.gov/RefSeq/key.html
-    'REFSEQ_ACC': '[A-Z]{2}_\d+',
-    'SNP_ID': '(rs|cnvi)?\d+',
-    'CHROMOSOME': '\d{1,2}',
-    'LOCATION': '\d+',
+    'REFSEQ_ACC': r'[A-Z]{2}_\d+',
+    'SNP_ID': r'(rs|cnvi)?\d+',
+    'CHROMOSOME': r'\d{1,2}',
+    'LOCATION': r'\d+',
   }
   for key in COL_TYPE_RX:
     COL_TYPE_RX[key] = re.compile(COL_TYPE_RX[key])
 
   def __init__(self, gpl_id, study_type=None, custom_parameters=None):
-    """Initialize GPL.
+    r"""Initialize GPL.
 
     Args:
       gpl_id: str of GPL id like GPL\d+
@@ -815,15 +1224,14 @@ class GPL(object):
     self.id = gpl_id
     self.populated = False
     self.loaded = False
+    self.loaded_cols = None
     self.col_titles = []
     self.col_desc = {}
-    self.row_desc = {}
-    self.probe_list = []
-    self.probe_idx_map = {}
+    self._set_table(None)
     self.type = study_type
     self.special_cols = {}
     self.attrs = {}
-    self.case_insensitive_row_id = {}
+    self.cache_key = None
     # Set external parameters, update with custom user settings if they exist.
     self.parameters = GPL_SETTINGS.get(self.id, {}).copy()
     if custom_parameters:
@@ -832,6 +1240,31 @@ class GPL(object):
     # Populate self with meta data
     self._populate()
 
+  @classmethod
+  def get(cls, gpl_id, study_type=None):
+    r"""Return shared GPL of this ID and study type from cache, or a new GPL.
+
+    New GPLs are added to the cache. Loading rows of a shared GPL updates its
+    cache file, or writes a separate file if only special columns are loaded.
+
+    Args:
+      gpl_id: str of GPL id like GPL\d+
+      study_type: str in RECOGNIZED_STUDY_TYPES or None to guess type
+    Returns:
+      GPL of populated platform, possibly with loaded row descriptions
+    """
+    if cls.CACHE is None:
+      return cls(gpl_id, study_type=study_type)
+    key = (gpl_id, study_type)
+    gpl = cls.CACHE.get(key, cls)
+    if gpl is not None:
+      Log.info("Using cached %s for (%s, %s).", gpl, gpl_id, study_type)
+    else:
+      gpl = cls(gpl_id, study_type=study_type)
+      cls.CACHE.put(key, gpl)
+    gpl.cache_key = key
+    return gpl
+
   @property
   def url(self):
     return self.PTN_GPL_FULL % {'id': self.id}
@@ -840,16 +1273,26 @@ class GPL(object):
   def brief_url(self):
     return self.PTN_GPL_QUICK % {'id': self.id}
 
+  @property
+  def data_url(self):
+    return self.PTN_GPL % {'id': self.id}
+
+  def source_urls(self):
+    """Return [str] of urls of downloads parsed into this object so far."""
+    if self.loaded:
+      return [self.brief_url, self.data_url]
+    return [self.brief_url]
+
   def _check_id(self, line):
     """Raise error if platform id parsed from `line` does not match self.id."""
     try:
       platform_id = self.RX_PLATFORM.match(line).group(1)
     except:
-      raise MalformedDataError, \
-          "Cannot recognize GPL ID in line %s parsing %s" % (line, self.id)
+      raise MalformedDataError("Cannot recognize GPL ID in line %s parsing %s" %
+        (line, self.id))
     if platform_id != self.id:
-      raise MalformedDataError, \
-          "GPL ID %s differs from requested ID %s." % (platform_id, self.id)
+      raise MalformedDataError("GPL ID %s differs from requested ID %s." %
+        (platform_id, self.id))
   
   def _parse_brief(self, fp):
     """Parse GPL QUICK SOFT report.
@@ -859,7 +1302,7 @@ class GPL(object):
     """
     # 1. Consume and check GPL ID
     # ==========
-    line = fp.next().strip()
+    line = next(fp).strip()
     self._check_id(line)
 
     # 2. Collect column title descriptions and attributes
@@ -888,19 +1331,19 @@ class GPL(object):
         break
 
       # This line should never be reached in this loop.
-      raise MalformedDataError, \
-        "Unrecognized line '%s' while parsing %s" % (line, self)      
+      raise MalformedDataError("Unrecognized line '%s' while parsing %s" %
+        (line, self))
 
     # 3. Collect column titles from first row of data.
     # ==========
-    line = fp.next()
+    line = next(fp)
     self.col_titles = line.strip().split("\t")
 
     # 4. Verify that all column titles have a description
     # ==========
     if len(self.col_titles) != len(self.col_desc):
-      Log.warning("%d col_titles != %d col_desc for %s" % \
-        (len(self.col_titles), len(self.col_desc), self))
+      Log.warning("%d col_titles != %d col_desc for %s",
+                  len(self.col_titles), len(self.col_desc), self)
 
   def __repr__(self):
     #TODO: include type
@@ -908,18 +1351,18 @@ class GPL(object):
 
   def _get_fp(self):
     """Return file pointer to http connection for GPL data."""
-    url = self.PTN_GPL % {'id': self.id}
+    url = self.data_url
     handle = Download(url)
-    http_fp = handle.read()
-    Log.info("Fetched %s while loading %s." % (url, self))
+    http_fp = as_text(handle.read())
+    Log.info("Fetched %s while loading %s.", url, self)
     return http_fp
 
   def _get_fp_brief(self):
     """Return file pointer to http connection for GPL brief."""
-    url = self.PTN_GPL_QUICK % {'id': self.id}
+    url = self.brief_url
     handle = Download(url)
-    http_fp = handle.read()
-    Log.info("Fetched %s while loading %s." % (url, self))
+    http_fp = as_text(handle.read())
+    Log.info("Fetched %s while loading %s.", url, self)
     return http_fp
 
   def _populate(self):
@@ -938,15 +1381,14 @@ class GPL(object):
     # if given a type, check that this type matches guess.
     if self.type is not None:
       if guessed_type != self.type:
-        Log.warning("Guessed type '%s' != given type '%s' for %s" % \
-          (guessed_type, self.type, self))
+        Log.warning("Guessed type '%s' != given type '%s' for %s",
+                    guessed_type, self.type, self)
       else:
-        Log.info("Guessed type '%s' matches given type '%s' for %s" % \
-          (guessed_type, self.type, self))
+        Log.info("Guessed type '%s' matches given type '%s' for %s",
+                 guessed_type, self.type, self)
     else:
       self.type = guessed_type
-      Log.info("Set type to guessed type '%s' for %s" % \
-        (guessed_type, self))
+      Log.info("Set type to guessed type '%s' for %s", guessed_type, self)
     
     # 3. Identify special column titles (like gene symbol) for this GPL type
     # ==========
@@ -960,9 +1402,8 @@ class GPL(object):
       # Override for custom-set paramaters.
       if name in self.parameters:
         if self.parameters[name] not in self.col_titles:
-          raise MalformedDataError, \
-            "Custom parameter %s=%s not for %s, col_titles=%s" % \
-            (name, self.parameters[name], self, self.col_titles)
+          raise MalformedDataError("Custom parameter %s=%s not for %s, col_titles=%s" %
+            (name, self.parameters[name], self, self.col_titles))
         mapped_name = self.parameters[name]
         
       # Automatically detect the best matching column title.
@@ -980,10 +1421,10 @@ class GPL(object):
     Returns:
       str in RECOGNIZED_STUDY_TYPES
     """
-    Log.info("Attempting to guess study type of GPL %s." % self)
+    Log.info("Attempting to guess study type of GPL %s.", self)
     # Warn if no column title
     if not len(self.col_desc) > 1:
-      raise NotPopulatedError, "Parse brief for %s before guessing type" % self
+      raise NotPopulatedError("Parse brief for %s before guessing type" % self)
 
     # Match best type using keyword matching.
     type_ranks = {}
@@ -1002,8 +1443,7 @@ class GPL(object):
 
     # Guess top ranked study type. Log scores. Return best score.
     top = sorted(type_ranks, key=lambda x: type_ranks[x], reverse=True)[0]
-    Log.info("Guessed type=%s for %s. Rankings: %s" % \
-             (top, self, type_ranks))
+    Log.info("Guessed type=%s for %s. Rankings: %s", top, self, type_ranks)
     return top
     
   def _find_column(self, name):
@@ -1033,12 +1473,12 @@ class GPL(object):
       desc = None
     if best_score[1] <= 1:
       # Do not return weak results.
-      Log.warning("%s %s column not found with confidence. Best: '%s: %s'" % \
-                  (self, name, title, desc))
+      Log.warning("%s %s column not found with confidence. Best: '%s: %s'",
+                  self, name, title, desc)
       title = None
     else:
-      Log.info("Mapped '%s' to col title '%s: %s' for %s. Confidence: %d" % \
-               (name, title, desc, self, score))
+      Log.info("Mapped '%s' to col title '%s: %s' for %s. Confidence: %d",
+               name, title, desc, self, score)
                   
     # Return name of highest scoring GPL column title.
     return title
@@ -1053,64 +1493,88 @@ class GPL(object):
       str of value in column mapped by `name` or None
     """
     if not self.populated:
-      raise NotPopulatedError, "%s Row definitions not yet populated." % self
+      raise NotPopulatedError("%s Row definitions not yet populated." % self)
 
     # Verify that this special column exists for this GPL type.
     try:
       key = self.special_cols[name]
     except KeyError:
-      raise KeyError, \
-        "Special column %s not defined for %s of type %s. Defined cols: %s" % \
-        (name, self, self.type, self.KEYWORDS[self.type].keys())
+      raise KeyError("Special column %s not defined for %s of type %s. Defined cols: %s" %
+        (name, self, self.type, self.KEYWORDS[self.type].keys()))
 
     try:
-      row = self.row_desc[row_id]
+      i = self.probe_idx_map[row_id]
     except KeyError:
       row_id = self.case_insensitive_row_id[row_id.lower()]
-      row = self.row_desc[row_id]
-    # Attempt to return this column value at this row, else return None
-    try:
-      value = row[key]
-    except KeyError:
-      value = None
-    return value
+      i = self.probe_idx_map[row_id]
+    # Return this column value at this row, else return None
+    return self.table.get(i, key)
 
-  def load(self):
+  def load(self, special_only=False):
     """Fetch GPL row definitions, load values into this object.
+
+    Args:
+      special_only: bool if to load only columns in self.special_cols, as
+        needed by get_column(); else load all columns
     """
-    Log.info("Loading %s" % self)
-    # Do not reload a populated GEO object.
-    if self.loaded:
-      Log.warning("%s already loaded." % self)
+    Log.info("Loading %s", self)
+    # Do not reload a populated GEO object unless more columns are requested.
+    if self.loaded and (self.loaded_cols is None or special_only):
+      Log.warning("%s already loaded.", self)
       return
+    if special_only:
+      columns = set([x for x in self.special_cols.values() if x is not None])
+    else:
+      columns = None
     
-    http_fp = self._get_fp()
-    self._parse(http_fp)
-    http_fp.close()
+    with metrics.stage("gpl.load") as stage:
+      http_fp = self._get_fp()
+      self._parse(http_fp, columns)
+      http_fp.close()
+      stage.rows = len(self.row_desc)
 
     # Verify that at least one row description has been loaded.
     if len(self.row_desc) < 1:
-      Log.warning("No row descriptions loaded for %s." % self)
+      Log.warning("No row descriptions loaded for %s.", self)
     else:
-      Log.info("Loaded %d row descriptions for %s." % (len(self.row_desc), self))
+      Log.info("Loaded %d row descriptions for %s.", len(self.row_desc), self)
     self.loaded = True
+    # Update cache file of a shared GPL to include its rows. Rows of special
+    #   columns only go to a separate file.
+    if self.cache_key is not None and self.CACHE is not None:
+      self.CACHE.put(self.cache_key, self)
+
+  def _set_table(self, table):
+    """Set row descriptions to GPLTable `table`, or to empty if None."""
+    self.table = table
+    if table is None:
+      self.row_desc = {}
+      self.probe_list = []
+      self.probe_idx_map = {}
+      self.case_insensitive_row_id = {}
+    else:
+      self.row_desc = table
+      self.probe_list = table.probe_ids
+      self.probe_idx_map = table.probe_idx
+      self.case_insensitive_row_id = table.lower_ids
 
-  def _parse(self, fp):
+  def _parse(self, fp, columns=None):
     """Parse a GPL text representation.
 
     Args:
       fp: iter=>str of "#header" format lines
+      columns: set of str of column titles to load or None to load all
     """
     # 0. Consume and check GPL ID
-    line = fp.next().strip()
+    line = next(fp).strip()
     try:
       platform_id = self.RX_PLATFORM.match(line).group(1)
     except:
-      raise MalformedDataError, \
-          "Cannot recognize GPL ID in line %s parsing %s" % (line, self.id)
+      raise MalformedDataError("Cannot recognize GPL ID in line %s parsing %s" %
+        (line, self.id))
     if platform_id != self.id:
-      raise MalformedDataError, \
-          "GPL ID %s differs from requested ID %s." % (platform_id, self.id)
+      raise MalformedDataError("GPL ID %s differs from requested ID %s." %
+        (platform_id, self.id))
     
     # 1. Collect GPL attributes and column titles.
     for line in fp:
@@ -1125,17 +1589,18 @@ class GPL(object):
             # This is a header line from a 'full' GPL definition file. Ignore it.
             continue
         else:
-          raise MalformedDataError, \
-              "Unrecognized line '%s' while parsing %s" % (line, self.id)
+          raise MalformedDataError("Unrecognized line '%s' while parsing %s" %
+            (line, self.id))
       key, value = m.groups()
       self.col_desc[key] = value
 
     # 2. Collect column titles from first row of data.
-    line = fp.next()
+    line = next(fp)
     self.col_titles = line.strip().split("\t")
       
-    # 3. Load probe definitions.
-    n_row = 0
+    # 3. Load probe definitions into a columnar table.
+    table = GPLTable(self.col_titles, columns)
+    warnings = LimitedLog(Log, self)
     for line in fp:
       
       # Only strip end-of-line characters to avoid column misalignment.
@@ -1143,39 +1608,32 @@ class GPL(object):
       if line == self.TABLE_END_LINE:
         break
       
-      # Split line by tabs.
+      # Split line by tabs. Add row values and row_id to row list.
       row = line.split('\t')
-      
-      # Create new dictionary for this row_id.
-      row_id = row[0]
-      self.row_desc[row_id] = {}
-
-      # Populate the attributes for this row.
-      for i in range(1, len(row)):
-        value = row[i].strip()
-        name = self.col_titles[i]
-        # Ignore empty values.
-        if value != "":
-          self.row_desc[row_id][name] = value
+      try:
+        is_new_lower = table.append(row)
+      except ValueError as e:
+        raise MalformedDataError("%s while parsing %s" % (e, self))
           
-      # Add row_id to case-insensitive map.
+      # Case-insensitive map keeps the first row_id.
       #   (use this for debugging when row_ids have letter case errors.)
-      if row_id.lower() in self.case_insensitive_row_id:
-        Log.warning("Multiple case-insensitive row_ids map row_id %s for %s" %\
-          (row_id.lower(), self))
-      else:
-        self.case_insensitive_row_id[row_id.lower()] = row_id
+      if not is_new_lower:
+        warnings.warning("row_id case", "Multiple case-insensitive row_ids "
+                         "map row_id %s for %s", row[0].lower(), self)
+    warnings.summary()
 
-      # Add row_id to row list.
-      self.probe_list.append(row_id)
-      self.probe_idx_map[row_id] = n_row
-      n_row += 1
+    self._set_table(table)
+    self.loaded_cols = table.columns
           
     # 4. Clean Up
-    Log.info("Populated %s with %d row descriptions of %d columns." % \
-             (self, len(self.row_desc), len(self.col_titles)))
-    Log.info("%d row_ids in list, %d unique row_ids." % \
-             (len(self.probe_list), len(self.probe_idx_map)))
+    if columns is None:
+      n_cols = len(self.col_titles)
+    else:
+      n_cols = len(columns)
+    Log.info("Populated %s with %d row descriptions of %d columns.",
+             self, len(self.row_desc), n_cols)
+    Log.info("%d row_ids in list, %d unique row_ids.",
+             len(self.probe_list), len(self.probe_idx_map))
     fp.close()
 
   @classmethod
@@ -1183,21 +1641,21 @@ class GPL(object):
     """Download full GPL definition."""
     url = cls.PTN_GPL_FULL % {'id': gpl_id}
     handle = Download(url)
-    return handle.read()
+    return as_text(handle.read())
 
   @classmethod
   def fp_download_data(cls, gpl_id):
     """Download full GPL definition."""
     url = cls.PTN_GPL_FULL % {'id': gpl_id}
     handle = Download(url)
-    return handle.read()
+    return as_text(handle.read())
 
   @classmethod
   def fp_download_brief(cls, gpl_id):
     """Download full GPL definition."""
     url = cls.PTN_GPL_QUICK % {'id': gpl_id}
     handle = Download(url)
-    return handle.read()
+    return as_text(handle.read())
 
 
     
@@ -1241,14 +1699,14 @@ class GSM(object):
     if key == "title":
       m = self.rx_title.match(value)
       if m is None:
-        Log.warning("Title '%s' of %s did not match regex %s." % \
-                    (value, self, self.rx_title))
+        Log.warning("Title '%s' of %s did not match regex %s.",
+                    value, self, self.rx_title.pattern)
       else:
         self.subject, self.rep = m.groups()
 
   def split_derivatives(self):
     """Attempt to split multi-attributes assigned to a single attribute key."""
-    for k, v in self.attr.items():
+    for k, v in list(self.attr.items()):
       if len(v) > 1:
         new_attrs = {}
         old_values = set()
@@ -1271,11 +1729,11 @@ class LocalGPL(GPL):
     self.fname_brief, self.fname_data, self.data_is_tab = fname_brief, fname_data, data_is_tab
 
     # get GPL ID from first line of GPL brief
-    gpl_id = self.RX_PLATFORM.match(open(fname_brief).next()).group(1)
+    gpl_id = self.RX_PLATFORM.match(next(open(fname_brief))).group(1)
     super(LocalGPL, self).__init__(gpl_id, *args, **kwds)
 
   def _get_fp(self):
-    Log.info("Loaded %s from file while loading %s." % (self.fname_data, self))
+    Log.info("Loaded %s from file while loading %s.", self.fname_data, self)
     if self.data_is_tab:
       fp = FauxGPLFile(open(self.fname_data, "r"), gpl_id=self.id)
     else:
@@ -1283,7 +1741,7 @@ class LocalGPL(GPL):
     return fp
   
   def _get_fp_brief(self):
-    Log.info("Loaded %s from file while loading %s." % (self.fname_brief, self))
+    Log.info("Loaded %s from file while loading %s.", self.fname_brief, self)
     return open(self.fname_brief, "r")
 
                            
@@ -1304,11 +1762,12 @@ class FauxGPLFile(object):
     elif self.n_line == 2:
       return GPL.HEAD_END_LINE+"\n"
     elif self.n_line == 3:
-      line = self.fp.next()
+      line = next(self.fp)
       assert line[0] == '#'
       return line[1:]
     else:
-      return self.fp.next()
+      return next(self.fp)
+  __next__ = next
     
   def close(self):
     self.fp.close()
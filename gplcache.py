@@ -0,0 +1,234 @@
+#!/usr/bin/python
+"""Persistent cache of parsed GPL platforms.
+
+Studies which share a platform share one parsed GPL object through an
+in-process LRU cache. Parsed platforms are also written to a binary file per
+platform and study type in CACHE_DIR, so that later processes skip the GPL
+download, parsing, study type guess and special column search. Cache files
+are marshalled builtin types read from a memory map; loading a 50k probe
+platform takes milliseconds.
+
+Cache files are named like "GPL570.eQTL.gpl" and include a format version.
+Platforms with only the special columns loaded, as by GPL.load(special_only=
+True), are written to files like "GPL570.eQTL.special.gpl" instead, so that
+they never replace a file with all columns. A cache file records when the GPL
+downloads it was parsed from were cached, and it is ignored once a download
+cache file of one of them is newer. Delete cache files to force reparsing,
+for example after changing KEYWORDS.
+"""
+import os
+import sys
+import marshal
+import mmap
+import threading
+
+try:
+  from collections import OrderedDict
+except ImportError:
+  from ordereddict import OrderedDict
+
+from gpltable import GPLTable
+from download.cached_download import get_cache_name, read_meta
+from download.cachemanager import touch
+from logger import Log
+
+# Magic prefix and version of cache files. Increment if GPL parsing changes.
+MAGIC = b"GPLCACHE"
+FORMAT_VERSION = 2
+# Header line of cache files; marshal data of Python 2 and 3 differ.
+HEADER = b"%s %d py%d\n" % (MAGIC, FORMAT_VERSION, sys.version_info[0])
+# Suffix of cache files of platforms with only special columns loaded.
+PARTIAL_SUFFIX = ".special"
+# GPL attributes stored in a cache file besides its row table.
+GPL_FIELDS = ("id", "type", "populated", "loaded", "loaded_cols", "col_titles",
+              "col_desc", "attrs", "special_cols", "parameters")
+
+
+def get_cache_dir():
+  """Return CACHE_DIR path from environment, or None if it is not set."""
+  return os.environ.get("CACHE_DIR")
+
+
+class GPLCache(object):
+  """In-process LRU cache of GPL objects backed by cache files.
+
+  Keys are (gpl_id, study_type) tuples. A study type of None is the key of
+  a GPL which guessed its own type.
+
+  Attributes:
+    max_size: int of maximum number of GPL objects kept in memory
+    cache_dir: str of directory of cache files, None to read CACHE_DIR from
+      the environment when used, or False to disable cache files
+  """
+  def __init__(self, max_size=8, cache_dir=None):
+    """Initialize empty cache.
+
+    Args:
+      max_size: int of maximum number of GPL objects kept in memory
+      cache_dir: str of directory of cache files, None for CACHE_DIR, or False
+    """
+    self.max_size = max_size
+    self.cache_dir = cache_dir
+    self._gpls = OrderedDict()
+    self._lock = threading.RLock()
+
+  def __repr__(self):
+    return "[GPLCache: %d of %d in memory, dir=%s (%d)]" % \
+      (len(self._gpls), self.max_size, self.cache_dir, id(self))
+
+  def __len__(self):
+    return len(self._gpls)
+
+  def _get_dir(self):
+    """Return str of cache file directory or None if files are disabled."""
+    cache_dir = self.cache_dir
+    if cache_dir is None:
+      cache_dir = get_cache_dir()
+    if cache_dir is None or cache_dir is False:
+      return None
+    return cache_dir
+
+  def _filepath(self, key, partial=False):
+    """Return str of cache file path of `key` or None if files are disabled.
+
+    Args:
+      key: (str, str) of (gpl_id, study_type)
+      partial: bool if of the file of a GPL with only special columns loaded
+    """
+    cache_dir = self._get_dir()
+    if cache_dir is None:
+      return None
+    gpl_id, study_type = key
+    suffix = PARTIAL_SUFFIX if partial else ""
+    return os.path.join(cache_dir, "%s.%s%s.gpl" % (gpl_id, study_type, suffix))
+
+  def _sources(self, urls):
+    """Return {str: float} of url to time its download was cached or None.
+
+    Download cache files are looked up in the cache file directory.
+    """
+    cache_dir = self._get_dir()
+    sources = {}
+    for url in urls:
+      meta = read_meta(os.path.join(cache_dir, get_cache_name(url))) or {}
+      sources[url] = meta.get('time')
+    return sources
+
+  def get(self, key, cls):
+    """Return cached GPL of `key` from memory or file, or None.
+
+    Args:
+      key: (str, str) of (gpl_id, study_type)
+      cls: class of GPL objects to restore from file
+    Returns:
+      GPL or None if not cached
+    """
+    with self._lock:
+      gpl = self._gpls.pop(key, None)
+      if gpl is not None:
+        self._gpls[key] = gpl
+        return gpl
+      gpl = self._read(self._filepath(key), cls)
+      if gpl is None or not gpl.loaded:
+        # Rows of special columns only are better than none.
+        gpl = self._read(self._filepath(key, partial=True), cls) or gpl
+      if gpl is not None:
+        self._remember(key, gpl)
+      return gpl
+
+  def put(self, key, gpl):
+    """Cache GPL in memory and write its cache file.
+
+    A GPL with only special columns loaded is written to its own file.
+
+    Args:
+      key: (str, str) of (gpl_id, study_type)
+      gpl: GPL of populated platform, with or without loaded rows
+    """
+    with self._lock:
+      self._gpls.pop(key, None)
+      self._remember(key, gpl)
+      self._write(key, gpl)
+
+  def clear(self):
+    """Forget all GPL objects in memory. Cache files are not removed."""
+    with self._lock:
+      self._gpls.clear()
+
+  def _remember(self, key, gpl):
+    """Add GPL to memory as most recently used; evict least recently used."""
+    self._gpls[key] = gpl
+    while len(self._gpls) > self.max_size:
+      self._gpls.popitem(last=False)
+
+  def _write(self, key, gpl):
+    """Write GPL to its cache file, if enabled. Log and ignore write errors."""
+    filepath = self._filepath(key, partial=gpl.loaded_cols is not None)
+    if filepath is None:
+      return
+    d = dict([(name, getattr(gpl, name)) for name in GPL_FIELDS])
+    d['sources'] = self._sources(gpl.source_urls())
+    if gpl.table is not None:
+      d['table'] = gpl.table.dump()
+    else:
+      d['table'] = None
+    # Write to a temporary file, then rename, so readers see whole files only.
+    tmp_filepath = "%s.%d.tmp" % (filepath, os.getpid())
+    try:
+      fp = open(tmp_filepath, "wb")
+      fp.write(HEADER)
+      marshal.dump(d, fp)
+      fp.close()
+      os.rename(tmp_filepath, filepath)
+    except (IOError, OSError, ValueError) as e:
+      Log.warning("Cannot write GPL cache file %s: %s" % (filepath, e))
+      if os.path.exists(tmp_filepath):
+        os.remove(tmp_filepath)
+      return
+    Log.info("Wrote %s to GPL cache file %s." % (gpl, filepath))
+
+  def _read(self, filepath, cls):
+    """Return GPL restored from cache file `filepath` or None if not cached.
+
+    A file is ignored if a download it was parsed from has been cached again
+    since it was written, or has been cached only since.
+    """
+    if filepath is None or not os.path.exists(filepath):
+      return None
+    try:
+      fp = open(filepath, "rb")
+    except IOError:
+      # Evicted by another process since it was found.
+      return None
+    try:
+      header = fp.readline()
+      if header != HEADER:
+        Log.info("Ignored GPL cache file %s of other format %r." % \
+          (filepath, header.strip()))
+        return None
+      mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        d = marshal.loads(mm[len(header):])
+      finally:
+        mm.close()
+      # Evicted downloads are no reason to reparse, newer downloads are.
+      sources = self._sources(d['sources'])
+      if [url for url, t in sources.items()
+          if t is not None and t != d['sources'][url]]:
+        Log.info("Ignored GPL cache file %s of other downloads.", filepath)
+        return None
+      gpl = cls.__new__(cls)
+      for name in GPL_FIELDS:
+        setattr(gpl, name, d[name])
+      if d['table'] is not None:
+        gpl._set_table(GPLTable.restore(d['table']))
+      else:
+        gpl._set_table(None)
+    except (EOFError, KeyError, ValueError, TypeError, EnvironmentError) as e:
+      Log.warning("Ignored unreadable GPL cache file %s: %s" % (filepath, e))
+      return None
+    finally:
+      fp.close()
+    touch(filepath)
+    Log.info("Loaded %s from GPL cache file %s." % (gpl, filepath))
+    return gpl
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+"""Columnar store of GPL platform row descriptions.
+
+A GPL table of 50k+ probes and 15+ annotation columns stored as one dict per
+probe takes hundreds of MB. GPLTable stores one list per column instead, of
+interned strings (values like gene symbols repeat across probes), and maps
+each probe ID to its integer row index. Columns not needed by the caller,
+like sequences or GO annotations, need not be stored at all.
+
+GPLTable also reads as the former {row_id: {col_title: value}} dict of row
+descriptions: table[row_id] returns a new dict of the row's nonempty values.
+"""
+try:
+  intern
+except NameError:
+  from sys import intern
+
+
+class GPLTable(object):
+  """Column-oriented GPL row descriptions indexed by probe ID.
+
+  Attributes:
+    col_titles: [str] of all column titles; col_titles[0] is the probe ID
+    columns: set of str of stored column titles or None if all are stored
+    probe_ids: [str] of probe IDs in row order
+    probe_idx: {str:int} of probe ID to its last row index in probe_ids
+    lower_ids: {str:str} of probe ID in lower case to its first actual case
+  """
+  def __init__(self, col_titles, columns=None):
+    """Initialize empty table.
+
+    Args:
+      col_titles: [str] of column titles of GPL data table, starting with ID
+      columns: [str] of column titles to store or None to store all columns
+    """
+    self.col_titles = list(col_titles)
+    if columns is not None:
+      columns = set(columns)
+    self.columns = columns
+    self.probe_ids = []
+    self.probe_idx = {}
+    self.lower_ids = {}
+    # Column positions in a row and value lists of stored columns.
+    self._col_pos = []
+    self._values = {}
+    for i, title in enumerate(self.col_titles):
+      if i == 0 or (columns is not None and title not in columns):
+        continue
+      self._col_pos.append((i, title))
+      self._values[title] = []
+
+  def __repr__(self):
+    return "[GPLTable: %d rows, %d of %d cols (%d)]" % \
+      (len(self.probe_ids), len(self._values), len(self.col_titles)-1, id(self))
+
+  def __len__(self):
+    """Return number of unique probe IDs."""
+    return len(self.probe_idx)
+
+  def __contains__(self, row_id):
+    return row_id in self.probe_idx
+
+  def __iter__(self):
+    return iter(self.probe_idx)
+
+  def keys(self):
+    return self.probe_idx.keys()
+
+  def __getitem__(self, row_id):
+    """Return {str: str} of nonempty stored values of probe `row_id`."""
+    i = self.probe_idx[row_id]
+    row = {}
+    for title, values in self._values.items():
+      if values[i] is not None:
+        row[title] = values[i]
+    return row
+
+  def get(self, i, title):
+    """Return value of column `title` at row index `i`, or None.
+
+    Args:
+      i: int of row index in self.probe_ids
+      title: str of column title
+    Returns:
+      str of nonempty value, or None if empty or column is not stored
+    """
+    try:
+      return self._values[title][i]
+    except KeyError:
+      return None
+
+  def append(self, row):
+    """Add row split from a GPL data line.
+
+    Args:
+      row: [str] of probe ID followed by column values
+    Returns:
+      bool if probe ID was new in lower case, as compared to prior rows
+    """
+    if len(row) > len(self.col_titles):
+      raise ValueError("Row %s has %d values, expected at most %d in %s." %
+        (row[0], len(row), len(self.col_titles), self))
+    n = len(row)
+    for i, title in self._col_pos:
+      value = row[i].strip() if i < n else ""
+      # Store empty values as None.
+      if value:
+        self._values[title].append(intern(value))
+      else:
+        self._values[title].append(None)
+
+    row_id = row[0]
+    self.probe_idx[row_id] = len(self.probe_ids)
+    self.probe_ids.append(row_id)
+    row_id_lower = row_id.lower()
+    if row_id_lower in self.lower_ids:
+      return False
+    self.lower_ids[row_id_lower] = row_id
+    return True
+
+  def dump(self):
+    """Return dict of table contents of only builtin types, as for marshal."""
+    return {
+      'col_titles': self.col_titles,
+      'columns': self.columns,
+      'probe_ids': self.probe_ids,
+      'probe_idx': self.probe_idx,
+      'lower_ids': self.lower_ids,
+      'values': self._values,
+    }
+
+  @classmethod
+  def restore(cls, d):
+    """Return GPLTable from dict `d` returned by GPLTable.dump()."""
+    table = cls(d['col_titles'], d['columns'])
+    table.probe_ids = d['probe_ids']
+    table.probe_idx = d['probe_idx']
+    table.lower_ids = d['lower_ids']
+    if set(d['values']) != set(table._values):
+      raise ValueError("Stored columns %s differ from expected %s." %
+        (sorted(d['values']), sorted(table._values)))
+    table._values = d['values']
+    return table
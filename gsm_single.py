@@ -5,8 +5,8 @@ Includes sample data.
 """
 import re
 
-RX_TITLE = re.compile("^\^SAMPLE = (\w+)")
-RX_SAMPLE = re.compile("^!Sample_(\w+) = (.+)$")
+RX_TITLE = re.compile(r"^\^SAMPLE = (\w+)")
+RX_SAMPLE = re.compile(r"^!Sample_(\w+) = (.+)$")
 RX_DESC = re.compile("^#([^=]+?) = ?(.*)")
 S_BEGIN = "!sample_table_begin"
 S_END = "!sample_table_end"
@@ -24,7 +24,7 @@ class GSM_Lite(object):
     self.rows = {}
 
     # title
-    self.id = RX_TITLE.match(fp.next().strip('\n\r')).group(1)
+    self.id = RX_TITLE.match(next(fp).strip('\n\r')).group(1)
     # headers
     for line in fp:
       line = line.strip('\n\r')
@@ -39,7 +39,7 @@ class GSM_Lite(object):
           self.col_desc.setdefault(m.group(1), []).append(m.group(2))
     self.split_derivatives()
     # data table column headers
-    self.col_headers = fp.next().strip('\n\r').split('\t')
+    self.col_headers = next(fp).strip('\n\r').split('\t')
     for line in fp:
       line = line.rstrip('\n\r')
       if line == S_END:
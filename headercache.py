@@ -0,0 +1,107 @@
+#!/usr/bin/python
+"""Persistent cache of parsed series matrix headers.
+
+GSE._populate reads the "!Sample_" header lines and the column title line of
+every series matrix file of a study, and GSE.get_rows reads the same files
+again from their first data line. The parsed header of each file, with the
+byte offset of its first data line in the decompressed file, is written to a
+cache file in CACHE_DIR. Later GSE objects populate from the cache file
+without opening the series matrix file, and get_rows skips to the data
+without parsing header lines.
+
+Cache files are named like the download cache file of the series matrix file
+with the suffix ".header". A cache file is ignored if the series matrix file
+on the FTP server has another size or modification time.
+"""
+import os
+import sys
+import marshal
+
+from download.cached_download import get_cache_name
+from download.cachemanager import touch
+from logger import Log
+
+# Magic prefix and version of cache files. Increment if header parsing changes.
+MAGIC = b"GSEHEADER"
+FORMAT_VERSION = 1
+# Header line of cache files; marshal data of Python 2 and 3 differ.
+HEADER = b"%s %d py%d\n" % (MAGIC, FORMAT_VERSION, sys.version_info[0])
+
+
+def get_cache_dir():
+  """Return CACHE_DIR path from environment, or None if it is not set."""
+  return os.environ.get("CACHE_DIR")
+
+
+class HeaderCache(object):
+  """Cache files of parsed series matrix headers keyed by FTPFile.
+
+  A header is a dict with keys:
+    'sample_attrs': {str: [[str]]} of !Sample_ attribute to rows of values
+    'col_titles': [str] of column titles of the file
+    'offset': int of byte offset of the first data line in the decompressed file
+
+  Attributes:
+    cache_dir: str of directory of cache files, None to read CACHE_DIR from
+      the environment when used, or False to disable cache files
+  """
+  def __init__(self, cache_dir=None):
+    self.cache_dir = cache_dir
+
+  def __repr__(self):
+    return "[HeaderCache: dir=%s (%d)]" % (self.cache_dir, id(self))
+
+  def _filepath(self, ftp_file):
+    """Return str of cache file path or None if files are disabled."""
+    cache_dir = self.cache_dir
+    if cache_dir is None:
+      cache_dir = get_cache_dir()
+    if cache_dir is None or cache_dir is False:
+      return None
+    return os.path.join(cache_dir, get_cache_name(ftp_file.url) + ".header")
+
+  def get(self, ftp_file):
+    """Return cached header dict of FTPFile `ftp_file` or None."""
+    filepath = self._filepath(ftp_file)
+    if filepath is None or not os.path.exists(filepath):
+      return None
+    try:
+      fp = open(filepath, "rb")
+    except IOError:
+      # Evicted by another process since it was found.
+      return None
+    try:
+      header = fp.readline()
+      if header != HEADER:
+        return None
+      d = marshal.load(fp)
+    except (EOFError, ValueError, TypeError, EnvironmentError) as e:
+      Log.warning("Ignored unreadable header cache file %s: %s" % (filepath, e))
+      return None
+    finally:
+      fp.close()
+    if d.get('size') != ftp_file.size or d.get('mtime') != ftp_file.mtime:
+      Log.info("Ignored header cache file %s of other remote file." % filepath)
+      return None
+    touch(filepath)
+    return d['header']
+
+  def put(self, ftp_file, header):
+    """Write header dict of FTPFile `ftp_file`. Log and ignore write errors."""
+    filepath = self._filepath(ftp_file)
+    if filepath is None:
+      return
+    d = {'url': ftp_file.url, 'size': ftp_file.size, 'mtime': ftp_file.mtime,
+         'header': header}
+    # Write to a temporary file, then rename, so readers see whole files only.
+    tmp_filepath = "%s.%d.tmp" % (filepath, os.getpid())
+    try:
+      fp = open(tmp_filepath, "wb")
+      fp.write(HEADER)
+      marshal.dump(d, fp)
+      fp.close()
+      os.rename(tmp_filepath, filepath)
+    except (IOError, OSError, ValueError) as e:
+      Log.warning("Cannot write header cache file %s: %s" % (filepath, e))
+      if os.path.exists(tmp_filepath):
+        os.remove(tmp_filepath)
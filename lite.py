@@ -9,7 +9,7 @@ except ImportError:
   # Python <=2.6
   from ordereddict import OrderedDict
   
-RX_PLATFORM = re.compile("^\^PLATFORM = (\w+)")
+RX_PLATFORM = re.compile(r"^\^PLATFORM = (\w+)")
 RX_HEADER = re.compile("^#([^=]+?) = ?(.*)")
 RX_ATTR = re.compile("^!Platform_([^=]+?) = ?(.*)")
 HEAD_END_LINE = "!platform_table_begin"
@@ -22,7 +22,7 @@ class GPL_Lite(object):
     self.rows = OrderedDict()
     
     # GPL ID
-    self.id = RX_PLATFORM.match(fp.next()).group(1)
+    self.id = RX_PLATFORM.match(next(fp)).group(1)
     # Column Attribute Descriptions
     for line in fp:
       m = RX_HEADER.match(line)
@@ -32,8 +32,8 @@ class GPL_Lite(object):
     s = line.strip('\r\n')
     assert s == HEAD_END_LINE, "[%s] != [%s]" % (s, HEAD_END_LINE)
     # Column titles
-    titles = fp.next().strip('\r\n').split('\t')
-    assert self.cols.keys() == titles, "%s != %s" % (self.cols.keys(), titles)
+    titles = next(fp).strip('\r\n').split('\t')
+    assert list(self.cols.keys()) == titles, "%s != %s" % (list(self.cols.keys()), titles)
     # Data rows
     for i, line in enumerate(fp):
       line = line.strip('\r\n')
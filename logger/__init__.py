@@ -1,10 +1,12 @@
 #!/usr/bin/python
 import os
 
+from .limited_log import LimitedLog
+
 # Set context sensitive logger.
 if 'ENV' in os.environ and os.environ['ENV'] == "SERVER":
-    import server_logger
+    from . import server_logger
     Log = server_logger.Log
 else:
-    import stderr_logger
+    from . import stderr_logger
     Log = stderr_logger.Log
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+"""Rate limited log of repeated warnings, as of malformed data rows.
+
+A malformed study can warn once per data row. LimitedLog logs the first
+`limit` messages of each kind and only counts the rest; summary() logs the
+counts.
+
+SAMPLE USE:
+  warnings = LimitedLog(Log, "GSE2034")
+  for row in rows:
+    if len(row) != n:
+      warnings.warning("columns", "Row of %d columns != %d.", len(row), n)
+  warnings.summary()
+"""
+import sys
+import logging
+
+
+class LimitedLog(object):
+  """Log of at most `limit` warnings per kind, with counts of all.
+
+  Attributes:
+    log: logging.Logger to which messages are written
+    name: str of name of the logging object, for summary messages
+    limit: int of messages logged per kind
+    counts: {str: int} of number of warnings per kind
+  """
+  LIMIT = 10
+
+  def __init__(self, log, name=None, limit=None):
+    self.log = log
+    self.name = name
+    if limit is None:
+      limit = self.LIMIT
+    self.limit = limit
+    self.counts = {}
+
+  def __repr__(self):
+    return "[LimitedLog %s: %s (%d)]" % (self.name, self.counts, id(self))
+
+  def warning(self, kind, msg, *args):
+    """Log warning `msg` % `args` unless `limit` warnings of `kind` were logged.
+
+    Args:
+      kind: str of kind of warning
+      msg: str of message format; it is formatted only if logged
+      *args: objs of message format arguments
+    """
+    n = self.counts.get(kind, 0) + 1
+    self.counts[kind] = n
+    if n <= self.limit:
+      self._warn(msg, args)
+      if n == self.limit:
+        self._warn("Logged %d '%s' warnings for %s; counting more.",
+                   (n, kind, self.name))
+
+  def summary(self):
+    """Log number of warnings per kind, if any were not logged."""
+    for kind, n in sorted(self.counts.items()):
+      if n > self.limit:
+        self._warn("%d '%s' warnings for %s, %d of them not logged.",
+                   (n, kind, self.name, n - self.limit))
+
+  def _warn(self, msg, args):
+    """Log warning with the module, function and line of the caller of self."""
+    if not self.log.isEnabledFor(logging.WARNING):
+      return
+    frame = sys._getframe(2)
+    code = frame.f_code
+    record = self.log.makeRecord(self.log.name, logging.WARNING,
+      code.co_filename, frame.f_lineno, msg, args, None, code.co_name)
+    self.log.handle(record)
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+"""Log handler which passes records to a writer thread through a queue.
+
+Parsing threads which log only put records on a queue; a daemon thread
+formats them and writes them to the file and stream handlers. Messages are
+formatted by the writer thread. Arguments which may change after they are
+logged, like lists or objects, are converted to str when logged; numbers and
+strings are kept, so that the message itself is not formatted when logged.
+
+Worker processes forked with a running writer thread start their own thread
+and queue on their first record. Queued records are written at exit.
+
+Set environment variable LOG_SYNC=1 to write records in the logging thread.
+
+For help, see QueueHandler and QueueListener in:
+
+"logging.handlers - Logging handlers"
+Python v3.2 documentation.
+[http://docs.python.org/3.2/library/logging.handlers.html]
+
+SAMPLE USE:
+  install(Log, [logging.StreamHandler()])
+"""
+import os
+import atexit
+import logging
+import threading
+import multiprocessing.util
+try:
+  import Queue
+except ImportError:
+  import queue as Queue
+
+# Types of log arguments which cannot change after they are logged.
+try:
+  IMMUTABLE_TYPES = (str, unicode, int, long, float, bool, type(None))
+except NameError:
+  IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+def _freeze(arg):
+  """Return log argument `arg`, or its str if it may change."""
+  if isinstance(arg, IMMUTABLE_TYPES):
+    return arg
+  return str(arg)
+
+
+def _prepare(record):
+  """Return `record` safe to format later in another thread."""
+  if isinstance(record.args, dict):
+    # Arguments of "%(name)s" formats: format now.
+    record.msg = record.getMessage()
+    record.args = None
+  elif record.args:
+    record.args = tuple([_freeze(a) for a in record.args])
+  if record.exc_info:
+    # Traceback objects hold the frames of the logging thread.
+    record.exc_text = logging.Formatter().formatException(record.exc_info)
+    record.exc_info = None
+  return record
+
+
+class QueueHandler(logging.Handler):
+  """Handler which queues records for handlers in a writer thread.
+
+  Attributes:
+    handlers: [logging.Handler] of handlers run by the writer thread
+  """
+  def __init__(self, handlers):
+    logging.Handler.__init__(self)
+    self.handlers = handlers
+    self._pid = None
+    self._queue = None
+    self._thread = None
+    self._start_lock = threading.Lock()
+
+  def __repr__(self):
+    return "[QueueHandler %s (%d)]" % (self.handlers, id(self))
+
+  def _start(self):
+    """Start writer thread and queue of this process."""
+    with self._start_lock:
+      if self._pid == os.getpid():
+        return
+      # A queue and thread inherited from a parent process are unusable.
+      self._queue = Queue.Queue()
+      self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                      name="log writer")
+      self._thread.daemon = True
+      self._thread.start()
+      self._pid = os.getpid()
+      # Multiprocessing workers exit without atexit handlers, but with its
+      #   finalizers.
+      multiprocessing.util.Finalize(self, QueueHandler.flush_queue, args=(self,),
+                                    exitpriority=0)
+
+  def _run(self, queue):
+    while True:
+      record = queue.get()
+      if record is None:
+        queue.task_done()
+        return
+      try:
+        for handler in self.handlers:
+          if record.levelno >= handler.level:
+            handler.handle(record)
+      except Exception:
+        self.handleError(record)
+      queue.task_done()
+
+  def emit(self, record):
+    if self._pid != os.getpid():
+      self._start()
+    try:
+      self._queue.put(_prepare(record))
+    except Exception:
+      self.handleError(record)
+
+  def flush_queue(self):
+    """Wait until queued records of this process are written."""
+    if self._pid == os.getpid() and self._thread.is_alive():
+      self._queue.join()
+    for handler in self.handlers:
+      handler.flush()
+
+  def close(self):
+    """Write queued records, stop writer thread and close handlers."""
+    if self._pid == os.getpid() and self._thread.is_alive():
+      self._queue.put(None)
+      self._thread.join()
+    self._pid = None
+    for handler in self.handlers:
+      handler.close()
+    logging.Handler.close(self)
+
+
+def install(log, handlers):
+  """Add `handlers` to logger `log` behind a QueueHandler.
+
+  With LOG_SYNC set, add them directly.
+
+  Returns:
+    QueueHandler or None
+  """
+  if os.environ.get("LOG_SYNC", "").lower() not in ("", "0", "false", "f"):
+    for handler in handlers:
+      log.addHandler(handler)
+    return None
+  handler = QueueHandler(handlers)
+  log.addHandler(handler)
+  atexit.register(handler.flush_queue)
+  return handler
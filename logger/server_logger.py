@@ -10,9 +10,11 @@ Python v2.7.2 documentation: Python HOWTOs.
 import logging
 import os
 
+from . import queue_handler
+
 # Get log directory from environment variable.
 if 'LOGFILE' not in os.environ:
-  raise Exception, "Set os.environ variable 'LOGFILE' to full path to log file."
+  raise Exception("Set os.environ variable 'LOGFILE' to full path to log file.")
 else:
   log_file = os.environ['LOGFILE']
 
@@ -24,7 +26,8 @@ fh = logging.FileHandler(log_file)
 fh.setLevel(logging.DEBUG)
 f = logging.Formatter("%(levelname)s %(asctime)s %(module)s.%(funcName)s %(lineno)d %(message)s")
 fh.setFormatter(f)
-Log.addHandler(fh)
+# Write records in a thread, not in the threads which log them.
+queue_handler.install(Log, [fh])
 
 def console(s):
   pass
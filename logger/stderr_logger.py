@@ -12,6 +12,8 @@ Python v2.7.2 documentation: Python HOWTOs.
 import os
 import logging
 
+from . import queue_handler
+
 Log = logging.getLogger("stderr_logger")
 Log.setLevel(logging.DEBUG)
 
@@ -21,14 +23,15 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.INFO)
 f = logging.Formatter("%(levelname)s %(asctime)s %(module)s.%(funcName)s %(lineno)d %(message)s")
 ch.setFormatter(f)
-Log.addHandler(ch)
 
 # Create file handler which logs even debug messages.
 # Use "debug" for big file dumps
 home_dir = os.environ["HOME"]
 fh = logging.FileHandler("%s/%s" % (home_dir, '.python_logger.log'))
 fh.setLevel(logging.DEBUG)
-Log.addHandler(fh)
+
+# Write records in a thread, not in the threads which log them.
+queue_handler.install(Log, [ch, fh])
 
 import sys
 def console(s):
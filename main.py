@@ -1,5 +1,6 @@
 #!/usr/bin/python
 """Loose test scripts for GEO Fetch."""
+from __future__ import print_function
 from geo import *
 from filter import *
 import sys
@@ -8,40 +9,40 @@ import subprocess
 
 def print_test1(gse):
   g = GSE(gse)
-  print g
+  print(g)
   for name in dir(g):
     if name[0] == "_":
       continue
-    print name, ":", getattr(g, name)
-  print "========="
-  print
+    print(name, ":", getattr(g, name))
+  print("=========")
+  print()
   for substudy in g.substudies:
-    print "----------"
+    print("----------")
     for name in dir(substudy):
       if name[0] == "_":
         continue
-      print name, ":", getattr(substudy, name)
+      print(name, ":", getattr(substudy, name))
 
 
 def test2(gse):
   """Dump GSE data rows to STDOUT"""
   g = GSE(gse)
   h = g.substudies["GSE25935"]
-  print "getting rows for ^%s..." % h.id
+  print("getting rows for ^%s..." % h.id)
   i = 0
-  print h.platform.populated
-  print len(h.platform.id_desc)
+  print(h.platform.populated)
+  print(len(h.platform.id_desc))
   # this may not be working correctly
   for row in h.get_rows():
     if i > 40:
       break
-    print "\t".join(row)
+    print("\t".join(row))
     i += 1
   i = 0
   for k,v in h.platform.id_desc.items():
     if i > 10:
       break
-    print k, v
+    print(k, v)
     i += 1
 
 def test4(gse):
@@ -51,7 +52,7 @@ def test4(gse):
   for row in g.get_rows():
     if i > 40:
       break
-    print "\t".join(row)
+    print("\t".join(row))
     i += 1
     
 
@@ -65,15 +66,15 @@ def test3(gse):
   # THIS DOES NOT WORK
   g = GSE(gse)
   if g.type not in RECOGNIZED_STUDY_TYPES:
-    raise Exception, "Unrecognized type %s." % g.type
+    raise Exception("Unrecognized type %s." % g.type)
   filt = EQTLFilter(g)
   i = 0
   for line in filt.get_rows():
-    print line
+    print(line)
     i += 1
     if i > 5:
       break
-  print g.platform.row_desc["ILMN_1659893"]
+  print(g.platform.row_desc["ILMN_1659893"])
 
 
 
@@ -82,19 +83,19 @@ def test5(gse):
 
   How to customize Filters?
   """
-  print "TEST 5"
+  print("TEST 5")
   g = GSE(gse)
 
   if g.type not in RECOGNIZED_STUDY_TYPES:
-    raise Exception, "Unrecognized type %s." % g.type
+    raise Exception("Unrecognized type %s." % g.type)
   
   i = 0
   for row in g.get_rows():
-    print row
+    print(row)
     i += 1
     if i > 5:
       break
-  print "what's going on?"
+  print("what's going on?")
     
 
 def test_plot():
@@ -135,7 +136,7 @@ def fetch(gse="GSE25935"):
   for row in filt2.get_rows():
     # yield column headers?
     i += 1
-    print "\t".join(row)
+    print("\t".join(row))
     if i >= 10:
       break
   
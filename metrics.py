@@ -0,0 +1,239 @@
+#!/usr/bin/python
+"""Per-study timing and throughput metrics of the GSE pipeline.
+
+Pipeline stages like "gse.populate", "gpl.load" or "filter.pass1" add their
+wall clock seconds, CPU seconds, calls, rows and bytes to the current Metrics
+of the calling thread. script.main starts a Metrics per study and writes it
+as JSON next to the study's output file.
+
+The current Metrics belongs to the thread which started it. Threads which do
+a study's own work, like parallel row readers, bind() it; other threads, like
+prefetch downloads, record nothing into it.
+
+Stages nest: the time of "filter.pass1" includes the time of "gse.get_rows"
+which it reads from. CPU seconds are of the thread which runs the stage, if
+the platform measures thread CPU time ('cpu_scope' "thread"), else of the
+whole process ('cpu_scope' "process"). Memory is reported per study as the
+change of current RSS and of the process's peak RSS since start(); the
+process's lifetime peak RSS is reported separately as 'process_peak_rss_kb'.
+
+Without a current Metrics, stages record nothing.
+
+SAMPLE USE:
+  m = metrics.start("GSE2034")
+  with metrics.stage("gpl.load") as s:
+    s.rows = load()
+  for row in metrics.timed("gse.get_rows", rows):
+    pass
+  metrics.stop().write("GSE2034.metrics.json")
+"""
+import os
+import json
+import time
+import resource
+import threading
+
+# Counters of each stage, in the order of output.
+COUNTERS = ("calls", "wall", "cpu", "rows", "bytes_in", "bytes_out")
+# Process CPU seconds; time.clock() was removed in Python 3.8.
+cpu_time = getattr(time, "process_time", None) or time.clock
+
+
+def _rusage_thread_time():
+  """Return float of CPU seconds of the calling thread (Linux)."""
+  r = resource.getrusage(resource.RUSAGE_THREAD)
+  return r.ru_utime + r.ru_stime
+
+# CPU seconds of the calling thread where available, else of the process.
+if hasattr(time, "thread_time"):
+  thread_cpu_time, CPU_SCOPE = time.thread_time, "thread"
+elif hasattr(resource, "RUSAGE_THREAD"):
+  thread_cpu_time, CPU_SCOPE = _rusage_thread_time, "thread"
+else:
+  thread_cpu_time, CPU_SCOPE = cpu_time, "process"
+
+
+class Metrics(object):
+  """Thread safe sums of counters per pipeline stage.
+
+  Attributes:
+    name: str of name of measured job, like a study
+    stages: {str: {str: number}} of stage name to counter sums
+    order: [str] of stage names in order of first use
+  """
+  def __init__(self, name=None):
+    self.name = name
+    self.stages = {}
+    self.order = []
+    self.started = time.time()
+    self.rss_start_kb = rss_kb()
+    self.peak_start_kb = peak_rss_kb()
+    self._lock = threading.Lock()
+
+  def __repr__(self):
+    return "[Metrics %s: %d stages (%d)]" % (self.name, len(self.stages), id(self))
+
+  def add(self, name, **counts):
+    """Add `counts` like calls=1, wall=0.5, rows=10 to counters of stage `name`."""
+    with self._lock:
+      stage = self.stages.get(name)
+      if stage is None:
+        stage = self.stages[name] = dict.fromkeys(COUNTERS, 0)
+        self.order.append(name)
+      for key, value in counts.items():
+        stage[key] += value
+
+  def to_dict(self):
+    """Return JSON serializable dict of stages with rates and peak RSS."""
+    with self._lock:
+      stages = [(name, dict(self.stages[name])) for name in self.order]
+    for name, stage in stages:
+      stage['wall'] = round(stage['wall'], 4)
+      stage['cpu'] = round(stage['cpu'], 4)
+      if stage['wall'] > 0:
+        stage['rows_per_sec'] = round(stage['rows'] / stage['wall'], 1)
+        stage['mb_in_per_sec'] = round(stage['bytes_in'] / stage['wall'] / 2**20, 3)
+    rss, peak = rss_kb(), peak_rss_kb()
+    return {
+      'name': self.name,
+      'started': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+      'seconds': round(time.time() - self.started, 3),
+      'pid': os.getpid(),
+      'cpu_scope': CPU_SCOPE,
+      'rss_kb': rss,
+      'rss_delta_kb': None if rss is None else rss - self.rss_start_kb,
+      'peak_rss_delta_kb': peak - self.peak_start_kb,
+      'process_peak_rss_kb': peak,
+      'stages': dict(stages),
+      'order': [name for name, stage in stages],
+    }
+
+  def write(self, filepath):
+    """Write metrics as JSON to `filepath`."""
+    fp = open(filepath, "w")
+    json.dump(self.to_dict(), fp, indent=1, sort_keys=True)
+    fp.close()
+
+  def summary(self):
+    """Return [str] of one line per stage for logs."""
+    d = self.to_dict()
+    rss = d['rss_delta_kb'] is None and "?" or "%+d" % d['rss_delta_kb']
+    lines = ["Metrics of %s: %.1fs, RSS %s KB, peak RSS %+d KB (process peak %d KB), %s CPU." % \
+      (d['name'], d['seconds'], rss, d['peak_rss_delta_kb'],
+       d['process_peak_rss_kb'], d['cpu_scope'])]
+    for name in d['order']:
+      s = d['stages'][name]
+      lines.append("  %-18s %5d calls %9.3fs wall %9.3fs cpu %9d rows %12d bytes in" % \
+        (name, s['calls'], s['wall'], s['cpu'], s['rows'], s['bytes_in']))
+    return lines
+
+
+class Stage(object):
+  """Context of one call of a stage. Set its counters like `rows` inside."""
+  def __init__(self, metrics, name):
+    self.metrics = metrics
+    self.name = name
+    self.rows = 0
+    self.bytes_in = 0
+    self.bytes_out = 0
+
+  def __enter__(self):
+    self.t = time.time()
+    self.c = thread_cpu_time()
+    return self
+
+  def __exit__(self, *exc_info):
+    if self.metrics is not None:
+      self.metrics.add(self.name, calls=1, wall=time.time() - self.t,
+                       cpu=thread_cpu_time() - self.c, rows=self.rows,
+                       bytes_in=self.bytes_in, bytes_out=self.bytes_out)
+    return False
+
+
+# Current Metrics per thread, as attribute `metrics`.
+_local = threading.local()
+
+
+def peak_rss_kb():
+  """Return int of peak resident set size of this process in KB (Linux)."""
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def rss_kb():
+  """Return int of current resident set size of this process in KB, or None
+  if unknown (Linux only)."""
+  try:
+    fp = open("/proc/self/statm")
+  except EnvironmentError:
+    return None
+  try:
+    pages = int(fp.read().split()[1])
+  finally:
+    fp.close()
+  return pages * resource.getpagesize() // 1024
+
+
+def start(name=None):
+  """Start and return new current Metrics of the calling thread."""
+  m = Metrics(name)
+  bind(m)
+  return m
+
+
+def stop():
+  """Stop recording in the calling thread. Return its current Metrics or None."""
+  return bind(None)
+
+
+def bind(m):
+  """Make Metrics `m`, or None, current in the calling thread, as in a helper
+  thread of the job of `m`. Return the previous current Metrics or None."""
+  previous = current()
+  _local.metrics = m
+  return previous
+
+
+def current():
+  """Return current Metrics of the calling thread or None."""
+  return getattr(_local, "metrics", None)
+
+
+def add(name, **counts):
+  """Add `counts` to stage `name` of the current Metrics, if any."""
+  m = current()
+  if m is not None:
+    m.add(name, **counts)
+
+
+def stage(name):
+  """Return context manager which times a call of stage `name`."""
+  return Stage(current(), name)
+
+
+def timed(name, rows):
+  """Yield from iterator `rows`, timing only its own work as stage `name`.
+
+  Time spent by the consumer between rows is not counted.
+  """
+  m = current()
+  if m is None:
+    for row in rows:
+      yield row
+    return
+  rows = iter(rows)
+  wall = cpu = 0
+  n = 0
+  try:
+    while True:
+      t, c = time.time(), thread_cpu_time()
+      try:
+        row = next(rows)
+      finally:
+        wall += time.time() - t
+        cpu += thread_cpu_time() - c
+      n += 1
+      yield row
+  except StopIteration:
+    pass
+  finally:
+    m.add(name, calls=1, wall=wall, cpu=cpu, rows=n)
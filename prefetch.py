@@ -0,0 +1,221 @@
+#!/usr/bin/python
+"""Concurrently download GEO files of a study into the download cache.
+
+Building a GSE super study fetches each substudy brief, its GPL brief and its
+series matrix FTP listing one after another. Prefetcher downloads all of them
+at once in a pool of threads, in waves that follow the study's structure:
+
+  1. GSE brief of the study
+  2. GSE briefs of all substudies
+  3. GPL briefs of all platforms and FTP listings of all studies
+  4. (optional) series matrix files and GPL data tables
+
+Downloads fill the CachedDownload cache, so that GSE objects then build from
+the cache without network round trips. Files already in the cache are skipped.
+
+SAMPLE USE:
+  from prefetch import Prefetcher
+  Prefetcher(max_workers=8).prefetch("GSE15745")
+  g = GSE("GSE15745")
+"""
+import threading
+from multiprocessing.pool import ThreadPool
+
+from download import Download, as_text
+from geo import GSE, GPL, FTPFile
+from logger import Log
+
+
+class Prefetcher(object):
+  """Thread pool which downloads GEO study files into the download cache.
+
+  Attributes:
+    max_workers: int of maximum number of concurrent downloads
+    data: bool if to also download series matrix files and GPL data tables
+    fetched: set of str of urls fetched or found in cache
+    failed: {str: str} of url => error message of failed downloads
+  """
+  def __init__(self, max_workers=8, data=False):
+    """Initialize.
+
+    Args:
+      max_workers: int of maximum number of concurrent downloads
+      data: bool if to also download series matrix files and GPL data tables
+    """
+    assert max_workers >= 1
+    self.max_workers = max_workers
+    self.data = data
+    self.fetched = set()
+    self.failed = {}
+    self._lock = threading.Lock()
+
+  def __repr__(self):
+    return "[Prefetcher: %d workers, %d fetched, %d failed (%d)]" % \
+      (self.max_workers, len(self.fetched), len(self.failed), id(self))
+
+  def prefetch(self, gse_id):
+    """Download all files needed to populate GSE `gse_id` and its substudies.
+
+    Download errors are logged and recorded in self.failed; the GSE object
+    later fetches any missing file itself.
+
+    Args:
+      gse_id: str of GSE study ID
+    Returns:
+      set of str of GPL IDs of all platforms of the studies
+    """
+    return self.prefetch_studies([gse_id])
+
+  def prefetch_studies(self, gse_ids):
+    """Download files of several GSE studies at once, as by prefetch().
+
+    Args:
+      gse_ids: [str] of GSE study IDs
+    Returns:
+      set of str of GPL IDs of all platforms of the studies
+    """
+    gse_ids = list(gse_ids)
+    Log.info("Prefetching %d studies with %d workers." % \
+      (len(gse_ids), self.max_workers))
+    pool = ThreadPool(self.max_workers)
+    try:
+      # 1. Briefs of the studies
+      # ==========
+      briefs = pool.map(self._fetch_brief, gse_ids)
+
+      # 2. Briefs of substudies
+      # ==========
+      sub_ids = set()
+      for sub_gse_ids, gpl_ids in briefs:
+        sub_ids.update(sub_gse_ids)
+      sub_ids.difference_update(gse_ids)
+      briefs.extend(pool.map(self._fetch_brief, sorted(sub_ids)))
+
+      # 3. GPL briefs and FTP listings of all studies
+      # ==========
+      gpl_ids = set()
+      for sub_gse_ids, study_gpl_ids in briefs:
+        gpl_ids.update(study_gpl_ids)
+      gpl_urls = [GPL.PTN_GPL_QUICK % {'id': x} for x in sorted(gpl_ids)]
+      dir_urls = [GSE.PTN_GSE_SERIES_DIR % {'id': x}
+                  for x in gse_ids + sorted(sub_ids)]
+      pool.map(self._fetch, gpl_urls)
+      listings = pool.map(self._fetch_listing, dir_urls)
+
+      # 4. Series matrix files and GPL data tables
+      # ==========
+      if self.data:
+        urls = [GPL.PTN_GPL % {'id': x} for x in sorted(gpl_ids)]
+        pool.map(self._fetch, urls)
+        pool.map(self._fetch_ftp_file,
+                 [f for ftp_files in listings for f in ftp_files])
+    finally:
+      pool.close()
+      pool.join()
+    Log.info("Prefetched %d studies: %s" % (len(gse_ids), self))
+    return gpl_ids
+
+  def fetch(self, urls):
+    """Download each of `urls` into cache unless already cached or fetched.
+
+    Args:
+      urls: [str] of urls
+    """
+    pool = ThreadPool(self.max_workers)
+    try:
+      pool.map(self._fetch, list(urls))
+    finally:
+      pool.close()
+      pool.join()
+
+  def _claim(self, url):
+    """Return True if `url` has not yet been claimed for download by a thread."""
+    with self._lock:
+      if url in self.fetched:
+        return False
+      self.fetched.add(url)
+      return True
+
+  def _fail(self, url, e):
+    with self._lock:
+      self.failed[url] = str(e)
+    Log.warning("Prefetch of %s failed: %s" % (url, e))
+
+  def _open(self, url, **kwds):
+    """Return open str line file pointer of url, or None if not readable."""
+    try:
+      return as_text(Download(url, **kwds).read())
+    except Exception as e:
+      self._fail(url, e)
+      return None
+
+  def _fetch(self, url, **kwds):
+    """Download `url` into cache unless it is already cached.
+
+    Args:
+      url: str of url
+      **kwds: keyword arguments of Download
+    """
+    if not self._claim(url):
+      return
+    handle = Download(url, **kwds)
+    if getattr(handle, "is_cached", None) and handle.is_cached():
+      return
+    try:
+      fp = handle.read()
+      # Read to EOF, which finalizes the cache file.
+      for lines in fp.iter_blocks():
+        pass
+      if not fp.closed:
+        fp.close()
+    except Exception as e:
+      self._fail(url, e)
+
+  def _fetch_ftp_file(self, ftp_file):
+    """Download series matrix FTPFile into cache as GSE would open it."""
+    self._fetch(ftp_file.url, expected_size=ftp_file.size,
+                expected_mtime=ftp_file.mtime)
+
+  def _read_lines(self, url, **kwds):
+    """Return [str] of all lines at `url` via the cache, or [] on failure."""
+    with self._lock:
+      self.fetched.add(url)
+    fp = self._open(url, **kwds)
+    if fp is None:
+      return []
+    try:
+      lines = list(fp)
+    except Exception as e:
+      self._fail(url, e)
+      lines = []
+    if not fp.closed:
+      fp.close()
+    return lines
+
+  def _fetch_brief(self, gse_id):
+    """Fetch GSE brief. Return ([str] substudy GSE IDs, [str] GPL IDs)."""
+    sub_gse_ids, gpl_ids = [], []
+    for line in self._read_lines(GSE.PTN_GSE_BRIEF % {'id': gse_id}):
+      m = GSE.RX_HEADER.match(line.strip())
+      if not m:
+        continue
+      key, value = m.group(1).strip(), m.group(2).strip()
+      if key == "relation":
+        m = GSE.RX_SUBSTUDY.match(value)
+        if m:
+          sub_gse_ids.append(m.group(1))
+      elif key == "platform_id":
+        gpl_ids.append(value)
+    return sub_gse_ids, gpl_ids
+
+  def _fetch_listing(self, dir_url):
+    """Fetch FTP listing of series matrix files. Return [FTPFile]."""
+    ftp_files = []
+    for line in self._read_lines(dir_url, max_age=GSE.LISTING_TTL):
+      if not line.strip():
+        continue
+      try:
+        ftp_files.append(FTPFile(dir_url, line.strip()))
+      except (IndexError, ValueError) as e:
+        self._fail(dir_url, "Cannot parse FTP line '%s': %s" % (line.strip(), e))
+    return ftp_files
@@ -10,6 +10,7 @@ $ python script.py GSE15745 2> api_log.txt
 
 $ python script.py GSE25935 percentile=1 merge_cols=0
 """
+from __future__ import print_function
 USE_MSG = """USE: python script.py GSE_ID [options]
 
 OPTIONS:
@@ -17,6 +18,11 @@ OPTIONS:
   out_dir=str: path to output directory where to save downloaded file
   merge_cols: bool (0 or 1) if to merge same-source columns [default=True]
   percentile: floot 0 < x <= 1 of percentile by std to keep [default=.75]
+  engine: str of EQTLFilter row engine, "python" or "numpy" [default=python]
+  spill: bool (0 or 1) if to spill rows to TMP_DIR rather than re-read them [default=True]
+  read_threads: int of threads to decompress block-compressed cache files ahead [default=1]
+  prefetch: int of concurrent downloads to prefetch study files, 0 to disable [default=0]
+  metrics: bool (0 or 1) if to write stage timings to GSE_ID.metrics.json and the log [default=False]
 """
 
 import sys
@@ -30,21 +36,24 @@ import time
 #   use default values: the local, current directory environment.
 if ("ENV" not in os.environ) and ("CACHE_DIR" not in os.environ) and \
   ("TMP_DIR" not in os.environ):
-  print "Warning: geo_api environment is not configured. Using local directory..."
+  print("Warning: geo_api environment is not configured. Using local directory...")
   os.environ["ENV"] = "LOCAL"
   os.environ["CACHE_DIR"] = ""
   os.environ["TMP_DIR"] = ""
 
 from __init__ import *
+from prefetch import Prefetcher
+import metrics as stage_metrics
 
 
 def report(msg, fp):
   """Both write a message to a log file and to the console."""
   fp.write(msg + "\n")
-  print msg
+  print(msg)
 
 
-def main(gse_id, gpl_id=None, out_dir="", merge_cols=False, percentile=.75):
+def main(gse_id, gpl_id=None, out_dir="", merge_cols=False, percentile=.75,
+         engine="python", spill=True, prefetch=0, metrics=False, read_threads=1):
   """Main script routine.
 
   Args:
@@ -53,12 +62,23 @@ def main(gse_id, gpl_id=None, out_dir="", merge_cols=False, percentile=.75):
     out_dir: str of path where to save downloads
     merge_cols: bool if to merge columns from same patient
     percentile: float of top percentile to keep by standard deviation
+    engine: str of EQTLFilter row engine in filter.ENGINES
+    spill: bool if to spill filtered rows to a temporary file
+    prefetch: int of concurrent downloads to prefetch study files or 0
+    metrics: bool if to write stage timings, rows and bytes of the study
+    read_threads: int of threads to decompress block-compressed cache files
   """
   if type(percentile) == str:
     percentile = float(percentile)
   assert percentile > 0 and percentile <= 1
   if type(merge_cols) == str:
     merge_cols = not merge_cols.lower() in ('0', 0, False, "", 'false','f', None)
+  if type(spill) == str:
+    spill = not spill.lower() in ('0', 0, False, "", 'false','f', None)
+  if type(metrics) == str:
+    metrics = not metrics.lower() in ('0', 0, False, "", 'false','f', None)
+  prefetch = int(prefetch)
+  read_threads = int(read_threads)
 
   # Verify that out_dir exists, and if not, create it.
   if out_dir != "" and not (os.path.exists(out_dir) and os.path.isdir(out_dir)):
@@ -74,25 +94,73 @@ def main(gse_id, gpl_id=None, out_dir="", merge_cols=False, percentile=.75):
   report("".join(msg), fp_log)
   report("Using EQTLFilter only, default parameters", fp_log)
 
-  # Create GSE object.
-  g = GSE(gse_id, platform_id=gpl_id)
+  if metrics:
+    stage_metrics.start(gse_id)
+  try:
+    # Download study briefs and listings concurrently into cache.
+    if prefetch > 0:
+      with stage_metrics.stage("prefetch"):
+        Prefetcher(max_workers=prefetch).prefetch(gse_id)
+
+    # Create GSE object.
+    g = GSE(gse_id, platform_id=gpl_id)
+    write_gse(g, fp_log, out_dir, merge_cols=merge_cols, percentile=percentile,
+              engine=engine, spill=spill, read_threads=read_threads)
+  finally:
+    m = stage_metrics.stop()
+  if m is not None:
+    m.write(os.path.join(out_dir, "%s.metrics.json" % gse_id))
+    for line in m.summary():
+      report(line, fp_log)
+
+
+def write_gse(g, fp_log, out_dir="", merge_cols=True, percentile=.75,
+              engine="python", spill=True, read_threads=1):
+  """Write filtered matrices of a study, or of each eQTL substudy if super.
 
+  Args:
+    g: geo.GSE study instance
+    fp_log: [*str] open writable file pointer for logging
+    out_dir: str of output directory
+    merge_cols: bool if to merge columns if possible
+    percentile: float 0<x<=1 of top percentile to keep by std
+    engine: str of EQTLFilter row engine in filter.ENGINES
+    spill: bool if to spill filtered rows to a temporary file
+    read_threads: int of threads to decompress block-compressed cache files
+  Returns:
+    [(geo.GSE, int)] of written study and its number of data rows
+  """
   # If g is a super study, fetch all sub studies
   if g.type == "SUPER":
     report("%s is a super study with %d children." % (g, len(g.substudies)), fp_log)
+    studies = []
     for gsub in g.substudies.values():
       # Skip substudies that are not eQTL
       if gsub.type != "eQTL":
         report("%s is type %s. Skipping..." % (gsub, gsub.type), fp_log)
         continue
-      write_study(gsub, fp_log, out_dir, merge_cols=merge_cols, percentile=percentile)
+      studies.append(gsub)
   # Otherwise, simply fetch G itself.
   else:
     report("%s is a child study. Fetching it directly..." % (g), fp_log)
-    write_study(g, fp_log, out_dir, merge_cols=merge_cols, percentile=percentile)
+    studies = [g]
+
+  written = []
+  for gse in studies:
+    n_rows = write_study(gse, fp_log, out_dir, merge_cols=merge_cols,
+                         percentile=percentile, engine=engine, spill=spill,
+                         read_threads=read_threads)
+    written.append((gse, n_rows))
+  return written
+
+
+def study_filename(gse):
+  """Return str of output file name of a filtered non-super study."""
+  return "%s.%s.%s.tab" % (gse.id, gse.platform.id, gse.type)
 
 
-def write_study(gse, fp_log, out_dir="", merge_cols=True, percentile=.75):
+def write_study(gse, fp_log, out_dir="", merge_cols=True, percentile=.75,
+                engine="python", spill=True, read_threads=1):
   """Write a filtered GSE matrix to a new file.
 
   Args:
@@ -101,14 +169,20 @@ def write_study(gse, fp_log, out_dir="", merge_cols=True, percentile=.75):
     out_dir: str of output directory
     merge_cols: bool if to merge columns if possible
     percentile: float 0<x<=1 of top percentile to keep by std
+    engine: str of EQTLFilter row engine in filter.ENGINES
+    spill: bool if to spill filtered rows to a temporary file
+    read_threads: int of threads to decompress block-compressed cache files
+  Returns:
+    int of number of data rows written, excluding the header row
   """
-  filename = "%s.%s.%s.tab" % (gse.id, gse.platform.id, gse.type)
+  filename = study_filename(gse)
   fp = open(os.path.join(out_dir, filename), "w")
   report("Writing %s to file %s with default EQTLFilter..." % (gse, filename), fp_log)
   
-  filt2 = EQTLFilter(gse, merge_cols=merge_cols, percentile=percentile)
+  filt2 = EQTLFilter(gse, merge_cols=merge_cols, percentile=percentile,
+                     engine=engine, spill=spill, read_threads=read_threads)
   n_lines = 0
-  for row in filt2.get_rows():
+  for row in stage_metrics.timed("filter.get_rows", filt2.get_rows()):
     n_lines += 1
     # DO NOT Skip headers.
     # If this is the first line, print a "#" to indicate that this is a header line
@@ -124,19 +198,20 @@ def write_study(gse, fp_log, out_dir="", merge_cols=True, percentile=.75):
         row[i] = ""
     fp.write("\t".join(row) + "\n")
   fp.close()
+  return max(n_lines - 1, 0)
     
     
 if __name__ == "__main__":
 
   if len(sys.argv) == 1 or sys.argv[1].lower().strip('-') in ("h", 'help'):
-    print USE_MSG
+    print(USE_MSG)
     sys.exit(1)
     
   try:
     gse_id = sys.argv[1]
     options = dict(map(lambda s: s.split('='), sys.argv[2:]))
   except:
-    print USE_MSG
+    print(USE_MSG)
     raise
 
     
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+"""Fixed-width binary spill files of filtered rows of floats.
+
+A spill holds one block of float64 values per row, in machine byte order, and
+a row index of (row id, gene symbol) pairs in a sidecar ".idx" text file. Every
+row has the same width, so row i starts at byte i * n_cols * 8 and a memory map
+of the spill can be read at any selected row without parsing the rows before it.
+
+Missing values (None) are stored as a NaN with a reserved payload so that
+literal "nan" values survive a round trip as floats.
+"""
+import os
+import array
+import mmap
+import struct
+
+# NumPy is optional. If installed, whole blocks of rows are written at once.
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# Quiet NaN with payload 1954 (as R's NA_real_) marks a missing value.
+MISSING = struct.unpack("<d", struct.pack("<Q", 0x7FF80000000007A2))[0]
+MISSING_STR = struct.pack("d", MISSING)
+# Width in bytes of one value.
+ITEM_SIZE = array.array('d').itemsize
+# Python 2 arrays name tobytes() and frombytes() tostring() and fromstring().
+_array_tobytes = getattr(array.array, "tobytes", None) or array.array.tostring
+_array_frombytes = getattr(array.array, "frombytes", None) or array.array.fromstring
+
+
+def is_missing(x):
+  """Return True if float `x` is the MISSING value rather than any other NaN."""
+  return x != x and struct.pack("d", x) == MISSING_STR
+
+
+def remove(filepath):
+  """Delete spill data file `filepath` and its row index, if they exist."""
+  for path in (filepath, filepath + ".idx"):
+    if os.path.exists(path):
+      os.remove(path)
+
+
+class SpillWriter(object):
+  """Append rows of floats to a new spill file.
+
+  Attributes:
+    filepath: str of path to spill data file; the row index is filepath + ".idx"
+    n_cols: int of number of floats per row
+    n_rows: int of number of rows written
+  """
+  def __init__(self, filepath, n_cols):
+    """Open spill files for writing.
+
+    Args:
+      filepath: str of path to new spill data file
+      n_cols: int of number of floats per row
+    """
+    self.filepath = filepath
+    self.n_cols = n_cols
+    self.n_rows = 0
+    self.fp = open(filepath, "wb")
+    self.fp_idx = open(filepath + ".idx", "w")
+
+  def __repr__(self):
+    return "[SpillWriter %s: %d rows of %d cols (%d)]" % \
+      (self.filepath, self.n_rows, self.n_cols, id(self))
+
+  def write(self, row_id, gene_sym, values):
+    """Append one row.
+
+    Args:
+      row_id: str of row ID
+      gene_sym: str of row gene symbol
+      values: [float or None] of `n_cols` values; None is stored as MISSING
+    """
+    if len(values) != self.n_cols:
+      raise ValueError("Row %s has %d values, expected %d for %s." %
+        (row_id, len(values), self.n_cols, self))
+    a = array.array('d', [MISSING if x is None else x for x in values])
+    self.fp.write(_array_tobytes(a))
+    self.fp_idx.write("%s\t%s\n" % (row_id, gene_sym))
+    self.n_rows += 1
+
+  def write_block(self, row_ids, gene_syms, values):
+    """Append a block of rows from a NumPy matrix.
+
+    Args:
+      row_ids: [str] of row IDs
+      gene_syms: [str] of gene symbols aligned to `row_ids`
+      values: np.array float64 of shape (len(row_ids), n_cols); missing values
+        should already be set to MISSING
+    """
+    if values.shape != (len(row_ids), self.n_cols):
+      raise ValueError("Block of shape %s, expected (%d, %d) for %s." %
+        (values.shape, len(row_ids), self.n_cols, self))
+    self.fp.write(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    self.fp_idx.write("".join(["%s\t%s\n" % x for x in zip(row_ids, gene_syms)]))
+    self.n_rows += len(row_ids)
+
+  def close(self):
+    self.fp.close()
+    self.fp_idx.close()
+
+
+class SpillReader(object):
+  """Random access reader of a memory mapped spill file.
+
+  Attributes:
+    filepath: str of path to spill data file
+    n_cols: int of number of floats per row
+    row_ids: [str] of row IDs in spill order
+    gene_syms: [str] of gene symbols in spill order
+  """
+  def __init__(self, filepath, n_cols):
+    """Open and memory map spill files for reading.
+
+    Args:
+      filepath: str of path to spill data file written by SpillWriter
+      n_cols: int of number of floats per row
+    """
+    self.filepath = filepath
+    self.n_cols = n_cols
+    self.row_ids = []
+    self.gene_syms = []
+    fp_idx = open(filepath + ".idx", "r")
+    for line in fp_idx:
+      row_id, gene_sym = line.rstrip("\n").split("\t")
+      self.row_ids.append(row_id)
+      self.gene_syms.append(gene_sym)
+    fp_idx.close()
+
+    self.row_size = n_cols * ITEM_SIZE
+    self.fp = open(filepath, "rb")
+    self.fp.seek(0, 2)
+    size = self.fp.tell()
+    if size != len(self.row_ids) * self.row_size:
+      self.fp.close()
+      raise ValueError("%s has %d bytes, expected %d rows of %d bytes." %
+        (filepath, size, len(self.row_ids), self.row_size))
+    # Zero length files cannot be memory mapped.
+    if size > 0:
+      self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      self.mm = None
+
+  def __repr__(self):
+    return "[SpillReader %s: %d rows of %d cols (%d)]" % \
+      (self.filepath, len(self.row_ids), self.n_cols, id(self))
+
+  def __len__(self):
+    return len(self.row_ids)
+
+  def read(self, i):
+    """Return values of row at position `i` with MISSING values as None.
+
+    Args:
+      i: int of row position in spill order
+    Returns:
+      [float or None] of `n_cols` values
+    """
+    offset = i * self.row_size
+    a = array.array('d')
+    _array_frombytes(a, self.mm[offset:offset + self.row_size])
+    return [None if x != x and is_missing(x) else x for x in a.tolist()]
+
+  def close(self):
+    if self.mm is not None:
+      self.mm.close()
+      self.mm = None
+    self.fp.close()
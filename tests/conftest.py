@@ -0,0 +1,113 @@
+"""Shared pytest fixtures. Modules of the package are imported top level."""
+import os
+import sys
+import io
+import gzip
+import shutil
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Write log records in the logging thread: pytest closes captured streams
+#   before a log writer thread would flush them at exit.
+os.environ.setdefault("LOG_SYNC", "1")
+
+import download
+from download import cached_download
+from download.cached_download import CachedDownload
+from download.fixture_download import FixtureDownload
+from headercache import HeaderCache
+from geo import GSE, GPL
+import fixtures
+
+
+@pytest.fixture
+def tmp_dir(tmp_path, monkeypatch):
+  """Return str of an empty TMP_DIR."""
+  path = tmp_path / "tmp"
+  path.mkdir()
+  monkeypatch.setenv("TMP_DIR", str(path))
+  return str(path)
+
+
+@pytest.fixture(scope="session")
+def fixture_dir(tmp_path_factory):
+  """Return str of a fixture directory of a small synthetic study."""
+  path = str(tmp_path_factory.mktemp("fixtures"))
+  fixtures.write_study(path, probes=300, samples=8, replicates=2, files=2)
+  return path
+
+
+@pytest.fixture(scope="session")
+def plain_fixture_dir(fixture_dir, tmp_path_factory):
+  """Return str of a fixture directory of the study with uncompressed, and so
+  seekable, series matrix files."""
+  path = str(tmp_path_factory.mktemp("plain_fixtures"))
+  for name in os.listdir(fixture_dir):
+    src = os.path.join(fixture_dir, name)
+    if not os.path.isdir(src):
+      shutil.copy(src, path)
+      continue
+    os.mkdir(os.path.join(path, name))
+    for filename in os.listdir(src):
+      fp = gzip.open(os.path.join(src, filename), "rb")
+      with open(os.path.join(path, name, filename[:-len(".gz")]), "wb") as fp_out:
+        shutil.copyfileobj(fp, fp_out)
+      fp.close()
+  return path
+
+
+@pytest.fixture
+def open_gse(monkeypatch):
+  """Return function(fixture_dir, backend=FixtureDownload) of a populated GSE
+  of the synthetic study in `fixture_dir`, served offline by `backend`."""
+  def open_gse(fixture_dir, backend=FixtureDownload):
+    monkeypatch.setattr(download, "_backend", backend)
+    monkeypatch.setattr(FixtureDownload, "FIXTURE_DIR", fixture_dir)
+    monkeypatch.setattr(GSE, "HEADER_CACHE", HeaderCache(cache_dir=False))
+    monkeypatch.setattr(GSE, "FTP_LISTINGS", {})
+    monkeypatch.setattr(GPL, "CACHE", None)
+    return GSE("GSE90001",
+               custom_parameters={'rx_gsm_subject_str': fixtures.RX_SUBJECT_STR})
+  return open_gse
+
+
+@pytest.fixture
+def gse(fixture_dir, open_gse):
+  """Return populated GSE of the synthetic study with gzip series matrices."""
+  return open_gse(fixture_dir)
+
+
+class FixtureResponse(io.BytesIO):
+  """Network response stand-in of a fixture file from byte `offset`."""
+  def __init__(self, url, offset=0):
+    fp = FixtureDownload(url).read()
+    data = fp.read()
+    fp.close()
+    io.BytesIO.__init__(self, data[offset:])
+    self.url = url
+    self.total_size = len(data)
+
+  def info(self):
+    return {}
+
+  def geturl(self):
+    return self.url
+
+
+@pytest.fixture
+def open_cached_gse(open_gse, tmp_path, monkeypatch):
+  """Return function(fixture_dir) of a populated GSE of the synthetic study in
+  `fixture_dir`, downloaded through the CachedDownload cache, which is
+  returned as attribute `cache_dir` of the function."""
+  cache_dir = tmp_path / "cache"
+  cache_dir.mkdir()
+  def open_cached_gse(fixture_dir):
+    monkeypatch.setattr(cached_download, "CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(CachedDownload, "_fetch_ftp",
+                        lambda self, offset=0: FixtureResponse(self.url, offset))
+    monkeypatch.setattr(CachedDownload, "_fetch_http",
+                        lambda self, data=None, headers=None: FixtureResponse(self.url))
+    return open_gse(fixture_dir, CachedDownload)
+  open_cached_gse.cache_dir = str(cache_dir)
+  return open_cached_gse
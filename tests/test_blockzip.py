@@ -0,0 +1,107 @@
+import gzip
+import os
+
+import pytest
+
+from download import blockzip
+from download import cached_download
+
+
+def write_lines(filepath, n, block_size=1000):
+  """Write `n` numbered lines as a block file. Return bytes written."""
+  data = b"".join([b"line %06d\t%s\n" % (i, b"x" * (i % 37)) for i in range(n)])
+  fp = blockzip.BlockWriter(filepath, block_size=block_size)
+  # Writes of odd sizes cross block boundaries.
+  for i in range(0, len(data), 777):
+    fp.write(data[i:i+777])
+  fp.close()
+  return data
+
+
+def test_index_and_gzip_compatible(tmp_path):
+  filepath = str(tmp_path / "data.gz")
+  data = write_lines(filepath, 2000)
+  index = blockzip.read_index(filepath)
+  assert index['size'] == len(data)
+  assert index['data'] == list(range(0, len(data), 1000))
+  assert len(index['file']) == len(index['data'])
+  # A block file is a plain gzip file of independent members.
+  with gzip.open(filepath, "rb") as fp:
+    assert fp.read() == data
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_seek_and_read_anywhere(tmp_path, threads):
+  filepath = str(tmp_path / "data.gz")
+  data = write_lines(filepath, 2000)
+  fp = blockzip.open(filepath, threads=threads)
+  # Forward and backward, at block starts, inside and at the end of blocks.
+  for offset in (0, 999, 1000, 1001, 54321, 123, len(data) - 1, 5000, 5100):
+    fp.seek(offset)
+    assert fp.read(50) == data[offset:offset+50]
+  fp.seek(len(data) + 10)
+  assert fp.read(10) == b""
+  fp.seek(54321)
+  line_end = data.index(b"\n", 54321) + 1
+  assert fp.readline() == data[54321:line_end]
+  assert fp.readline() == data[line_end:data.index(b"\n", line_end) + 1]
+  fp.close()
+  fp = blockzip.open(filepath, offset=4321, threads=threads)
+  assert fp.read() == data[4321:]
+  fp.close()
+
+
+def test_seek_in_current_block_does_not_decompress(tmp_path, monkeypatch):
+  filepath = str(tmp_path / "data.gz")
+  data = write_lines(filepath, 500)
+  fp = blockzip.open(filepath)
+  fp.seek(2100)
+  fp.readline()
+  calls = []
+  decompress = blockzip._decompress
+  monkeypatch.setattr(blockzip, "_decompress",
+                      lambda b: calls.append(1) or decompress(b))
+  fp.seek(2050)
+  assert fp.read(20) == data[2050:2070]
+  fp.seek(2500)
+  assert fp.read(20) == data[2500:2520]
+  assert calls == []
+  fp.seek(3000)
+  assert fp.read(20) == data[3000:3020]
+  assert calls == [1]
+  fp.close()
+
+
+def test_append_shifts_index(tmp_path):
+  a, b = str(tmp_path / "a.gz"), str(tmp_path / "b.gz")
+  data = write_lines(a, 300) + write_lines(b, 200, block_size=700)
+  blockzip.append(a, b)
+  fp = blockzip.open(a)
+  assert fp.read() == data
+  fp.seek(len(data) - 100)
+  assert fp.read() == data[-100:]
+  fp.close()
+
+
+def test_file_without_index_reads_from_start(tmp_path):
+  filepath = str(tmp_path / "data.gz")
+  data = write_lines(filepath, 300)
+  os.remove(filepath + blockzip.INDEX_SUFFIX)
+  assert blockzip.read_index(filepath) is None
+  fp = blockzip.open(filepath, offset=1234)
+  assert not hasattr(fp, "seek")
+  assert fp.read() == data[1234:]
+  fp.close()
+
+
+def test_cached_download_reads_block_cache_in_threads(tmp_path, monkeypatch):
+  monkeypatch.setattr(cached_download, "CACHE_DIR", str(tmp_path))
+  url = "ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SeriesMatrix/GSE1/GSE1_series_matrix.txt"
+  filepath = str(tmp_path / cached_download.get_cache_name(url))
+  data = write_lines(filepath, 1000)
+  cached_download.write_json(filepath + cached_download.META_SUFFIX,
+    {'url': url, 'bytes': len(data), 'encoding': cached_download.ENC_BLOCK})
+  fp = cached_download.CachedDownload(url, read_threads=2).read()
+  assert isinstance(fp, blockzip.BlockStream) and fp.threads == 2
+  assert fp.read() == data
+  fp.close()
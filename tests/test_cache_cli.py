@@ -0,0 +1,37 @@
+import os
+import time
+
+import cache
+
+
+def make_entry(cache_dir, name, size, age):
+  filepath = os.path.join(cache_dir, name)
+  with open(filepath, "wb") as fp:
+    fp.write(b"x" * size)
+  t = time.time() - age
+  os.utime(filepath, (t, t))
+
+
+def test_inspect_and_prune(tmp_path, monkeypatch, capsys):
+  cache_dir = str(tmp_path)
+  make_entry(cache_dir, "a.cache", 3000, 3600)
+  make_entry(cache_dir, "a.cache.meta", 100, 3600)
+  make_entry(cache_dir, "b.cache", 1000, 7200)
+  make_entry(cache_dir, "acc_GPL1_.cache", 5000, 9000)
+  monkeypatch.delenv("CACHE_MAX_BYTES", raising=False)
+
+  cache.main("inspect", cache_dir=cache_dir)
+  out = capsys.readouterr().out
+  assert "Total: 8.9K in 3 entries" in out
+  assert "Pinned: 4.9K in 1 entries" in out
+  assert out.index("acc_GPL1_.cache") < out.index("a.cache") < out.index("b.cache")
+
+  cache.main("prune", cache_dir=cache_dir, max_bytes="8500", dry_run="1")
+  assert "would delete" in capsys.readouterr().out
+  assert os.path.exists(os.path.join(cache_dir, "b.cache"))
+  cache.main("prune", cache_dir=cache_dir, max_bytes="8500")
+  out = capsys.readouterr().out
+  # Least recently used first; the pinned GPL entry is kept.
+  assert "deleted" in out and "b.cache" in out
+  names = [x for x in os.listdir(cache_dir) if not x.startswith(".")]
+  assert sorted(names) == ["a.cache", "a.cache.meta", "acc_GPL1_.cache"]
@@ -0,0 +1,112 @@
+import os
+import time
+
+import pytest
+
+from download import cachemanager
+from download.cachemanager import CacheManager
+from download.entrylock import EntryLock
+
+HOUR = 3600
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+  return str(tmp_path)
+
+
+def make_files(cache_dir, names, size, age):
+  for name in names:
+    filepath = os.path.join(cache_dir, name)
+    with open(filepath, "wb") as fp:
+      fp.write(b"x" * size)
+    t = time.time() - age
+    os.utime(filepath, (t, t))
+
+
+def entry_names(cache_dir):
+  return sorted(set([cachemanager.get_entry_key(x) for x in os.listdir(cache_dir)])
+                - set([None]))
+
+
+def test_entries_group_files(cache_dir):
+  make_files(cache_dir, ["a.cache", "a.cache.meta", "a.cache.idx"], 100, HOUR)
+  make_files(cache_dir, ["b.cache.tmp", "b.cache.tmp.resume",
+                         "b.cache.tmp.seg"], 100, HOUR)
+  make_files(cache_dir, ["acc_GPL1_.cache", "GPL1.gpl", "GPL1.gpl.idx"], 100, HOUR)
+  entries = dict([(e.key, e) for e in CacheManager(cache_dir).scan()])
+  assert sorted(entries) == ["GPL1.gpl", "a.cache", "acc_GPL1_.cache", "b.cache.tmp"]
+  assert entries["a.cache"].size == 300 and not entries["a.cache"].pinned
+  assert entries["b.cache.tmp"].partial
+  assert entries["b.cache.tmp"].get_cache_name() == "b.cache"
+  assert entries["GPL1.gpl"].pinned and entries["acc_GPL1_.cache"].pinned
+
+
+def test_prune_keeps_pinned_entries(cache_dir):
+  make_files(cache_dir, ["acc_GPL1_.cache", "GPL1.gpl"], 5000, 10 * HOUR)
+  make_files(cache_dir, ["old.cache", "old.cache.meta"], 1000, 5 * HOUR)
+  make_files(cache_dir, ["new.cache"], 1000, HOUR)
+  # Pinned entries alone exceed the budget: all others are evicted.
+  removed = CacheManager(cache_dir).prune(max_bytes=6000)
+  assert sorted([e.key for e in removed]) == ["new.cache", "old.cache"]
+  assert entry_names(cache_dir) == ["GPL1.gpl", "acc_GPL1_.cache"]
+
+
+def test_prune_evicts_least_recently_used(cache_dir):
+  make_files(cache_dir, ["old.cache"], 1000, 5 * HOUR)
+  make_files(cache_dir, ["new.cache"], 1000, 2 * HOUR)
+  # Reading "old.cache" makes "new.cache" the least recently used entry.
+  cachemanager.touch(os.path.join(cache_dir, "old.cache"))
+  removed = CacheManager(cache_dir).prune(max_bytes=1000, dry_run=True)
+  assert [e.key for e in removed] == ["new.cache"]
+  assert entry_names(cache_dir) == ["new.cache", "old.cache"]
+  CacheManager(cache_dir).prune(max_bytes=1000)
+  assert entry_names(cache_dir) == ["old.cache"]
+  # Entries used within MIN_IDLE seconds are never evicted.
+  assert CacheManager(cache_dir).prune(max_bytes=0) == []
+  assert entry_names(cache_dir) == ["old.cache"]
+
+
+def test_prune_deletes_idle_partials(cache_dir):
+  make_files(cache_dir, ["stale.cache.tmp", "stale.cache.tmp.resume"], 100,
+             30 * 24 * HOUR)
+  make_files(cache_dir, ["recent.cache.tmp", "recent.cache.tmp.resume"], 100,
+             HOUR)
+  removed = CacheManager(cache_dir).prune()
+  assert [e.key for e in removed] == ["stale.cache.tmp"]
+  assert entry_names(cache_dir) == ["recent.cache.tmp"]
+
+
+def test_prune_skips_locked_entries(cache_dir):
+  make_files(cache_dir, ["locked.cache"], 1000, 5 * HOUR)
+  make_files(cache_dir, ["other.cache"], 1000, 4 * HOUR)
+  make_files(cache_dir, ["stale.cache.tmp", "stale.cache.tmp.resume"], 100,
+             30 * 24 * HOUR)
+  make_files(cache_dir, ["busy.cache.tmp"], 100, 30 * 24 * HOUR)
+  # Downloads of "locked.cache" and "busy.cache" hold their entry locks.
+  locks = [EntryLock(cache_dir, name) for name in ("locked.cache", "busy.cache")]
+  for lock in locks:
+    assert lock.acquire(0)
+  try:
+    removed = CacheManager(cache_dir).prune(max_bytes=500)
+  finally:
+    for lock in locks:
+      lock.release()
+  assert sorted([e.key for e in removed]) == ["other.cache", "stale.cache.tmp"]
+  assert entry_names(cache_dir) == ["busy.cache.tmp", "locked.cache"]
+
+
+def test_maybe_prune_without_budget(cache_dir):
+  make_files(cache_dir, ["a.cache"], 1000, 5 * HOUR)
+  manager = CacheManager(cache_dir)
+  manager.maybe_prune()
+  assert entry_names(cache_dir) == ["a.cache"]
+  manager.max_bytes = 0
+  manager.maybe_prune()
+  assert entry_names(cache_dir) == []
+
+
+@pytest.mark.parametrize("s, n", [("1024", 1024), ("1.5K", 1536), ("50G", 50 * 1024**3),
+                                  ("2 MiB", 2 * 1024**2)])
+def test_parse_bytes(s, n):
+  assert cachemanager.parse_bytes(s) == n
@@ -0,0 +1,173 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from download import entrylock
+from download.entrylock import EntryLock
+from download import cached_download
+from download.cached_download import CachedDownload
+
+NAME = "ftp.ncbi.nih.gov_pub_geo_GSE1.txt.cache"
+
+
+@pytest.fixture(autouse=True)
+def fast_poll(monkeypatch):
+  monkeypatch.setattr(entrylock, "POLL_SECONDS", 0.01)
+
+
+def try_lock(cache_dir, result):
+  result.put(EntryLock(cache_dir, NAME).acquire(0))
+
+
+def test_lock_excludes_threads_and_processes(tmp_path):
+  cache_dir = str(tmp_path)
+  lock = EntryLock(cache_dir, NAME)
+  assert lock.acquire(0) and lock.locked
+  # Another lock object of the same entry, as in another thread.
+  other = EntryLock(cache_dir, NAME)
+  assert not other.acquire(0)
+  assert not other.acquire(0.05) and not other.locked
+  # Another process.
+  result = multiprocessing.Queue()
+  p = multiprocessing.Process(target=try_lock, args=(cache_dir, result))
+  p.start()
+  p.join()
+  assert result.get() is False
+  # Other entries are not locked.
+  assert EntryLock(cache_dir, NAME + ".gz").acquire(0)
+  lock.release()
+  assert not lock.locked
+  assert other.acquire(0)
+  other.release()
+
+
+def test_waiter_takes_lock_when_released(tmp_path):
+  lock = EntryLock(str(tmp_path), NAME)
+  lock.acquire()
+  taken = []
+  def wait():
+    taken.append(EntryLock(str(tmp_path), NAME).acquire(5))
+  t = threading.Thread(target=wait)
+  t.start()
+  time.sleep(0.05)
+  assert taken == []
+  lock.release()
+  t.join()
+  assert taken == [True]
+
+
+def test_lock_of_exited_holder_is_released(tmp_path):
+  p = multiprocessing.Process(target=EntryLock(str(tmp_path), NAME).acquire)
+  p.start()
+  p.join()
+  assert EntryLock(str(tmp_path), NAME).acquire(0)
+
+
+def test_thread_does_not_wait_for_its_own_lock(tmp_path):
+  lock = EntryLock(str(tmp_path), NAME)
+  assert lock.acquire(0)
+  other = EntryLock(str(tmp_path), NAME)
+  assert other.held_by_caller()
+  t = time.time()
+  assert not other.acquire(60) and not other.acquire()
+  assert time.time() - t < 1
+  # Other threads wait for it.
+  held = []
+  run = threading.Thread(target=lambda: held.append(other.held_by_caller()))
+  run.start()
+  run.join()
+  assert held == [False]
+  lock.release()
+  assert not other.held_by_caller()
+  assert other.acquire(0)
+  other.release()
+
+
+def serve(monkeypatch, tmp_path, url, data):
+  """Serve `data` of FTP `url` to CachedDownload. Return [int] of offsets
+  of fetches."""
+  monkeypatch.setattr(cached_download, "CACHE_DIR", str(tmp_path))
+  fetched = []
+  class Response(object):
+    total_size = len(data)
+    def __init__(self):
+      self.lines = iter(data.splitlines(True))
+    def readline(self):
+      return next(self.lines, b"")
+    def read(self, size=-1):
+      return b"".join(self.lines)
+    def info(self):
+      return {}
+    def geturl(self):
+      return url
+  def fetch_ftp(self, offset=0):
+    fetched.append(offset)
+    return Response()
+  monkeypatch.setattr(CachedDownload, "_fetch_ftp", fetch_ftp)
+  return fetched
+
+
+def test_concurrent_downloads_of_url_fetch_once(tmp_path, monkeypatch):
+  url = "ftp://ftp.ncbi.nih.gov/pub/geo/GSE1.txt"
+  data = b"".join([b"line %d\n" % i for i in range(2000)])
+  fetched = serve(monkeypatch, tmp_path, url, data)
+
+  # The first download holds the entry lock until it is closed.
+  fp = CachedDownload(url, report_status=False).read()
+  assert next(fp) == b"line 0\n"
+  results = []
+  def read():
+    fp = CachedDownload(url, report_status=False).read()
+    results.append(fp.read())
+    fp.close()
+  threads = [threading.Thread(target=read) for i in range(3)]
+  for t in threads:
+    t.start()
+  time.sleep(0.1)
+  assert results == []
+  # Closing finishes the download, finalizes the cache and releases the lock.
+  fp.close()
+  for t in threads:
+    t.join()
+  assert results == [data] * 3
+  assert fetched == [0]
+
+
+def test_reopen_in_same_thread_does_not_wait(tmp_path, monkeypatch):
+  url = "ftp://ftp.ncbi.nih.gov/pub/geo/GSE1.txt"
+  data = b"".join([b"line %d\n" % i for i in range(2000)])
+  fetched = serve(monkeypatch, tmp_path, url, data)
+  fp = CachedDownload(url, report_status=False).read()
+  assert next(fp) == b"line 0\n"
+  # The url is open for download in this thread: download it without cache.
+  t = time.time()
+  fp2 = CachedDownload(url, report_status=False).read()
+  assert fp2.read() == data
+  fp2.close()
+  assert time.time() - t < 1
+  fp.close()
+  assert fetched == [0, 0]
+  fp = CachedDownload(url, report_status=False).read()
+  assert fp.read() == data
+  assert fetched == [0, 0]
+
+
+def test_failed_open_rows_releases_opened_files(fixture_dir, open_cached_gse,
+                                                monkeypatch):
+  gse = open_cached_gse(fixture_dir)
+  urls = [f.url for f in gse._get_ftp_files()]
+  assert len(urls) == 2
+  fetch_ftp = CachedDownload._fetch_ftp
+  def fail_second(self, offset=0):
+    if self.url == urls[1]:
+      raise IOError("connection reset")
+    return fetch_ftp(self, offset)
+  monkeypatch.setattr(CachedDownload, "_fetch_ftp", fail_second)
+  with pytest.raises(IOError):
+    gse.open_rows()
+  # The download of the first file was closed and released its lock.
+  lock = EntryLock(open_cached_gse.cache_dir, cached_download.get_cache_name(urls[0]))
+  assert lock.acquire(0)
+  lock.release()
@@ -0,0 +1,153 @@
+import io
+import random
+
+import pytest
+
+import geo
+import filter
+
+pytest.importorskip("numpy")
+
+
+class Sample(object):
+  def __init__(self, subject):
+    self.subject = subject
+
+
+class Platform(object):
+  """Loaded GPL stand-in with a gene symbol for most rows."""
+  loaded = True
+
+  def __init__(self, genes):
+    self.genes = genes
+    self.special_cols = dict([(name, None) for name in geo.GPL.EQTL_GENE_NAME_LIST])
+    self.special_cols['GENE_SYMBOL'] = "Gene Symbol"
+
+  def get_column(self, row_id, name):
+    return self.genes[row_id]
+
+
+class FakeGSE(object):
+  """Populated eQTL study stand-in of random rows of replicate samples.
+
+  With `n_values`, rows repeat one of `n_values` random rows of values, so
+  that many rows have equal means and stds.
+  """
+  populated = True
+  type = "eQTL"
+  id = "GSE0"
+  parameters = {'rx_gsm_subject_str': "subject"}
+
+  def __init__(self, n_rows=600, n_subjects=6, replicates=2, seed=1,
+               n_values=None):
+    rnd = random.Random(seed)
+    self.samples = {}
+    self.subject_gsms = {}
+    gsms = []
+    for s in range(n_subjects):
+      for r in range(replicates):
+        gsm = "GSM%d" % (s * replicates + r)
+        self.samples[gsm] = Sample("subject%d" % s)
+        self.subject_gsms.setdefault("subject%d" % s, []).append(gsm)
+        gsms.append(gsm)
+    rnd.shuffle(gsms)
+    self.col_titles = ["ID_REF"] + gsms
+    genes = {}
+    self.rows = []
+    pool = [["%.6f" % rnd.gauss(8, 2) for gsm in gsms]
+            for i in range(n_values or 0)]
+    for i in range(n_rows):
+      row_id = "%d_at" % i
+      # Some rows have no gene; most genes have several rows.
+      genes[row_id] = rnd.random() < 0.9 and "GENE%d" % rnd.randrange(n_rows // 3) or ""
+      if pool:
+        self.rows.append([row_id] + rnd.choice(pool))
+        continue
+      values = ["%.6f" % rnd.gauss(8, 2) for gsm in gsms]
+      for j in range(rnd.randrange(3)):
+        values[rnd.randrange(len(values))] = "null"
+      self.rows.append([row_id] + values)
+    self.platform = Platform(genes)
+    self.est_num_row = n_rows
+    self.col_plans = {}
+
+  def __repr__(self):
+    return "[FakeGSE %s (%d)]" % (self.id, id(self))
+
+  def get_rows(self):
+    return self.open_rows()
+
+  def open_rows(self, index=None, read_threads=1):
+    """Return iter of rows, indexed by row number in `index`, if any."""
+    if index is not None:
+      index.start(["rows"], [io.BytesIO()], [0])
+    return self._iter_rows(index)
+
+  def _iter_rows(self, index):
+    for row in self.rows:
+      if index is not None:
+        index.add([1])
+      yield row[:]
+
+  def get_rows_at(self, index, row_nums):
+    for n in row_nums:
+      yield self.rows[index.offsets[0][n]][:]
+
+
+@pytest.mark.parametrize("spill", [True, False], ids=["spill", "nospill"])
+@pytest.mark.parametrize("merge_cols", [True, False], ids=["merge", "nomerge"])
+@pytest.mark.parametrize("block_size", [7, 2048])
+def test_numpy_engine_matches_python_engine(tmp_dir, merge_cols, block_size,
+                                            spill, monkeypatch):
+  monkeypatch.setattr(filter.EQTLFilter, "ROW_BLOCK_SIZE", block_size)
+  gse = FakeGSE()
+  expected = list(filter.EQTLFilter(gse, merge_cols=merge_cols,
+                                    engine="python").get_rows())
+  rows = list(filter.EQTLFilter(gse, merge_cols=merge_cols, engine="numpy",
+                                spill=spill).get_rows())
+  assert rows == expected
+  assert len(rows) > 100
+
+
+@pytest.mark.parametrize("engine", filter.ENGINES)
+@pytest.mark.parametrize("spill", [True, False], ids=["spill", "nospill"])
+def test_ties_go_to_first_row(tmp_dir, engine, spill, monkeypatch):
+  monkeypatch.setattr(filter.EQTLFilter, "ROW_BLOCK_SIZE", 7)
+  gse = FakeGSE(n_values=4)
+  f = filter.EQTLFilter(gse, engine=engine, spill=spill)
+  rows = list(f.get_rows())
+  stats, nums = f.row_stats, f.row_nums
+
+  # Per gene, the first row of the maximum mean.
+  best = {}
+  for row_id in sorted(stats, key=nums.get):
+    gene = gse.platform.genes[row_id]
+    if gene not in best or stats[row_id]['mean'] > stats[best[gene]]['mean']:
+      best[gene] = row_id
+  # Equal stds at the cut: the first rows are kept.
+  ranked = sorted(best.values(), key=lambda x: (-stats[x]['std'], nums[x]))
+  n = int(len(ranked) * f.percentile)
+  assert stats[ranked[n - 1]]['std'] == stats[ranked[n]]['std']
+  assert [row[0] for row in rows[1:]] == sorted(ranked[:n], key=nums.get)
+  assert len(set(stats[x]['mean'] for x in best.values())) == 4
+
+
+def test_column_plan_is_reused(tmp_dir):
+  gse = FakeGSE()
+  f = filter.EQTLFilter(gse, engine="python")
+  expected = list(f.get_rows())
+  g = filter.EQTLFilter(gse, engine="numpy")
+  assert g.col_plan is f.col_plan
+  assert list(g.get_rows()) == expected
+
+
+def test_unknown_engine():
+  with pytest.raises(ValueError):
+    filter.EQTLFilter(FakeGSE(), engine="fortran")
+
+
+def test_engines_match_on_fixture_study(plain_fixture_dir, open_gse, tmp_dir):
+  gse = open_gse(plain_fixture_dir)
+  outputs = [list(filter.EQTLFilter(gse, engine=engine, spill=spill).get_rows())
+             for engine in filter.ENGINES for spill in (True, False)]
+  assert all(rows == outputs[0] for rows in outputs)
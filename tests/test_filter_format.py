@@ -0,0 +1,32 @@
+import re
+
+import pytest
+
+import filter
+
+
+@pytest.mark.parametrize("x, s", [
+  (None, "None"),
+  (0.0, "0.0"),
+  (-3.0, "-3.0"),
+  (7.3193375, "7.3193375"),
+  (0.29852874338202307, "0.298528743382"),
+  (1 / 3.0, "0.333333333333"),
+  (1e16, "1e+16"),
+  (2.5e-07, "2.5e-07"),
+  (float("inf"), "inf"),
+])
+def test_format_float_matches_python2_str(x, s):
+  assert filter.format_float(x) == s
+
+
+@pytest.mark.parametrize("spill", [True, False], ids=["spill", "reread"])
+def test_filtered_floats_have_12_significant_digits(plain_fixture_dir, open_gse,
+                                                    tmp_dir, spill):
+  gse = open_gse(plain_fixture_dir)
+  rows = list(filter.EQTLFilter(gse, spill=spill).get_rows())
+  for row in rows[1:]:
+    assert re.match(r"^\d+$", row[2])
+    for s in row[3:]:
+      if s != "None":
+        assert len(re.sub(r"[^\d]", "", s.split("e")[0]).lstrip("0")) <= 12
@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+import geo
+import filter
+from download import blockzip, cached_download
+
+
+@pytest.fixture(params=[True, False], ids=["parallel", "serial"])
+def parallel_read(request, monkeypatch):
+  monkeypatch.setattr(geo.GSE, "PARALLEL_READ", request.param)
+  return request.param
+
+
+def test_no_spill_rereads_rows_by_offset(plain_fixture_dir, open_gse, tmp_dir,
+                                         parallel_read, monkeypatch):
+  gse = open_gse(plain_fixture_dir)
+  expected = list(filter.EQTLFilter(gse, spill=True).get_rows())
+  # The second pass reads rows by offset, not whole files again.
+  opened = []
+  get_rows_at = geo.GSE.get_rows_at
+  def spy(self, index, row_nums):
+    opened.append((len(index), len(row_nums)))
+    return get_rows_at(self, index, row_nums)
+  monkeypatch.setattr(geo.GSE, "get_rows_at", spy)
+  monkeypatch.setattr(geo.GSE, "get_rows", None)
+
+  f = filter.EQTLFilter(gse, spill=False)
+  rows = list(f.get_rows())
+  assert rows == expected
+  assert opened == [(300, len(rows) - 1)]
+  assert os.listdir(tmp_dir) == []
+
+
+def test_row_index_offsets_point_at_row_lines(plain_fixture_dir, open_gse,
+                                              parallel_read):
+  gse = open_gse(plain_fixture_dir)
+  index = geo.RowIndex()
+  rows = list(gse.open_rows(index))
+  assert index.seekable and len(index) == len(rows) == 300
+  for k, url in enumerate(index.urls):
+    path = os.path.join(plain_fixture_dir, "GSE90001", url.split("/")[-1])
+    with open(path, "rb") as fp:
+      for i in (0, 1, 150, 299):
+        fp.seek(index.offsets[k][i])
+        assert fp.readline().split(b"\t")[0] == ('"%s"' % rows[i][0]).encode()
+  assert list(gse.get_rows_at(index, [0, 150, 299])) == \
+    [rows[0], rows[150], rows[299]]
+
+
+def test_no_spill_of_gzip_files_reads_forward(gse, tmp_dir):
+  expected = list(filter.EQTLFilter(gse, spill=True).get_rows())
+  it = filter.EQTLFilter(gse, spill=False).get_rows()
+  rows = [next(it)]
+  # Gzip files are not seekable, but row offsets were recorded: no spill.
+  assert os.listdir(tmp_dir) == []
+  rows.extend(it)
+  assert rows == expected
+
+
+def test_no_spill_of_verbatim_gzip_cache(fixture_dir, open_cached_gse, tmp_dir,
+                                         monkeypatch):
+  # Small gzip files are cached as they are, and cannot seek.
+  monkeypatch.setattr(cached_download, "REBLOCK_MIN_BYTES", 1 << 30)
+  gse = open_cached_gse(fixture_dir)
+  expected = list(filter.EQTLFilter(gse, spill=True).get_rows())
+  for f in gse._get_ftp_files():
+    filepath = os.path.join(open_cached_gse.cache_dir,
+                            cached_download.get_cache_name(f.url))
+    meta = cached_download.read_meta(filepath)
+    assert meta['encoding'] == cached_download.ENC_VERBATIM
+
+  spills = []
+  monkeypatch.setattr(filter.spill, "SpillWriter",
+                      lambda *args: spills.append(args))
+  rows = list(filter.EQTLFilter(gse, spill=False).get_rows())
+  assert rows == expected
+  assert spills == [] and os.listdir(tmp_dir) == []
+
+
+def test_rows_seek_in_reblocked_gzip_cache(fixture_dir, open_cached_gse,
+                                          monkeypatch):
+  monkeypatch.setattr(cached_download, "REBLOCK_MIN_BYTES", 0)
+  gse = open_cached_gse(fixture_dir)
+  # The first read downloads the series matrix files to the cache.
+  rows = list(gse.get_rows())
+  for f in gse._get_ftp_files():
+    filepath = os.path.join(open_cached_gse.cache_dir,
+                            cached_download.get_cache_name(f.url))
+    meta = cached_download.read_meta(filepath)
+    assert meta['encoding'] == cached_download.ENC_GZIP_BLOCK
+
+  index = geo.RowIndex()
+  assert list(gse.open_rows(index)) == rows
+  assert index.seekable and index.complete
+  moves = []
+  move_to = geo.GSE._move_to
+  def spy(self, fp, pos, offset):
+    moves.append(geo.is_seekable(fp))
+    return move_to(self, fp, pos, offset)
+  monkeypatch.setattr(geo.GSE, "_move_to", spy)
+  assert list(gse.get_rows_at(index, [3, 150, 299])) == \
+    [rows[3], rows[150], rows[299]]
+  assert moves and all(moves)
+
+
+def test_header_is_not_decompressed_again(fixture_dir, open_cached_gse,
+                                          monkeypatch):
+  monkeypatch.setattr(cached_download, "REBLOCK_MIN_BYTES", 0)
+  monkeypatch.setattr(blockzip, "BLOCK_SIZE", 256)
+  gse = open_cached_gse(fixture_dir)
+  rows = list(gse.get_rows())
+
+  read = []
+  read_block = blockzip.BlockStream._read_block
+  def spy(self, i):
+    read.append((self.name, i))
+    return read_block(self, i)
+  monkeypatch.setattr(blockzip.BlockStream, "_read_block", spy)
+  assert list(gse.open_rows()) == rows
+  assert read
+  for f in gse._get_ftp_files():
+    filepath = os.path.join(open_cached_gse.cache_dir,
+                            cached_download.get_cache_name(f.url))
+    starts = blockzip.read_index(filepath)['data']
+    offset = gse.data_offsets[f.url]
+    header_blocks = [i for i in range(len(starts) - 1) if starts[i + 1] <= offset]
+    assert header_blocks
+    blocks = [i for name, i in read if name == filepath]
+    assert blocks and not set(blocks) & set(header_blocks)
@@ -0,0 +1,78 @@
+import ftplib
+
+from download import ftppool
+
+LISTING = ["-r--r--r--   1 ftp      anonymous 1024 Dec 28 07:34 GSE1_series_matrix.txt.gz"]
+
+
+class FakeFTP(object):
+  """ftplib.FTP stand-in which lists one directory and counts commands."""
+  def __init__(self):
+    self.commands = []
+    self.closed = False
+
+  def retrlines(self, cmd, callback):
+    self.commands.append(cmd)
+    for line in LISTING:
+      callback(line)
+
+  def voidcmd(self, cmd):
+    self.commands.append(cmd)
+
+  def quit(self):
+    self.commands.append("QUIT")
+    self.closed = True
+
+  def close(self):
+    self.closed = True
+
+
+def make_pool(monkeypatch):
+  pool = ftppool.FTPPool()
+  sessions = []
+  def connect(key):
+    sessions.append(FakeFTP())
+    pool.n_connects += 1
+    return sessions[-1]
+  monkeypatch.setattr(pool, "_connect", connect)
+  return pool, sessions
+
+
+def test_listings_reuse_session_but_are_not_cached(monkeypatch):
+  pool, sessions = make_pool(monkeypatch)
+  url = "ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SeriesMatrix/GSE1/"
+  for i in range(2):
+    fp = pool.open(url)
+    assert fp.read() == (LISTING[0] + "\n").encode("latin-1")
+  assert len(sessions) == 1
+  assert sessions[0].commands == ["LIST /pub/geo/DATA/SeriesMatrix/GSE1/",
+    "TYPE I"] * 2
+
+
+def test_permanent_error_keeps_session(monkeypatch):
+  pool, sessions = make_pool(monkeypatch)
+  key = ("ftp.ncbi.nih.gov", ftplib.FTP_PORT, "anonymous", "")
+  def fail(ftp):
+    raise ftplib.error_perm("550 No such file")
+  try:
+    pool._call(key, "ftp://ftp.ncbi.nih.gov/missing", fail)
+  except ftplib.error_perm:
+    pass
+  assert pool.acquire(key) == (sessions[0], True)
+
+
+def test_forked_process_forgets_inherited_sessions(monkeypatch):
+  pool, sessions = make_pool(monkeypatch)
+  url = "ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SeriesMatrix/GSE1/"
+  pool.open(url).read()
+  assert len(sessions) == 1
+  # As in a forked worker: same pool object, another process ID.
+  child_pid = pool._pid + 1
+  monkeypatch.setattr(ftppool.os, "getpid", lambda: child_pid)
+  pool.open(url).read()
+  assert len(sessions) == 2
+  # The inherited session was neither used nor quit by the child.
+  assert sessions[0].commands == ["LIST /pub/geo/DATA/SeriesMatrix/GSE1/", "TYPE I"]
+  assert not sessions[0].closed
+  pool.close()
+  assert sessions[1].commands[-1] == "QUIT"
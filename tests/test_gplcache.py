@@ -0,0 +1,70 @@
+import os
+
+from download import cached_download
+from download.cached_download import get_cache_name
+from gplcache import GPLCache, GPL_FIELDS
+
+KEY = ("GPL1", "eQTL")
+BRIEF_URL = "http://example.org/GPL1/brief"
+DATA_URL = "http://example.org/GPL1/data"
+
+
+class FakeGPL(object):
+  """Object with the GPL attributes which GPLCache stores."""
+  def __init__(self, loaded=False, loaded_cols=None):
+    for name in GPL_FIELDS:
+      setattr(self, name, None)
+    self.id = "GPL1"
+    self.loaded = loaded
+    self.loaded_cols = loaded_cols
+    self.table = None
+
+  def source_urls(self):
+    if self.loaded:
+      return [BRIEF_URL, DATA_URL]
+    return [BRIEF_URL]
+
+  def _set_table(self, table):
+    self.table = table
+
+
+def cache_download(cache_dir, url, t):
+  """Write download cache metadata of `url` as if cached at epoch time `t`."""
+  filepath = os.path.join(cache_dir, get_cache_name(url))
+  open(filepath, "wb").close()
+  cached_download.write_json(filepath + cached_download.META_SUFFIX,
+                             {'url': url, 'time': t})
+
+
+def test_partial_load_does_not_replace_full_load(tmp_path):
+  cache_dir = str(tmp_path)
+  cache = GPLCache(cache_dir=cache_dir)
+  cache.put(KEY, FakeGPL(loaded=True))
+  cache.put(KEY, FakeGPL(loaded=True, loaded_cols=["ID"]))
+  assert sorted(os.listdir(cache_dir)) == \
+    ["GPL1.eQTL.gpl", "GPL1.eQTL.special.gpl"]
+  gpl = GPLCache(cache_dir=cache_dir).get(KEY, FakeGPL)
+  assert gpl.loaded and gpl.loaded_cols is None
+
+
+def test_partial_load_is_used_without_full_load(tmp_path):
+  cache_dir = str(tmp_path)
+  cache = GPLCache(cache_dir=cache_dir)
+  cache.put(KEY, FakeGPL())
+  cache.put(KEY, FakeGPL(loaded=True, loaded_cols=["ID"]))
+  gpl = GPLCache(cache_dir=cache_dir).get(KEY, FakeGPL)
+  assert gpl.loaded and gpl.loaded_cols == ["ID"]
+
+
+def test_entry_expires_with_its_downloads(tmp_path):
+  cache_dir = str(tmp_path)
+  cache_download(cache_dir, BRIEF_URL, 100.0)
+  cache_download(cache_dir, DATA_URL, 200.0)
+  GPLCache(cache_dir=cache_dir).put(KEY, FakeGPL(loaded=True))
+  assert GPLCache(cache_dir=cache_dir).get(KEY, FakeGPL) is not None
+  # An evicted download does not expire the entry.
+  os.remove(os.path.join(cache_dir, get_cache_name(DATA_URL) + ".meta"))
+  assert GPLCache(cache_dir=cache_dir).get(KEY, FakeGPL) is not None
+  # A download cached again does.
+  cache_download(cache_dir, BRIEF_URL, 300.0)
+  assert GPLCache(cache_dir=cache_dir).get(KEY, FakeGPL) is None
@@ -0,0 +1,41 @@
+import threading
+
+import metrics
+
+
+def run_in_thread(f):
+  t = threading.Thread(target=f)
+  t.start()
+  t.join()
+
+
+def test_other_threads_do_not_count_toward_study():
+  m = metrics.start("GSE1")
+  try:
+    with metrics.stage("gse.open") as stage:
+      stage.rows = 3
+    # Like a prefetch download in a pool thread.
+    run_in_thread(lambda: metrics.add("download", calls=1, bytes_in=100))
+    # Like a parallel row reader of the study.
+    def reader():
+      metrics.bind(m)
+      metrics.add("download", calls=1, bytes_in=7)
+    run_in_thread(reader)
+  finally:
+    assert metrics.stop() is m
+  assert metrics.current() is None
+  assert m.stages["gse.open"]["rows"] == 3
+  assert m.stages["download"]["calls"] == 1
+  assert m.stages["download"]["bytes_in"] == 7
+
+
+def test_memory_is_reported_per_study():
+  m = metrics.start("GSE1")
+  block = bytearray(b"x") * (32 << 20)
+  d = metrics.stop().to_dict()
+  assert d["cpu_scope"] in ("thread", "process")
+  assert d["peak_rss_delta_kb"] >= 0
+  assert d["process_peak_rss_kb"] >= d["peak_rss_delta_kb"]
+  if d["rss_kb"] is not None:
+    assert d["rss_delta_kb"] >= 30000
+  assert len(block) == 32 << 20
@@ -0,0 +1,28 @@
+import logging
+
+from logger import queue_handler
+
+
+def record(msg, *args):
+  return logging.LogRecord("test", logging.INFO, __file__, 1, msg, args, None)
+
+
+class Study(object):
+  def __repr__(self):
+    return "[Study GSE1]"
+
+
+def test_prepare_keeps_message_lazy():
+  rows = ["a", "b"]
+  r = queue_handler._prepare(record("%s has %d rows %s, %.1f%%", Study(), 2, rows, 12.5))
+  rows.append("c")
+  # Only the arguments which may change are converted; the message is not
+  #   formatted yet.
+  assert r.msg == "%s has %d rows %s, %.1f%%"
+  assert r.args == ("[Study GSE1]", 2, "['a', 'b']", 12.5)
+  assert r.getMessage() == "[Study GSE1] has 2 rows ['a', 'b'], 12.5%"
+
+
+def test_prepare_formats_mapping_arguments():
+  r = queue_handler._prepare(record("%(n)d rows", {'n': 3}))
+  assert r.msg == "3 rows" and r.args is None
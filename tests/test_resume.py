@@ -0,0 +1,172 @@
+import gzip
+import io
+import os
+
+import pytest
+
+from download import cached_download
+from download.cached_download import CachedDownload
+
+URL = "ftp://ftp.ncbi.nih.gov/pub/geo/DATA/SeriesMatrix/GSE1/GSE1_series_matrix.txt"
+DATA = b"".join([b"\"%d_at\"\t%d.5\t%d.25\n" % (i, i, i * 3) for i in range(5000)])
+
+
+class FakeResponse(io.BytesIO):
+  """FTP transfer stand-in of remote bytes from a REST offset."""
+  def __init__(self, data, url, rest):
+    io.BytesIO.__init__(self, data[rest:])
+    self.url = url
+    self.total_size = len(data)
+
+  def info(self):
+    return {}
+
+  def geturl(self):
+    return self.url
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+  """Return {'data': bytes, 'offsets': [int]} of the remote file of URL,
+  fetched from FTP with REST offsets recorded in 'offsets'."""
+  monkeypatch.setattr(cached_download, "CACHE_DIR", str(tmp_path))
+  remote = {'data': DATA, 'offsets': []}
+  def fetch_ftp(self, offset=0):
+    remote['offsets'].append(offset)
+    return FakeResponse(remote['data'], self.url, offset)
+  monkeypatch.setattr(CachedDownload, "_fetch_ftp", fetch_ftp)
+  return remote
+
+
+def gzip_bytes(data):
+  out = io.BytesIO()
+  fp = gzip.GzipFile(fileobj=out, mode="wb")
+  fp.write(data)
+  fp.close()
+  return out.getvalue()
+
+
+def tmp_cache_path(tmp_path, url=URL):
+  return str(tmp_path / cached_download.get_cache_name(url)) + ".tmp"
+
+
+def partial_files(tmp_path):
+  return [x for x in os.listdir(str(tmp_path)) if ".tmp" in x]
+
+
+def download(url, size, **kwds):
+  """Return DownloadIter of url of remote size `size`, as GSE opens it."""
+  return CachedDownload(url, expected_size=size, report_status=False,
+                        **kwds).read()
+
+
+def download_part(url, size, n_reads):
+  """Read `n_reads` blocks of url, then close the download before completion."""
+  fp = download(url, size, finalize=False)
+  for i in range(n_reads):
+    fp.read(1000)
+  fp.close()
+  return fp.bytes_read
+
+
+def read_all(fp):
+  data = fp.read()
+  fp.close()
+  return data
+
+
+@pytest.mark.parametrize("gz", [False, True], ids=["block", "verbatim"])
+def test_resume_from_incomplete_cache(tmp_path, remote, gz):
+  url = URL
+  if gz:
+    url += ".gz"
+    remote['data'] = gzip_bytes(DATA)
+  size = len(remote['data'])
+  n = download_part(url, size, 7)
+  assert n == 7000
+  rec = cached_download.read_resume_record(tmp_cache_path(tmp_path, url))
+  assert rec['bytes'] == n and rec['size'] == size
+  assert rec['encoding'] == (cached_download.ENC_VERBATIM if gz else
+                             cached_download.ENC_BLOCK)
+
+  assert read_all(download(url, size)) == remote['data']
+  assert remote['offsets'] == [0, n]
+  assert partial_files(tmp_path) == []
+  # Read from the finalized cache, not the network.
+  fp = download(url, size)
+  if gz:
+    assert gzip.GzipFile(fileobj=fp).read() == DATA
+  else:
+    assert fp.read() == DATA
+  fp.close()
+  assert len(remote['offsets']) == 2
+
+
+def test_resume_overwrites_stale_segment(tmp_path, remote):
+  n = download_part(URL, len(DATA), 3)
+  # As if a previous resume was killed while writing its segment.
+  seg_filepath = tmp_cache_path(tmp_path) + cached_download.SEGMENT_SUFFIX
+  fp = gzip.GzipFile(seg_filepath, "wb")
+  fp.write(b"stale segment\n")
+  fp.close()
+
+  assert read_all(download(URL, len(DATA))) == DATA
+  assert remote['offsets'] == [0, n]
+  assert partial_files(tmp_path) == []
+  assert read_all(download(URL, len(DATA))) == DATA
+  assert len(remote['offsets']) == 2
+
+
+def test_resume_of_changed_remote_file_starts_over(tmp_path, remote):
+  download_part(URL, len(DATA), 3)
+  remote['data'] = DATA + b"\"5000_at\"\t1\t2\n"
+  assert read_all(download(URL, len(remote['data']))) == remote['data']
+  # The remote size differs from the resume record: download from byte 0.
+  assert remote['offsets'] == [0, 0]
+  assert read_all(download(URL, len(remote['data']))) == remote['data']
+
+
+def test_resume_refused_by_server_starts_over(tmp_path, remote, monkeypatch):
+  download_part(URL, len(DATA), 3)
+  # The server reports another size after REST, as if the file changed.
+  fetch_ftp = CachedDownload._fetch_ftp
+  def fetch_changed(self, offset=0):
+    rsp = fetch_ftp(self, offset)
+    if offset:
+      rsp.total_size += 1
+    return rsp
+  monkeypatch.setattr(CachedDownload, "_fetch_ftp", fetch_changed)
+  assert read_all(download(URL, len(DATA))) == DATA
+  assert remote['offsets'] == [0, 3000, 0]
+  assert partial_files(tmp_path) == []
+
+
+def test_resumed_gzip_download_is_reblocked(tmp_path, remote, monkeypatch):
+  monkeypatch.setattr(cached_download, "REBLOCK_MIN_BYTES", 0)
+  url = URL + ".gz"
+  remote['data'] = gzip_bytes(DATA)
+  size = len(remote['data'])
+  download_part(url, size, 1)
+  assert read_all(download(url, size)) == remote['data']
+  assert partial_files(tmp_path) == []
+  filepath = str(tmp_path / cached_download.get_cache_name(url))
+  meta = cached_download.read_meta(filepath)
+  assert meta['encoding'] == cached_download.ENC_GZIP_BLOCK
+  assert meta['bytes'] == size
+
+  # Still a gzip file of the same data to callers which decompress it.
+  handle = CachedDownload(url, expected_size=size, report_status=False)
+  fp = handle.read()
+  assert not handle.gunzipped
+  assert gzip.GzipFile(fileobj=fp).read() == DATA
+  fp.close()
+  # Decompressed and seekable to callers which pass `gunzip`.
+  handle = CachedDownload(url, expected_size=size, report_status=False,
+                          gunzip=True)
+  fp = handle.read()
+  assert handle.gunzipped
+  offset = DATA.index(b"\"4321_at\"")
+  fp.seek(offset)
+  assert fp.readline() == DATA[offset:DATA.index(b"\n", offset) + 1]
+  fp.close()
+  assert remote['offsets'] == [0, 1000]
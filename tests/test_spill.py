@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+import spill
+import filter
+
+
+def test_round_trip_keeps_missing_and_nan(tmp_path):
+  filepath = str(tmp_path / "rows")
+  rows = [
+    ("ILMN_1", "GENE1", [3, 7.25, 0.5, 1.0, None, -2.5e-300]),
+    ("ILMN_2", "GENE2", [2, float("nan"), float("inf"), None, None, 0.0]),
+  ]
+  fp = spill.SpillWriter(filepath, 6)
+  for row_id, gene_sym, values in rows:
+    fp.write(row_id, gene_sym, values)
+  fp.close()
+
+  reader = spill.SpillReader(filepath, 6)
+  assert len(reader) == 2
+  assert reader.row_ids == ["ILMN_1", "ILMN_2"]
+  assert reader.gene_syms == ["GENE1", "GENE2"]
+  assert reader.read(0) == rows[0][2]
+  values = reader.read(1)
+  reader.close()
+  # A literal NaN stays a float; only MISSING reads back as None.
+  assert values[1] != values[1]
+  assert values[0] == 2 and values[2:] == [float("inf"), None, None, 0.0]
+
+
+def test_missing_is_not_any_nan():
+  assert spill.is_missing(spill.MISSING)
+  assert not spill.is_missing(float("nan"))
+  assert not spill.is_missing(1.0)
+
+
+def test_write_rejects_wrong_width(tmp_path):
+  fp = spill.SpillWriter(str(tmp_path / "rows"), 3)
+  with pytest.raises(ValueError):
+    fp.write("ILMN_1", "GENE1", [1.0, 2.0])
+  fp.close()
+
+
+def test_reader_rejects_truncated_file(tmp_path):
+  filepath = str(tmp_path / "rows")
+  fp = spill.SpillWriter(filepath, 2)
+  fp.write("ILMN_1", "GENE1", [1.0, 2.0])
+  fp.close()
+  with open(filepath, "ab") as fp:
+    fp.write(b"\0")
+  with pytest.raises(ValueError):
+    spill.SpillReader(filepath, 2)
+
+
+def test_empty_spill(tmp_path):
+  filepath = str(tmp_path / "rows")
+  spill.SpillWriter(filepath, 4).close()
+  reader = spill.SpillReader(filepath, 4)
+  assert len(reader) == 0
+  reader.close()
+  spill.remove(filepath)
+  assert os.listdir(str(tmp_path)) == []
+
+
+def test_filter_deletes_spill(gse, tmp_dir):
+  rows = list(filter.EQTLFilter(gse, spill=True).get_rows())
+  assert len(rows) > 1
+  assert os.listdir(tmp_dir) == []
+
+
+def test_filter_deletes_spill_when_closed_early(gse, tmp_dir):
+  it = filter.EQTLFilter(gse, spill=True).get_rows()
+  next(it)
+  next(it)
+  assert len(os.listdir(tmp_dir)) == 2
+  it.close()
+  assert os.listdir(tmp_dir) == []
@@ -0,0 +1,30 @@
+import csv
+
+import pytest
+
+from geo import GSE
+
+LINES = [
+  '"1007_s_at"\t7.3\t8.1\tnull\n',
+  '"1007_s_at"\t7.3\t8.1\tnull\r\n',
+  '"1007_s_at"\n',
+  '"1007_s_at"\t\t\n',
+  '1007_s_at\t7.3\t8.1\n',
+  '1007_s_at\t7.3\t8.1',
+  '"1007_s_at"\t"7.3"\t"8.1"\n',
+  '"1007\ts_at"\t7.3\n',
+  '"1007 ""quoted"" at"\t7.3\n',
+  '"1007_s_at"\t7.3\t"a, ""b"""\n',
+  '""\t7.3\n',
+  '"1007_s_at\t7.3\n',
+  '"1007_s_at"x\t7.3\n',
+  '1007_s_at\t"7.3"\n',
+  '\t7.3\n',
+  '\n',
+  '',
+]
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_split_line_matches_csv(line):
+  assert GSE._split_line(line) == next(csv.reader([line], delimiter="\t"), [])
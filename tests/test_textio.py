@@ -0,0 +1,83 @@
+import gzip
+import io
+
+import pytest
+
+from download import textio
+from download import gzstream
+from download.gzipper import Gzipper
+from download.textio import TextLines, as_text
+
+# GEO text is mostly ASCII, but some files have latin-1 or broken UTF-8 bytes.
+DATA = b"".join([b"!Sample_title\t\"Patient \xe9 %d\"\t\"\xc3\xa9t\xff\"\r\n" % i
+                 for i in range(500)]) + b"last line without end"
+LINES = DATA.decode("latin-1").splitlines(True)
+PY2 = str is bytes
+# Lines as str: decoded on Python 3, bytes on Python 2.
+STR_LINES = DATA.splitlines(True) if PY2 else LINES
+
+
+def gzip_bytes(data):
+  out = io.BytesIO()
+  fp = gzip.GzipFile(fileobj=out, mode="wb")
+  fp.write(data)
+  fp.close()
+  return out.getvalue()
+
+
+class Lines(io.BytesIO):
+  """Byte stream with readlines_block(n), as DownloadIter."""
+  def readlines_block(self, n):
+    return [line for i, line in zip(range(n), self)]
+
+
+def test_text_lines_decode_every_byte():
+  fp = TextLines(io.BytesIO(DATA))
+  assert fp.text
+  lines = list(fp)
+  assert lines == LINES
+  assert all(isinstance(line, type(u"")) for line in lines)
+  # One character per byte, so str offsets are byte offsets.
+  assert sum([len(line) for line in lines]) == len(DATA)
+  assert lines[0].encode(textio.ENCODING) == DATA[:len(lines[0])]
+
+
+@pytest.mark.parametrize("cls", [io.BytesIO, Lines], ids=["lines", "blocks"])
+def test_text_lines_blocks(cls):
+  blocks = list(TextLines(cls(DATA)).iter_blocks(64))
+  assert [len(b) for b in blocks] == [64] * 7 + [501 - 7 * 64]
+  assert sum(blocks, []) == LINES
+
+
+def test_text_lines_read_and_readline():
+  fp = TextLines(io.BytesIO(DATA))
+  assert fp.readline() == LINES[0]
+  assert fp.read(5) == LINES[1][:5]
+  assert fp.read() == u"".join(LINES)[len(LINES[0]) + 5:]
+  assert fp.readline() == u""
+  # Other attributes are those of the byte stream.
+  assert not fp.closed
+  fp.close()
+  assert fp.closed
+
+
+def test_as_text():
+  fp = io.BytesIO(DATA)
+  if PY2:
+    assert as_text(fp) is fp
+  else:
+    assert list(as_text(fp)) == LINES
+  # Text streams are returned as they are.
+  fp = gzstream.GzipStream(fileobj=io.BytesIO(gzip_bytes(DATA)), mode="r")
+  assert as_text(fp) is fp
+
+
+@pytest.mark.parametrize("read_size", [7, gzstream.GzipStream.READ_SIZE])
+def test_gzip_text_mode_matches_text_lines(read_size, monkeypatch):
+  monkeypatch.setattr(gzstream.GzipStream, "READ_SIZE", read_size)
+  fp = Gzipper(fileobj=io.BytesIO(gzip_bytes(DATA)), mode="r")
+  assert list(fp) == STR_LINES
+  fp = Gzipper(fileobj=io.BytesIO(gzip_bytes(DATA)), mode="r")
+  assert sum(list(fp.iter_blocks(100)), []) == STR_LINES
+  fp = Gzipper(fileobj=io.BytesIO(gzip_bytes(DATA)), mode="rb")
+  assert b"".join(fp) == DATA
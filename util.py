@@ -20,7 +20,7 @@ def assert_row_alignment(n, varlist, gpl):
   """Assert that GPL row descriptions and row id list aligns to data rows."""
   assert n == len(gpl.row_desc) == len(gpl.probe_list) == len(gpl.probe_idx_map), \
       " != ".join((n, len(gpl.row_desc), len(gpl.probe_list), len(gpl.probe_idx_map)))
-  for i in xrange(n):
+  for i in range(n):
     s = gpl.probe_list[i]
     assert s == varlist[i]
     assert gpl.probe_idx_map[s] == i